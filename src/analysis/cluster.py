@@ -5,9 +5,26 @@ The following clustering algorithms are used:
     - K-Medoids
     - Agglomerative Clustering
     - Affinity Propagation
+
+Representatives are medoids (the member closest to all others), found
+without building the full distance matrix
+
+Agglomerative clustering and affinity propagation need the full distance
+matrix, so they are limited to a few thousand points. StreamingClusters
+fits Mini-Batch K-Means or BIRCH a chunk at a time instead, and is saved
+between runs so new posts refresh it without refitting
+
+CommunityStats keeps running aggregates of every community in the database,
+so centroids and approximate representatives never need a full scan
 """
 
-from sklearn.cluster import AffinityPropagation, AgglomerativeClustering, KMeans
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+from sklearn.cluster import AffinityPropagation, AgglomerativeClustering, Birch, KMeans, MiniBatchKMeans
 from sklearn_extra.cluster import KMedoids
 
 
@@ -39,26 +56,574 @@ def affinity_propagation(data):
     aff = AffinityPropagation().fit(data)
     return aff.labels_
 
-def get_representative(scores: dict):
+# Methods of StreamingClusters
+STREAMING_METHODS = ('minibatch', 'birch')
+
+class StreamingClusters():
+    """
+    Clusters of score vectors fitted one chunk at a time, so memory does not
+    grow with the data, and refreshed with new chunks instead of refitting
+
+    Attributes:
+        method: str
+            'minibatch' (Mini-Batch K-Means) or 'birch'
+        n_clusters: int
+            The number of clusters
+        threshold: float
+            Radius of the BIRCH subclusters
+        model: MiniBatchKMeans or Birch
+            The fitted estimator
+        seen: int
+            The number of points fitted so far
+    """
+    def __init__(self, method: str='minibatch', n_clusters: int=5, threshold: float=0.1,
+                 batch_size: int=1024, random_state: int=0) -> None:
+        """
+        Sets up an unfitted model
+
+        Args:
+            method: str
+                One of STREAMING_METHODS
+            n_clusters: int
+                The number of clusters
+            threshold: float
+                Radius of the BIRCH subclusters, smaller keeps more detail
+            batch_size: int
+                The number of points in each Mini-Batch K-Means step
+            random_state: int
+                Seed of the K-Means initialization
+        """
+        if method == 'minibatch':
+            self.model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, n_init=3,
+                                         random_state=random_state)
+        elif method == 'birch':
+            # Chunks only grow the tree of subclusters, they are grouped into
+            # n_clusters once in finish instead of after every chunk
+            self.model = Birch(threshold=threshold, n_clusters=None)
+        else:
+            raise ValueError(f"Unknown method {method}, expected one of {', '.join(STREAMING_METHODS)}")
+        self.method = method
+        self.n_clusters = n_clusters
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.seen = 0
+        self._centers = None # BIRCH centers, see measure
+        self._buffer = [] # every K-Means step needs n_clusters points, smaller chunks wait here
+
+    @property
+    def fitted(self) -> bool:
+        """
+        Whether the model has clusters to predict with
+        """
+        return hasattr(self.model, 'cluster_centers_') or hasattr(self.model, 'subcluster_labels_')
+
+    def partial_fit(self, data: np.ndarray) -> None:
+        """
+        Updates the model with a chunk of points
+        Points missing a score (NaN) are left out
+
+        Args:
+            data: np.ndarray
+                The points, one per row
+        """
+        data = np.asarray(data, dtype=float)
+        data = data[np.isfinite(data).all(axis=1)]
+        if len(data) == 0:
+            return
+        self.seen += len(data)
+
+        if self.method == 'birch':
+            self.model.set_params(n_clusters=None)
+            self.model.partial_fit(data)
+            self._centers = None
+            return
+
+        if self._buffer or len(data) < self.n_clusters:
+            self._buffer.append(data)
+            data = np.concatenate(self._buffer)
+            if len(data) < self.n_clusters:
+                return
+            self._buffer = []
+        for start in range(0, len(data), self.batch_size):
+            batch = data[start:start + self.batch_size]
+            # A short last batch joins the previous one, steps need n_clusters points
+            if len(data) - start - self.batch_size < self.n_clusters:
+                batch = data[start:]
+                self.model.partial_fit(batch)
+                break
+            self.model.partial_fit(batch)
+
+    def fit_batches(self, batches) -> 'StreamingClusters':
+        """
+        Updates the model with every chunk of a stream, then finishes it
+        BIRCH centers still have to be measured, see measure
+
+        Args:
+            batches: iterable
+                2-D arrays of points, such as the batches of Database.stream_data
+        Returns:
+            StreamingClusters
+                The model itself
+        """
+        for batch in batches:
+            self.partial_fit(batch)
+        self.finish()
+        return self
+
+    def finish(self) -> None:
+        """
+        Groups the BIRCH subclusters into the final clusters, nothing to do for K-Means
+        """
+        if self.method == 'birch' and self.seen:
+            self.model.set_params(n_clusters=self.n_clusters)
+            self.model.partial_fit()
+            self._centers = None
+
+    def predict(self, data: np.ndarray) -> np.ndarray:
+        """
+        Returns the cluster of every point
+        """
+        return self.model.predict(np.asarray(data, dtype=float))
+
+    def measure(self, batches) -> np.ndarray:
+        """
+        Computes the center of every BIRCH cluster as the mean of its points
+        Birch does not expose the number of points of its subclusters, so the centers
+        take one more pass over the points fitted, labelled with the public predict
+
+        Args:
+            batches: iterable
+                2-D arrays of every point fitted, such as the batches of Database.stream_data
+        Returns:
+            np.ndarray
+                The centers, also kept for centers
+        """
+        n_clusters = self.model.subcluster_labels_.max() + 1
+        sums = None
+        counts = np.zeros(n_clusters, dtype=np.int64)
+        for batch in batches:
+            data = np.asarray(batch, dtype=float)
+            data = data[np.isfinite(data).all(axis=1)]
+            if len(data) == 0:
+                continue
+            if sums is None:
+                sums = np.zeros((n_clusters, data.shape[1]))
+            labels = self.predict(data)
+            counts += np.bincount(labels, minlength=n_clusters)
+            np.add.at(sums, labels, data)
+        if sums is None:
+            self._centers = self.model.subcluster_centers_[:0]
+        else:
+            self._centers = sums[counts > 0] / counts[counts > 0, None]
+        return self._centers
+
+    @property
+    def centers(self) -> np.ndarray:
+        """
+        The center of every cluster, the mean of its points
+        BIRCH centers are only known once measured after the last chunk
+
+        Raises:
+            ValueError: The BIRCH centers were not measured since the model last changed
+        """
+        if self.method == 'minibatch':
+            return self.model.cluster_centers_
+        if getattr(self, '_centers', None) is None:
+            raise ValueError("BIRCH centers are not measured, see StreamingClusters.measure")
+        return self._centers
+
+    def save(self, path: str) -> None:
+        """
+        Writes the model to a file, replacing it only once it is fully written
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        joblib.dump(self, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load(path: str) -> 'StreamingClusters':
+        """
+        Reads a model written by save
+        """
+        return joblib.load(path)
+
+def distance_sums(points: np.ndarray, data: np.ndarray, chunk_size: int=1024) -> np.ndarray:
+    """
+    This function is used to sum the Euclidean distances from points to every row of data.
+    Only a (chunk_size, len(data)) block of distances is held at a time, and
+    chunk_size shrinks as data grows to keep that block bounded.
+    
+    Args:
+        points: np.ndarray
+            The points to sum the distances of
+        data: np.ndarray
+            The points to measure the distances to
+        chunk_size: int
+            The number of points handled at once
+    Returns:
+        sums: np.ndarray
+            The sum of the distances of every point
+    """
+    # Keep each block of distances to about 16M values (128MB)
+    chunk_size = max(1, min(chunk_size, (1 << 24) // max(1, len(data))))
+    squared = np.einsum('ij,ij->i', data, data)
+    sums = np.empty(len(points))
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        # |x - y|^2 = |x|^2 + |y|^2 - 2 x.y, one matrix product per chunk
+        distances = np.einsum('ij,ij->i', chunk, chunk)[:, None] + squared[None, :] - 2 * chunk @ data.T
+        sums[start:start + chunk_size] = np.sqrt(np.maximum(distances, 0)).sum(axis=1)
+    return sums
+
+def medoid(data: np.ndarray, chunk_size: int=1024) -> int:
+    """
+    This function is used to find the exact medoid of the data, the point with the
+    smallest sum of Euclidean distances to all others (as KMedoids with one cluster).
+    Only O(chunk_size * n) memory is used.
+    
+    Notes:
+        By the triangle inequality, the sum of distances from x is at least
+        n * |x - mean|. Points are tried from the closest to the mean, and the
+        search stops once that bound beats the best sum found, which usually
+        leaves a few chunks to evaluate instead of all n points
+    
+    Args:
+        data: np.ndarray
+            The points, one per row
+        chunk_size: int
+            The number of points handled at once
+    Returns:
+        index: int
+            The row of the medoid
+    """
+    bounds = len(data) * np.linalg.norm(data - data.mean(axis=0), axis=1)
+    order = np.argsort(bounds, kind='stable')
+
+    best, best_sum = order[0], np.inf
+    for start in range(0, len(order), chunk_size):
+        candidates = order[start:start + chunk_size]
+        if bounds[candidates[0]] >= best_sum:
+            break
+        sums = distance_sums(data[candidates], data, chunk_size)
+        if sums.min() < best_sum:
+            best, best_sum = candidates[np.argmin(sums)], sums.min()
+    return int(best)
+
+def approximate_medoid(data: np.ndarray, sample_size: int=2000, samples: int=5, random_state: int=0) -> int:
     """
-    This function is used to find the representative of a cluster using K-Medoids.
+    This function is used to approximate the medoid of large data (CLARA).
+    The exact medoid of every random sample is a candidate, and the candidate
+    with the smallest sum of distances over all of the data wins.
+    Takes O(samples * sample_size^2 + n) time at most.
     
     Args:
-        data: dict
+        data: np.ndarray
+            The points, one per row
+        sample_size: int
+            The number of points per sample
+        samples: int
+            The number of samples drawn
+        random_state: int
+            Seed of the sampling
+    Returns:
+        index: int
+            The row of the approximate medoid
+    """
+    if len(data) <= sample_size:
+        return medoid(data)
+
+    generator = np.random.default_rng(random_state)
+    candidates = np.unique([
+        sample[medoid(data[sample])]
+        for sample in (generator.choice(len(data), sample_size, replace=False) for _ in range(samples))
+    ])
+    return int(candidates[np.argmin(distance_sums(data[candidates], data))])
+
+def representative_index(data: np.ndarray, exact_limit: int=20000):
+    """
+    This function is used to find the row of the medoid of a cluster.
+    Rows missing a score (NaN) are left out.
+    
+    Args:
+        data: np.ndarray
+            The scores, one post per row
+        exact_limit: int
+            Largest cluster whose medoid is computed exactly, larger ones are approximated
+    Returns:
+        index: int
+            The row of the representative, None for an empty cluster
+    """
+    rows = np.flatnonzero(np.isfinite(data).all(axis=1))
+    if len(rows) == 0:
+        return None
+    
+    if len(rows) <= exact_limit:
+        index = medoid(data[rows])
+    else:
+        index = approximate_medoid(data[rows])
+    return int(rows[index])
+
+def get_representative(scores: dict, exact_limit: int=20000):
+    """
+    This function is used to find the representative of a cluster, its medoid.
+    Posts missing a score are left out.
+    
+    Args:
+        scores: dict
             Data with postID and toxicity scores
+        exact_limit: int
+            Largest cluster whose medoid is computed exactly, larger ones are approximated
     Returns:
-        representative: dict
-            The representative of the cluster
+        representative: tuple
+            The postID and scores of the representative, None for an empty cluster
     """
     # unpack the data
-    data = [i for i in scores.values()]
+    keys = list(scores.keys())
+    data = np.array([scores[key] for key in keys], dtype=float)
+    if data.ndim == 1:
+        data = data.reshape(len(keys), -1)
     
-    kmedoids = KMedoids(n_clusters=1, random_state=0).fit(data)
-    res = kmedoids.cluster_centers_[0]
+    index = representative_index(data, exact_limit)
+    if index is None:
+        return None
+    key = keys[index]
+    return key, scores[key]
+
+def _community_representative(community: str, keys: np.ndarray, data: np.ndarray, exact_limit: int):
+    """
+    Finds the representative of one community, run in a worker process
+    """
+    index = representative_index(data, exact_limit)
+    if index is None:
+        return community, None
+    return community, (int(keys[index]), data[index].tolist())
+
+def get_representatives(groups: dict, workers: int=None, exact_limit: int=20000):
+    """
+    This function is used to find the representative of many clusters at once,
+    one cluster per process.
     
-    for key, value in scores.items():
-        if (value == res).all():
-            return key, value
+    Args:
+        groups: dict
+            Cluster to a (keys, data) pair of arrays, the postIDs and their scores
+        workers: int
+            The number of processes, defaults to the number of cores
+        exact_limit: int
+            Largest cluster whose medoid is computed exactly, larger ones are approximated
+    Yields:
+        tuple
+            (cluster, representative) as each cluster finishes, representative
+            being the postID and scores, None for an empty cluster
+    """
+    if workers == 1 or len(groups) < 2:
+        for community, (keys, data) in groups.items():
+            yield _community_representative(community, keys, data, exact_limit)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # The largest clusters go first so they do not finish last on their own
+        futures = [
+            executor.submit(_community_representative, community, keys, data, exact_limit)
+            for community, (keys, data) in sorted(groups.items(), key=lambda group: -len(group[1][0]))
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+# Candidate medoids kept per community by CommunityStats
+CANDIDATES = 256
+
+class CommunityStats():
+    """
+    Running aggregates of the scores of every community, updated as posts are scored
+    Adding a post costs O(1), whatever the size of its community
+
+    The aggregates live in the database:
+        - community_stats: number of posts, sums and sums of squares of the scores
+        - community_candidates: a uniform sample (reservoir) of the posts, the candidate medoids
+        - cluster_fitted: postID of every post counted, under the model 'community',
+          and a marker row (model 'community-initialized') once every scored post was counted
+
+    Attributes:
+        database: Database
+            The database holding the aggregates
+        columns: list
+            The score columns aggregated
+        candidates: int
+            The number of candidate medoids kept per community
+    """
+    MODEL = 'community'
+    INITIALIZED = 'community-initialized'
+
+    def __init__(self, database, columns: list=('toxicity_score', 'insult_score', 'threat_score', 'sexually_explicit_score'),
+                 candidates: int=CANDIDATES, random_state: int=None) -> None:
+        """
+        Sets up the aggregates
+
+        Args:
+            database: Database
+                The database holding the aggregate tables
+            columns: list
+                The score columns aggregated
+            candidates: int
+                The number of candidate medoids kept per community
+            random_state: int
+                Seed of the reservoir sampling
+        """
+        self.database = database
+        self.columns = list(columns)
+        self.candidates = candidates
+        self._random = random.Random(random_state)
+
+    def _load(self, communities: list) -> dict:
+        """
+        Reads the aggregates of some communities
+
+        Returns:
+            dict
+                Community to [count, sums, squares], missing communities are left out
+        """
+        rows = self.database.select_data(
+            'community, count, sums, squares',
+            'community_stats',
+            f"community IN ({', '.join('?' for _ in communities)})",
+            tuple(communities)) or []
+        return {
+            community: [count, np.frombuffer(sums).copy(), np.frombuffer(squares).copy()]
+            for community, count, sums, squares in rows
+        }
+
+    def add(self, rows: list) -> None:
+        """
+        Counts a batch of scored posts in the aggregates of their communities
+        The caller commits, and makes sure no post is added twice (see refresh)
+
+        Args:
+            rows: list
+                (community, postID, *scores) rows, scores in the order of columns
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[0], []).append(row)
+        stats = self._load(list(groups))
+
+        candidates = []
+        for community, members in groups.items():
+            count, sums, squares = stats.get(community, [0, np.zeros(len(self.columns)), np.zeros(len(self.columns))])
+            data = np.array([row[2:] for row in members], dtype=float)
+            sums += data.sum(axis=0)
+            squares += (data ** 2).sum(axis=0)
+
+            # Reservoir sampling: the n-th post replaces a random candidate with probability candidates / n,
+            # so the candidates stay a uniform sample of the community
+            for row, scores in zip(members, data):
+                count += 1
+                slot = count - 1 if count <= self.candidates else self._random.randrange(count)
+                if slot < self.candidates:
+                    candidates.append((community, slot, row[1], scores.tobytes()))
+            stats[community] = [count, sums, squares]
+
+        self.database.insert_many(
+            'community_stats',
+            ['community', 'count', 'sums', 'squares'],
+            [(community, count, sums.tobytes(), squares.tobytes())
+             for community, (count, sums, squares) in stats.items() if community in groups],
+            on_conflict='replace')
+        # A slot replaced twice in the batch keeps the later post, as insert or replace applies in order
+        self.database.insert_many(
+            'community_candidates',
+            ['community', 'slot', 'postID', 'scores'],
+            candidates,
+            on_conflict='replace')
+
+    def initialized(self) -> bool:
+        """
+        Whether the aggregates count every post scored before they were first refreshed
+
+        Returns:
+            bool
+                True once a full refresh was done
+        """
+        return bool(self.database.select_data(
+            'postID', 'cluster_fitted', 'model = ?', (self.INITIALIZED,)))
+
+    def refresh(self, post_ids: list=None, batch_size: int=10000) -> int:
+        """
+        Adds every scored post that is not counted yet, duplicates left out
+        The caller commits
+
+        Args:
+            post_ids: list
+                Only look at these posts, such as a chunk that was just scored.
+                Ignored until the aggregates are initialized, the first refresh counts every scored post
+            batch_size: int
+                The number of posts read at once
+        Returns:
+            int
+                The number of posts added
+        """
+        if post_ids is not None and not self.initialized():
+            post_ids = None
+        if post_ids is not None and len(post_ids) == 0:
+            return 0
+        new_rows = (
+            ' AND '.join(f"{column} IS NOT NULL" for column in self.columns) + ' '
+            'AND postID NOT IN (SELECT postID FROM duplicates) '
+            'AND NOT EXISTS (SELECT 1 FROM cluster_fitted '
+            'WHERE cluster_fitted.model = ? AND cluster_fitted.postID = processed.postID)'
+        )
+        params = (self.MODEL,)
+        if post_ids is not None:
+            new_rows += f" AND postID IN ({', '.join('?' for _ in post_ids)})"
+            params += tuple(post_ids)
+
+        added = 0
+        # Paged by postID, so the counted posts are recorded while reading
+        for batch in self.database.stream_data(
+                ['community', 'postID'] + self.columns, 'processed', new_rows, params,
+                batch_size=batch_size, key_column='postID'):
+            self.add(batch)
+            self.database.insert_many('cluster_fitted', ['model', 'postID'], [(self.MODEL, row[1]) for row in batch])
+            added += len(batch)
+        if post_ids is None:
+            self.database.insert_many('cluster_fitted', ['model', 'postID'], [(self.INITIALIZED, 0)],
+                                      on_conflict='ignore')
+        return added
+
+    def summary(self) -> dict:
+        """
+        Returns the number of posts, the centroid and the standard deviation of every community
+        Read from the aggregates alone
+
+        Returns:
+            dict
+                Community to (count, mean, std), mean and std being arrays in the order of columns
+        """
+        summary = {}
+        for community, count, sums, squares in self.database.select_data(
+                'community, count, sums, squares', 'community_stats') or []:
+            mean = np.frombuffer(sums) / count
+            variance = np.maximum(np.frombuffer(squares) / count - mean ** 2, 0)
+            summary[community] = (count, mean, np.sqrt(variance))
+        return summary
+
+    def representatives(self) -> dict:
+        """
+        Returns the approximate representative of every community, the medoid of its candidates
+
+        Returns:
+            dict
+                Community to the postID and scores of its representative
+        """
+        groups = {}
+        for community, post_id, scores in self.database.select_data(
+                'community, postID, scores', 'community_candidates') or []:
+            groups.setdefault(community, []).append((post_id, np.frombuffer(scores)))
+
+        representatives = {}
+        for community, members in groups.items():
+            index = medoid(np.array([scores for _, scores in members]))
+            representatives[community] = (members[index][0], members[index][1].tolist())
+        return representatives
 
 if __name__ == "__main__":
     import numpy as np
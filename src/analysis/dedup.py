@@ -0,0 +1,216 @@
+"""
+This module is used to find near-duplicate posts (retweets, copy-paste
+campaigns, bot spam) without comparing every pair of posts
+
+Every post gets a MinHash signature of its set of words. The signature is
+cut into bands, and posts sharing a band bucket are candidates (LSH), so
+only candidates are compared. Candidates whose estimated Jaccard
+similarity reaches the threshold are duplicates of the first such post
+seen, the canonical post of the group.
+
+The index lives in the database:
+    - minhash: signature of every canonical post
+    - minhash_bands: band buckets of every canonical post
+    - duplicates: postID of every duplicate, with its canonical postID
+"""
+
+import zlib
+
+import numpy as np
+
+NUM_PERM = 64       # hash functions per signature
+BANDS = 16          # bands of NUM_PERM / BANDS rows, candidates from about 0.5 similarity
+THRESHOLD = 0.8     # estimated Jaccard similarity needed to be a duplicate
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Fixed seed, signatures are stored and must stay comparable between runs
+_generator = np.random.RandomState(1)
+_A = _generator.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_B = _generator.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_BAND_MULTIPLIERS = _generator.randint(1, 1 << 62, size=NUM_PERM // BANDS, dtype=np.uint64) | np.uint64(1)
+
+
+def shingles(text: str) -> set:
+    """
+    Returns the set of words compared between posts
+
+    Args:
+        text (str):
+            The cleaned text of a post
+    Returns:
+        The lower case words of the text
+    """
+    return set(text.lower().split())
+
+def minhash_many(texts: list, chunk_size: int=1000) -> np.ndarray:
+    """
+    Computes the MinHash signatures of a list of texts at once
+
+    Args:
+        texts (list):
+            The texts to sign
+        chunk_size (int):
+            The number of texts hashed together, bounds the memory used
+    Returns:
+        A (len(texts), NUM_PERM) uint32 array, texts without words get a row of the max hash
+    """
+    signatures = np.full((len(texts), NUM_PERM), _MAX_HASH, dtype=np.uint64)
+
+    for start in range(0, len(texts), chunk_size):
+        hashes = []
+        rows = []
+        offsets = []
+        for row, text in enumerate(texts[start:start + chunk_size], start):
+            words = shingles(text)
+            if words:
+                offsets.append(len(hashes))
+                rows.append(row)
+                hashes.extend(zlib.crc32(word.encode("utf-8")) for word in words)
+        if not hashes:
+            continue
+
+        # Every word under every permutation, then the minimum of each text's words
+        values = np.array(hashes, dtype=np.uint64)[:, None]
+        permuted = ((values * _A + _B) % _MERSENNE_PRIME) & _MAX_HASH
+        signatures[rows] = np.minimum.reduceat(permuted, offsets, axis=0)
+
+    return signatures.astype(np.uint32)
+
+def band_keys(signatures: np.ndarray) -> np.ndarray:
+    """
+    Hashes every band of the signatures into a bucket
+
+    Args:
+        signatures (np.ndarray):
+            Signatures from minhash_many
+    Returns:
+        A (len(signatures), BANDS) int64 array of buckets
+    """
+    bands = signatures.astype(np.uint64).reshape(len(signatures), BANDS, NUM_PERM // BANDS)
+    with np.errstate(over='ignore'):
+        keys = (bands * _BAND_MULTIPLIERS).sum(axis=2, dtype=np.uint64)
+    return keys.view(np.int64)
+
+def similarity(signature1: np.ndarray, signature2: np.ndarray) -> float:
+    """
+    Estimates the Jaccard similarity of two posts from their signatures
+    """
+    return float(np.mean(signature1 == signature2))
+
+
+class DuplicateIndex():
+    """
+    LSH index of the posts of the database, grouping near-duplicates
+    Posts are only compared within their community
+
+    Attributes:
+        database: Database
+            The database holding the index tables
+        threshold: float
+            Estimated Jaccard similarity needed to be a duplicate
+    """
+    def __init__(self, database, threshold: float=THRESHOLD) -> None:
+        """
+        Sets up the index
+
+        Args:
+            database: Database
+                The database holding the index tables
+            threshold: float
+                Estimated Jaccard similarity needed to be a duplicate
+        """
+        self.database = database
+        self.threshold = threshold
+        database.create_table("temp.lsh_batch", "row int, band int, bucket int", if_not_exists=True)
+
+    def _candidates(self, community: str, keys: np.ndarray) -> dict:
+        """
+        Finds the indexed posts sharing a bucket with each post of a batch
+
+        Args:
+            community: str
+                The community of the batch
+            keys: np.ndarray
+                The band keys of the batch
+        Returns:
+            dict
+                Row of the batch to {postID: signature} of its candidates
+        """
+        self.database.clear_table("temp.lsh_batch")
+        self.database.insert_many(
+            "temp.lsh_batch",
+            ["row", "band", "bucket"],
+            [(row, band, int(bucket)) for row, buckets in enumerate(keys) for band, bucket in enumerate(buckets)])
+        # CROSS JOIN keeps the batch as the outer loop, every bucket is then one index lookup
+        matches = self.database.select_data(
+            "DISTINCT lsh_batch.row, minhash.postID, minhash.signature",
+            "temp.lsh_batch "
+            "CROSS JOIN minhash_bands ON minhash_bands.band = lsh_batch.band AND minhash_bands.bucket = lsh_batch.bucket "
+            "JOIN minhash ON minhash.postID = minhash_bands.postID",
+            "minhash_bands.community = ?",
+            (community,)
+        ) or []
+
+        candidates = {}
+        for row, post_id, signature in matches:
+            candidates.setdefault(row, {})[post_id] = np.frombuffer(signature, dtype=np.uint32)
+        return candidates
+
+    def add(self, community: str, rows: list) -> int:
+        """
+        Indexes a batch of posts, recording the ones that duplicate an indexed post
+        The caller commits
+
+        Args:
+            community: str
+                The community of the posts
+            rows: list
+                (postID, cleaned text) rows
+        Returns:
+            int
+                The number of posts found to be duplicates
+        """
+        rows = [row for row in rows if shingles(row[1])]
+        if not rows:
+            return 0
+        signatures = minhash_many([row[1] for row in rows])
+        keys = band_keys(signatures)
+        candidates = self._candidates(community, keys)
+
+        # Posts of the batch are also compared with the batch's earlier canonical posts
+        batch_buckets = {}
+        canonical = []
+        duplicates = []
+        for row, (post_id, _) in enumerate(rows):
+            found = dict(candidates.get(row, {}))
+            for band, bucket in enumerate(keys[row]):
+                for other in batch_buckets.get((band, int(bucket)), ()):
+                    found[rows[other][0]] = signatures[other]
+
+            best = max(((similarity(signatures[row], signature), other_id)
+                        for other_id, signature in found.items() if other_id != post_id), default=None)
+            if best and best[0] >= self.threshold:
+                duplicates.append((post_id, best[1], best[0]))
+                continue
+
+            canonical.append(row)
+            for band, bucket in enumerate(keys[row]):
+                batch_buckets.setdefault((band, int(bucket)), []).append(row)
+
+        self.database.insert_many(
+            "minhash",
+            ["postID", "community", "signature"],
+            [(rows[row][0], community, signatures[row].tobytes()) for row in canonical],
+            on_conflict="replace")
+        self.database.insert_many(
+            "minhash_bands",
+            ["community", "band", "bucket", "postID"],
+            [(community, band, int(bucket), rows[row][0]) for row in canonical for band, bucket in enumerate(keys[row])])
+        self.database.insert_many(
+            "duplicates",
+            ["postID", "canonicalID", "similarity"],
+            duplicates,
+            on_conflict="replace")
+        return len(duplicates)
@@ -1,7 +1,16 @@
 """
 Uses distance measure to measure the distance between two vectors
+
+Pairwise distances between any number of vectors (community representatives
+or centroids) are computed at once with NumPy. The matrix is symmetric with a
+zero diagonal, so only its upper triangle needs to be stored (see condensed).
 """
 
+import numpy as np
+
+# Metrics supported by pairwise_distances
+METRICS = ('euclidean', 'manhattan', 'cosine', 'mahalanobis')
+
 def euclidean_distance(value1, value2):
     """
     Calculates the Euclidean Distance between two values
@@ -11,11 +20,103 @@ def euclidean_distance(value1, value2):
 def get_distance(vector1, vector2):
     """
     Calculates the distance between two vectors
+    This is the Manhattan Distance (sum of the absolute differences),
+    see pairwise_distances for the other metrics
+    """
+    return float(pairwise_distances([vector1, vector2], 'manhattan')[0, 1])
+
+def _whiten(vectors: np.ndarray, covariance: np.ndarray) -> np.ndarray:
+    """
+    Maps vectors so that Euclidean distances between them are Mahalanobis distances
+    The pseudo-inverse keeps a singular covariance (e.g. a constant score) usable
+    """
+    values, vectors_basis = np.linalg.eigh(np.linalg.pinv(covariance))
+    return vectors @ (vectors_basis * np.sqrt(np.maximum(values, 0)))
+
+def pairwise_distances(vectors, metric: str='euclidean', covariance=None, chunk_size: int=256) -> np.ndarray:
+    """
+    Calculates the distance between every pair of vectors
+
+    Args:
+        vectors: array-like
+            The vectors, one per row
+        metric: str
+            One of METRICS
+        covariance: array-like
+            Covariance used by 'mahalanobis', defaults to the covariance of the vectors
+        chunk_size: int
+            Number of rows handled at once by 'manhattan', bounds its memory
+    Returns:
+        np.ndarray
+            The (n, n) symmetric distance matrix
+    """
+    vectors = np.asarray(vectors, dtype=float)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(-1, 1)
+
+    if metric == 'mahalanobis':
+        if covariance is None:
+            covariance = np.cov(vectors, rowvar=False)
+        vectors = _whiten(vectors, np.atleast_2d(covariance))
+        metric = 'euclidean'
+
+    if metric == 'euclidean':
+        squared = np.einsum('ij,ij->i', vectors, vectors)
+        distances = np.sqrt(np.maximum(squared[:, None] + squared[None, :] - 2 * vectors @ vectors.T, 0))
+    elif metric == 'manhattan':
+        distances = np.empty((len(vectors), len(vectors)))
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            distances[start:start + chunk_size] = np.abs(chunk[:, None, :] - vectors[None, :, :]).sum(axis=2)
+    elif metric == 'cosine':
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1 # a zero vector is not similar to anything
+        unit = vectors / norms[:, None]
+        distances = np.clip(1 - unit @ unit.T, 0, 2)
+    else:
+        raise ValueError(f"Unknown metric {metric}, expected one of {', '.join(METRICS)}")
+
+    np.fill_diagonal(distances, 0)
+    return distances
+
+def streamed_covariance(batches) -> np.ndarray:
+    """
+    Calculates the covariance of data read in batches, without holding all of it
+    Rows with a missing value (NaN) are left out
+
+    Args:
+        batches: iterable
+            2-D arrays of vectors
+    Returns:
+        np.ndarray
+            The covariance matrix, None if fewer than two rows were read
+    """
+    count, total, products = 0, 0, 0
+    for batch in batches:
+        batch = np.asarray(batch, dtype=float)
+        batch = batch[np.isfinite(batch).all(axis=1)]
+        count += len(batch)
+        total = total + batch.sum(axis=0)
+        products = products + batch.T @ batch
+    if count < 2:
+        return None
+    mean = total / count
+    return (products - count * np.outer(mean, mean)) / (count - 1)
+
+def condensed(distances: np.ndarray) -> tuple:
+    """
+    Keeps the upper triangle of a distance matrix, n * (n - 1) / 2 values
+
+    Args:
+        distances: np.ndarray
+            A symmetric distance matrix
+    Returns:
+        tuple
+            The row indices, column indices and distances of every pair i < j
     """
-    distance = 0
-    for i in range(len(vector1)):
-        distance += euclidean_distance(vector1[i], vector2[i])
-    return distance
+    rows, columns = np.triu_indices(len(distances), 1)
+    return rows, columns, distances[rows, columns]
 
 if __name__ == '__main__':
     print(euclidean_distance(1, 10))
+    print(pairwise_distances([[0, 0], [3, 4], [1, 1]]))
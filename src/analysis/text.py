@@ -9,9 +9,12 @@ The following distance measure for pieces of text will be used:
     - Etc
 
 These will analyze how close two pieces of text are to each other
+The pairwise functions compare two texts, the matrix functions compare whole
+corpora at once through a sparse term matrix built once per corpus
 """
 
-from nltk.metrics import distance
+import numpy as np
+from scipy import sparse
 
 def jaccard_distance(text1: str, text2: str) -> float:
     """
@@ -32,7 +35,76 @@ def jaccard_distance(text1: str, text2: str) -> float:
     # Calculate the Jaccard Distance
     return len(text1.intersection(text2)) / len(text1.union(text2))
 
-def levenshtein_distance(text1: str, text2: str) -> int:
+def _pattern_masks(text: str) -> dict:
+    """
+    Returns the bit mask of the positions of every character of text
+    """
+    masks = {}
+    for position, character in enumerate(text):
+        masks[character] = masks.get(character, 0) | (1 << position)
+    return masks
+
+def _bit_parallel_distance(text1: str, masks: dict, text2: str, max_distance: int=None) -> int:
+    """
+    Levenshtein Distance computed a whole column of the DP table at a time
+
+    Notes:
+        Myers' bit-vector algorithm (Hyyro's edit distance variant): the vertical
+        differences of a column of the table are kept in two bit vectors, so every
+        character of text2 costs a few integer operations instead of len(text1) cells
+
+    Args:
+        text1 (str):
+            The first piece of text, the one masks were made from
+        masks (dict):
+            _pattern_masks of text1
+        text2 (str):
+            The second piece of text
+        max_distance (int):
+            Give up once the distance is known to exceed it
+    Returns:
+        The Levenshtein Distance, or max_distance + 1 past the cutoff
+    """
+    length = len(text1)
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    positive, negative = full, 0
+    score = length
+
+    for index, character in enumerate(text2):
+        equal = masks.get(character, 0)
+        vertical = equal | negative
+        horizontal = ((((equal & positive) + positive) ^ positive) | equal) & full
+        horizontal_positive = negative | (~(horizontal | positive) & full)
+        horizontal_negative = positive & horizontal
+        if horizontal_positive & last:
+            score += 1
+        elif horizontal_negative & last:
+            score -= 1
+        # Every remaining character lowers the score by at most one
+        if max_distance is not None and score - (len(text2) - index - 1) > max_distance:
+            return max_distance + 1
+        horizontal_positive = ((horizontal_positive << 1) | 1) & full
+        horizontal_negative = (horizontal_negative << 1) & full
+        positive = horizontal_negative | (~(vertical | horizontal_positive) & full)
+        negative = horizontal_positive & vertical
+
+    return score
+
+def _trim(text1: str, text2: str) -> tuple:
+    """
+    Removes the prefix and suffix both texts share, they never add to the distance
+    """
+    start = 0
+    shortest = min(len(text1), len(text2))
+    while start < shortest and text1[start] == text2[start]:
+        start += 1
+    end = 0
+    while end < shortest - start and text1[-1 - end] == text2[-1 - end]:
+        end += 1
+    return text1[start:len(text1) - end], text2[start:len(text2) - end]
+
+def levenshtein_distance(text1: str, text2: str, max_distance: int=None) -> int:
     """
     Returns the Levenshtein Distance between two pieces of text
     
@@ -45,10 +117,55 @@ def levenshtein_distance(text1: str, text2: str) -> int:
             The first piece of text to be compared
         text2 (str):
             The second piece of text to be compared
+        max_distance (int):
+            Only distances up to this matter, larger ones are cut off early.
+            None for the exact distance
+    Returns:
+        The Levenshtein Distance between the two pieces of text,
+        max_distance + 1 if it is larger than max_distance
+    """
+    # The length difference is a lower bound of the distance
+    if max_distance is not None and abs(len(text1) - len(text2)) > max_distance:
+        return max_distance + 1
+
+    text1, text2 = _trim(text1, text2)
+    if not text1 or not text2:
+        distance = len(text1) + len(text2)
+        return distance if max_distance is None else min(distance, max_distance + 1)
+
+    # The shorter text makes the smaller bit vectors
+    if len(text1) > len(text2):
+        text1, text2 = text2, text1
+    return _bit_parallel_distance(text1, _pattern_masks(text1), text2, max_distance)
+
+def levenshtein_many(text: str, others: list, max_distance: int=None) -> list:
+    """
+    Returns the Levenshtein Distance between a piece of text and many others
+    The bit masks of text are only built once
+
+    Args:
+        text (str):
+            The piece of text to compare
+        others (list):
+            The pieces of text to compare it to
+        max_distance (int):
+            See levenshtein_distance
     Returns:
-        The Levenshtein Distance between the two pieces of text
+        The distances, in the same order as others
     """
-    return distance.edit_distance(text1, text2)
+    if not text:
+        return [len(other) if max_distance is None else min(len(other), max_distance + 1) for other in others]
+
+    masks = _pattern_masks(text)
+    distances = []
+    for other in others:
+        if max_distance is not None and abs(len(text) - len(other)) > max_distance:
+            distances.append(max_distance + 1)
+        elif not other:
+            distances.append(len(text) if max_distance is None else min(len(text), max_distance + 1))
+        else:
+            distances.append(_bit_parallel_distance(text, masks, other, max_distance))
+    return distances
 
 def cosine_similarity(text1: str, text2: str) -> float:
     """
@@ -68,3 +185,129 @@ def cosine_similarity(text1: str, text2: str) -> float:
 
     # Calculate the cosine similarity
     return len(text1.intersection(text2)) / (len(text1) * len(text2)) ** 0.5
+
+def term_matrix(texts: list, vocabulary: dict=None):
+    """
+    Builds the binary term matrix of a corpus, tokenized like the pairwise functions
+
+    Args:
+        texts (list):
+            The texts of the corpus
+        vocabulary (dict):
+            Term to column of an existing matrix, terms outside of it are
+            ignored. None to build the vocabulary from the texts
+    Returns:
+        The (len(texts), len(vocabulary)) CSR matrix, 1 where a text has a term,
+        and the vocabulary
+    """
+    grow = vocabulary is None
+    if grow:
+        vocabulary = {}
+
+    indptr = [0]
+    indices = []
+    for text in texts:
+        for term in set(text.split()):
+            column = vocabulary.setdefault(term, len(vocabulary)) if grow else vocabulary.get(term)
+            if column is not None:
+                indices.append(column)
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+        shape=(len(texts), len(vocabulary)))
+    return matrix, vocabulary
+
+def _similarities(intersections, row_sizes: np.ndarray, column_sizes: np.ndarray, metric: str):
+    """
+    Turns a sparse matrix of shared term counts into similarities
+
+    Args:
+        intersections:
+            CSR matrix of the number of terms shared by every pair of texts
+        row_sizes (np.ndarray):
+            Number of terms of the texts of the rows
+        column_sizes (np.ndarray):
+            Number of terms of the texts of the columns
+        metric (str):
+            'cosine' (see cosine_similarity) or 'jaccard' (see jaccard_distance)
+    Returns:
+        A CSR matrix of similarities, pairs sharing no term are left out
+    """
+    intersections = intersections.tocoo()
+    shared = intersections.data
+    rows = row_sizes[intersections.row]
+    columns = column_sizes[intersections.col]
+    if metric == 'cosine':
+        values = shared / np.sqrt(rows * columns)
+    elif metric == 'jaccard':
+        values = shared / (rows + columns - shared)
+    else:
+        raise ValueError(f"Unknown metric: {metric}")
+    return sparse.csr_matrix((values, (intersections.row, intersections.col)), shape=intersections.shape)
+
+def similarity_blocks(texts: list, others: list=None, metric: str='cosine', chunk_size: int=1000):
+    """
+    Computes the similarity of every pair of texts, a block of rows at a time
+    Only one block is in memory at a time, and blocks are sparse
+
+    Args:
+        texts (list):
+            The texts of the rows
+        others (list):
+            The texts of the columns, None to compare texts with themselves
+        metric (str):
+            'cosine' (see cosine_similarity) or 'jaccard' (see jaccard_distance)
+        chunk_size (int):
+            The number of rows per block
+    Yields:
+        The index of the block's first row and the (rows, len(others)) CSR
+        block of similarities, pairs sharing no term are left out
+    """
+    matrix, vocabulary = term_matrix(texts)
+    other_matrix = matrix if others is None else term_matrix(others, vocabulary)[0]
+    other_t = other_matrix.T.tocsr()
+    sizes = np.diff(matrix.indptr)
+    # Terms of others missing from texts are not in the matrix, but still count towards the union
+    other_sizes = sizes if others is None else np.array([len(set(text.split())) for text in others])
+
+    for start in range(0, matrix.shape[0], chunk_size):
+        intersections = matrix[start:start + chunk_size] @ other_t
+        yield start, _similarities(intersections, sizes[start:start + chunk_size], other_sizes, metric)
+
+def top_k_similar(texts: list, others: list=None, k: int=10, metric: str='cosine', chunk_size: int=1000):
+    """
+    Finds the k most similar texts of every text
+
+    Args:
+        texts (list):
+            The texts to find neighbours for
+        others (list):
+            The texts to search, None to search texts itself (a text is not its own neighbour)
+        k (int):
+            The number of neighbours
+        metric (str):
+            'cosine' (see cosine_similarity) or 'jaccard' (see jaccard_distance)
+        chunk_size (int):
+            The number of texts handled at once
+    Returns:
+        A (len(texts), k) array of neighbour indices, most similar first and -1
+        when fewer than k texts share a term, and the matching array of similarities
+    """
+    neighbours = np.full((len(texts), k), -1, dtype=np.int64)
+    scores = np.zeros((len(texts), k), dtype=np.float64)
+
+    for start, block in similarity_blocks(texts, others, metric, chunk_size):
+        for row in range(block.shape[0]):
+            data = block.data[block.indptr[row]:block.indptr[row + 1]]
+            columns = block.indices[block.indptr[row]:block.indptr[row + 1]]
+            if others is None:
+                data, columns = data[columns != start + row], columns[columns != start + row]
+            if len(data) > k:
+                best = np.argpartition(-data, k - 1)[:k]
+                data, columns = data[best], columns[best]
+            order = np.lexsort((columns, -data))
+            neighbours[start + row, :len(order)] = columns[order]
+            scores[start + row, :len(order)] = data[order]
+
+    return neighbours, scores
@@ -0,0 +1,89 @@
+"""
+This module contains the readers for archived posts
+
+Archives are newline delimited JSON files (one post per line), either plain,
+gzip (.gz) or zstandard (.zst) compressed, such as Twitter API dumps or
+Pushshift Reddit dumps. They are read line by line, so memory use does
+not depend on the size of the archive.
+"""
+
+import gzip
+import io
+import logging
+
+# Optional dependency, parses JSON a few times faster than the standard library
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+
+def open_archive(path: str):
+    """
+    Opens an archive for reading text, decompressing it on the fly
+
+    Args:
+        path: str
+            Path to the archive, compression is picked from the extension
+    Returns:
+        A text file object
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        # Optional dependency, only needed for zstandard archives
+        try:
+            import zstandard
+        except ImportError as err:
+            raise ImportError("Reading .zst archives requires the zstandard package") from err
+        # Pushshift dumps are compressed with a long window
+        reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+def read_archive(path: str):
+    """
+    Reads the posts of an archive
+
+    Args:
+        path: str
+            Path to the archive
+    Yields:
+        dict
+            The next post, lines that are not valid JSON are skipped
+    """
+    skipped = 0
+    with open_archive(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                yield loads(line)
+            except ValueError:
+                skipped += 1
+    if skipped:
+        logging.warning(f"Skipped {skipped} malformed lines in {path}")
+
+def read_records(posts, schema):
+    """
+    Turns archived posts into records
+
+    Args:
+        posts: iterable
+            The posts, such as the output of read_archive
+        schema: function
+            Turns a post into a record, or None for posts that are not kept
+    Yields:
+        The next record, posts that cannot be turned into one are skipped
+    """
+    skipped = 0
+    for post in posts:
+        try:
+            record = schema(post)
+        except (KeyError, ValueError, TypeError, AttributeError):
+            skipped += 1
+            continue
+        if record is not None:
+            yield record
+    if skipped:
+        logging.warning(f"Skipped {skipped} malformed posts")
@@ -0,0 +1,80 @@
+"""
+This module contains the schema of archived Reddit posts
+
+Reddit has no free bulk API, so posts come from archives
+(such as the Pushshift dumps) read by collection.archive
+
+Reddit ids are base 36, and comments and submissions each count from 0,
+so they would collide with each other and with tweet ids once converted.
+Reddit posts are stored under negative ids, which keep the kind of post
+(see post_id and fullname), and never meet the positive tweet ids.
+"""
+
+from datetime import datetime, timezone
+
+from collection.twitter import TweetRecord
+
+# Kind prefix of Reddit fullnames to the number stored in post ids
+KINDS = {'t1': 1, 't2': 2, 't3': 3} # comment, account, submission
+_KIND_BITS = 2
+
+def post_id(kind: str, reddit_id: str) -> int:
+    """
+    Turns a Reddit id into the id it is stored under
+
+    Args:
+        kind: str
+            The kind prefix, e.g. 't3' for a submission
+        reddit_id: str
+            The base 36 id, e.g. 'abc12'
+    Returns:
+        int
+            A negative id, unique across kinds of post and sources
+    """
+    return -((int(reddit_id, 36) << _KIND_BITS) | KINDS[kind])
+
+def fullname(stored_id: int) -> str:
+    """
+    Turns a stored id back into the Reddit fullname, e.g. 't3_abc12'
+    """
+    value = -stored_id
+    kind = next(kind for kind, number in KINDS.items() if number == value & ((1 << _KIND_BITS) - 1))
+    value >>= _KIND_BITS
+    digits = ''
+    while True:
+        value, digit = divmod(value, 36)
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'[digit] + digits
+        if value == 0:
+            return f"{kind}_{digits}"
+
+def from_archive(post: dict) -> TweetRecord:
+    """
+    Turns an archived comment or submission into a record
+    Same fields as a tweet, so both are stored alike, lang is always None
+
+    Args:
+        post: dict
+            The post, as one line of an archive
+    Returns:
+        TweetRecord, None if the post has no id or text, or was deleted
+    Raises:
+        ValueError, KeyError, TypeError: The post is malformed
+    """
+    if "body" in post:
+        kind = 't1'
+        text = post["body"]
+    else:
+        kind = 't3'
+        text = '\n'.join(part for part in (post.get("title"), post.get("selftext")) if part)
+    if "id" not in post or not text or text in ("[deleted]", "[removed]"):
+        return None
+
+    created_at = post.get("created_utc")
+    if created_at is not None:
+        created_at = datetime.fromtimestamp(int(float(created_at)), timezone.utc).isoformat()
+
+    # Fullnames look like t2_1w72
+    author_id = post.get("author_fullname")
+    author_id = post_id('t2', author_id.split('_')[-1]) if author_id else None
+
+    return TweetRecord(post_id(kind, post["id"]), text, created_at, author_id, None)
@@ -0,0 +1,175 @@
+"""
+This module contains the scheduler used to collect several communities at once
+
+A manifest maps every community to the keywords it is searched by, e.g.
+    {
+        "gaming": ["gaming", "gamer", "gamers"],
+        "stem": {"keywords": ["science", "technology"], "target": 500}
+    }
+Every keyword is searched by its own thread. Pages of tweets are handed
+back to the calling thread, which stores them, so the database is only
+used from one thread. Each community stops once it reaches its quota,
+which keeps the sample balanced between communities.
+"""
+
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_manifest(path: str, target: int=None) -> dict:
+    """
+    Reads a community manifest
+
+    Args:
+        path: str
+            Path to the JSON manifest
+        target: int
+            The number of tweets to collect for communities without their own target
+    Returns:
+        dict
+            Community to {"keywords": list, "target": int}
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+
+    communities = {}
+    for community, entry in manifest.items():
+        if isinstance(entry, list):
+            entry = {"keywords": entry}
+        communities[community] = {
+            "keywords": list(entry["keywords"]),
+            "target": int(entry.get("target") or target or 0),
+        }
+    return communities
+
+
+class CollectionScheduler():
+    """
+    Runs the searches of several communities concurrently
+
+    Attributes:
+        twitter: Twitter
+            The Twitter API wrapper, its rate limiter is shared by every search
+        workers: int
+            The number of searches run at once
+        page_size: int
+            The number of tweets handed back at once
+        targets: dict
+            Community to the number of tweets to collect
+        collected: dict
+            Community to the number of tweets collected so far
+    """
+    def __init__(self, twitter, targets: dict, workers: int=8, page_size: int=100) -> None:
+        """
+        Sets up the scheduler
+
+        Args:
+            twitter: Twitter
+                The Twitter API wrapper
+            targets: dict
+                Community to the number of tweets to collect
+            workers: int
+                The number of searches run at once
+            page_size: int
+                The number of tweets handed back at once
+        """
+        self.twitter = twitter
+        self.targets = dict(targets)
+        self.workers = workers
+        self.page_size = page_size
+        self.collected = {community: 0 for community in targets}
+
+        self._done = {community: threading.Event() for community in targets}
+        self._stop = threading.Event()
+
+    def remaining(self, community: str) -> int:
+        """
+        Returns the number of tweets still missing from a community's quota
+        """
+        return max(0, self.targets[community] - self.collected[community])
+
+    def record(self, community: str, count: int) -> None:
+        """
+        Counts tweets stored for a community, ending its searches once the quota is met
+
+        Args:
+            community: str
+                The community the tweets were stored for
+            count: int
+                The number of new tweets stored
+        """
+        self.collected[community] += count
+        if self.remaining(community) == 0:
+            self._done[community].set()
+
+    def _search(self, pages: queue.Queue, community: str, query: str, watermark) -> None:
+        """
+        Searches one keyword, putting its tweets on the queue a page at a time
+        Every page carries a copy of the watermark covering exactly the tweets handed back so far
+        Runs in a worker thread until the community is done or the results run out
+        """
+        done = self._done[community]
+        page = []
+        covered = watermark.copy()
+        try:
+            for tweet in self.twitter.get_tweets(query, self.targets[community], watermark):
+                if done.is_set() or self._stop.is_set():
+                    break
+                page.append(tweet)
+                covered = watermark.copy()
+                if len(page) == self.page_size:
+                    self._put(pages, (community, query, page, covered))
+                    page = []
+            else:
+                # Running out of results can close a gap in the watermark
+                covered = watermark.copy()
+            if not self._stop.is_set():
+                self._put(pages, (community, query, page, covered))
+        except Exception as e:
+            logging.error(f"Search for {query} ({community}) failed: {e}")
+
+    def _put(self, pages: queue.Queue, item: tuple) -> None:
+        """
+        Puts a page on the queue, giving up if the scheduler is stopped meanwhile
+        """
+        while not self._stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def run(self, queries: list):
+        """
+        Runs the searches, yielding their pages to the calling thread
+        The caller stores every page and reports it with record
+
+        Args:
+            queries: list
+                (community, query, watermark) tuples, see Twitter.get_tweets
+        Yields:
+            tuple
+                (community, query, tweets, watermark) pages, as they arrive,
+                the watermark covering the page and every page before it
+        """
+        queries = [query for query in queries if self.remaining(query[0]) > 0]
+        if not queries:
+            return
+
+        # A bounded queue keeps fast searches from running ahead of the writer
+        pages = queue.Queue(maxsize=self.workers * 2)
+        executor = ThreadPoolExecutor(max_workers=min(self.workers, len(queries)))
+        futures = [executor.submit(self._search, pages, *query) for query in queries]
+        try:
+            while True:
+                try:
+                    yield pages.get(timeout=0.5)
+                except queue.Empty:
+                    if all(future.done() for future in futures) and pages.empty():
+                        return
+        finally:
+            self._stop.set()
+            executor.shutdown(wait=True)
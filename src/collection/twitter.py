@@ -2,18 +2,145 @@
 This module contains the analysis/preprocessing functions using Twitter's API
 """
 
+import functools
+from datetime import datetime
+from typing import NamedTuple
+
 import tweepy
 
+from util.rate_limit import TokenBucket
+
+class TweetRecord(NamedTuple):
+    """
+    The fields of a tweet that are stored, without the rest of the API response
+
+    Attributes:
+        id: int
+            The id of the tweet
+        text: str
+            The text of the tweet
+        created_at: str
+            When the tweet was posted, in ISO 8601
+        author_id: int
+            The id of the user who posted the tweet
+        lang: str
+            The language Twitter detected for the tweet
+    """
+    id: int
+    text: str
+    created_at: str
+    author_id: int
+    lang: str
+
+class Watermark():
+    """
+    The tweet ids already collected for a query
+
+    Every tweet from max_id up to since_id is collected. Tweets newer than
+    since_id are fetched newest first, so a collection that stops early
+    leaves a pending range, pending_max_id up to pending_since_id, above a
+    gap of tweets not fetched yet. since_id only moves up to pending_since_id
+    once that gap is closed, so no tweet is ever skipped
+
+    Attributes:
+        since_id: int
+            The newest tweet id of the collected range
+        max_id: int
+            The oldest tweet id of the collected range
+        pending_since_id: int
+            The newest tweet id of the pending range, None without one
+        pending_max_id: int
+            The oldest tweet id of the pending range, None without one
+    """
+    def __init__(self, since_id: int=None, max_id: int=None,
+                 pending_since_id: int=None, pending_max_id: int=None) -> None:
+        self.since_id = since_id
+        self.max_id = max_id
+        self.pending_since_id = pending_since_id
+        self.pending_max_id = pending_max_id
+
+    def copy(self) -> 'Watermark':
+        """
+        Returns a snapshot of the watermark
+        """
+        return Watermark(self.since_id, self.max_id, self.pending_since_id, self.pending_max_id)
+
+    def as_tuple(self) -> tuple:
+        """
+        Returns (since_id, max_id, pending_since_id, pending_max_id), as stored in the watermarks table
+        """
+        return self.since_id, self.max_id, self.pending_since_id, self.pending_max_id
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Watermark) and self.as_tuple() == other.as_tuple()
+
+def to_record(status) -> TweetRecord:
+    """
+    Turns a tweepy Status into a TweetRecord, so the Status can be freed
+
+    Args:
+        status: tweepy.models.Status
+            The tweet returned by the API
+    Returns:
+        TweetRecord
+    """
+    created_at = getattr(status, "created_at", None)
+    user = getattr(status, "user", None)
+    return TweetRecord(
+        status.id,
+        getattr(status, "full_text", None) or status.text,
+        created_at.isoformat() if created_at else None,
+        user.id if user else None,
+        getattr(status, "lang", None),
+    )
+
+def from_archive(tweet: dict) -> TweetRecord:
+    """
+    Turns an archived tweet into a TweetRecord
+    Both API v1.1 (user object, "Wed Oct 10 20:19:24 +0000 2018" dates)
+    and API v2 (author_id, ISO 8601 dates) tweets are understood
+
+    Args:
+        tweet: dict
+            The tweet, as one line of an archive
+    Returns:
+        TweetRecord, None if the line is not a tweet (e.g. a deletion notice)
+    """
+    text = tweet.get("full_text") or tweet.get("text")
+    if "id" not in tweet or text is None:
+        return None
+
+    created_at = tweet.get("created_at")
+    if created_at and not created_at[0].isdigit():
+        created_at = datetime.strptime(created_at, "%a %b %d %H:%M:%S %z %Y").isoformat()
+
+    author_id = tweet.get("author_id")
+    if author_id is None and tweet.get("user"):
+        author_id = tweet["user"].get("id")
+
+    return TweetRecord(
+        int(tweet["id"]),
+        text,
+        created_at,
+        int(author_id) if author_id is not None else None,
+        tweet.get("lang"),
+    )
+
 class Twitter():
     """
     This class is used set up a Twitter API object
     for use in tweet/data gathering.
 
     Attributes:
+        limiter: TokenBucket
+            Shared by every search, so concurrent collections stay within the rate limit window
 
     Functions:
+        search: Walks the search results page by page
+        get_tweets: Gets the tweets not collected yet for a query
     """
-    def __init__(self, consumer_key: str, consumer_secret: str, access_token: str, access_token_secret: str):
+    def __init__(self, consumer_key: str, consumer_secret: str, access_token: str, access_token_secret: str,
+                 requests_per_window: int=180, window: int=900):
         """
         This function is used to set up the Twitter API object
         
@@ -26,6 +153,10 @@ class Twitter():
                 The access token for the Twitter API
             access_token_secret: str
                 The access token secret for the Twitter API
+            requests_per_window: int
+                The number of search requests allowed per rate limit window
+            window: int
+                The length of the rate limit window, in seconds
         
         Returns:
             None
@@ -41,20 +172,109 @@ class Twitter():
         auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
         auth.set_access_token(access_token, access_token_secret)
         
-        self.api = tweepy.API(auth)
+        # Paginated searches sleep through the rate limit window instead of failing
+        self.api = tweepy.API(auth, wait_on_rate_limit=True)
+        self.limiter = TokenBucket.for_window(requests_per_window, window)
+
+    def _search_page(self):
+        """
+        Returns api.search_tweets waiting on the limiter before every page
+        The wrapper keeps the method's pagination attributes, so it can be given to a Cursor
+        """
+        @functools.wraps(self.api.search_tweets)
+        def search_tweets(*args, **kwargs):
+            self.limiter.acquire()
+            return self.api.search_tweets(*args, **kwargs)
+        return search_tweets
+    
+    def search(self, query: str, count: int, since_id: int=None, max_id: int=None, page_size: int=100):
+        """
+        This function is used to walk the search results page by page, newest first
+        
+        Args:
+            query: str
+                The query to search for
+            count: int
+                The maximum number of tweets to return
+            since_id: int
+                Only return tweets newer than this id
+            max_id: int
+                Only return tweets older than or equal to this id
+            page_size: int
+                The number of tweets requested per page (at most 100)
+        
+        Returns:
+            tweets: generator
+        """
+        return tweepy.Cursor(
+            self._search_page(),
+            q=query,
+            count=page_size,
+            since_id=since_id,
+            max_id=max_id,
+            result_type="recent"
+        ).items(count)
     
-    def get_tweets(self, query: str, count: int=10):
+    def get_tweets(self, query: str, count: int=10, watermark: Watermark=None):
         """
         This function is used to get tweets from the Twitter API
+        Given the watermark of a previous collection, only tweets outside of the
+        range already collected are fetched: first the gap left below a pending
+        range, then the tweets newer than since_id, then, if the count is not
+        reached, the tweets older than max_id.
+        The watermark is moved past every tweet before it is yielded, so a copy
+        taken after receiving a tweet covers exactly the tweets received
         
         Args:
             query: str
                 The query to search for
             count: int
                 The number of tweets to return
+            watermark: Watermark
+                The ids collected so far for the query, updated in place
         
         Returns:
-            tweets: list
+            tweets: generator of TweetRecord
+                Only one page of API responses is held at a time
         """
-        tweets = self.api.search_tweets(q=query, count=count)
-        return tweets
+        watermark = watermark if watermark is not None else Watermark()
+        remaining = int(count)
+
+        # Nothing collected yet, the results run from the newest tweet down
+        if watermark.since_id is None:
+            for status in self.search(query, remaining):
+                remaining -= 1
+                watermark.since_id = status.id if watermark.since_id is None else max(watermark.since_id, status.id)
+                watermark.max_id = status.id if watermark.max_id is None else min(watermark.max_id, status.id)
+                yield to_record(status)
+            return
+
+        # Tweets newer than since_id, first closing the gap below a pending range
+        while remaining > 0:
+            filling = watermark.pending_max_id is not None
+            results = self.search(
+                query, remaining,
+                since_id=watermark.since_id,
+                max_id=watermark.pending_max_id - 1 if filling else None)
+            for status in results:
+                remaining -= 1
+                if watermark.pending_max_id is None:
+                    watermark.pending_since_id = status.id
+                watermark.pending_max_id = min(status.id, watermark.pending_max_id or status.id)
+                yield to_record(status)
+            if remaining == 0:
+                # Results may be left above since_id, the range stays pending
+                break
+
+            # The results ran out before the count, so every tweet down to since_id is collected
+            if watermark.pending_since_id is not None:
+                watermark.since_id = max(watermark.since_id, watermark.pending_since_id)
+            watermark.pending_since_id = watermark.pending_max_id = None
+            if not filling:
+                break
+
+        # Then tweets older than max_id
+        if remaining > 0 and watermark.max_id is not None:
+            for status in self.search(query, remaining, max_id=watermark.max_id - 1):
+                watermark.max_id = min(watermark.max_id, status.id)
+                yield to_record(status)
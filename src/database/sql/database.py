@@ -8,13 +8,41 @@ import logging
 import sqlite3
 from sqlite3 import Error
 
+# Pragmas applied to every connection
+# WAL lets readers query while a long gain run is writing, and with WAL
+# synchronous=NORMAL only syncs at checkpoints instead of every commit
+PERFORMANCE_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,       # 64 MiB page cache
+    "mmap_size": 268435456,     # 256 MiB memory-mapped I/O
+    "temp_store": "MEMORY",
+}
+
 class Database():
     """
     This class is used to create a database and manipulate it.
     """
-    def __init__(self, db_name: str) -> None:
-        self.connector = sqlite3.connect(f"src\data\{db_name}.db")
+    def __init__(self, db_name: str, profile: dict=PERFORMANCE_PROFILE) -> None:
+        # Wait on a writer in another process instead of failing with "database is locked"
+        self.connector = sqlite3.connect(f"src\data\{db_name}.db", timeout=30)
         self.cursor = self.connector.cursor()
+        self.apply_profile(profile)
+
+    def apply_profile(self, profile: dict):
+        """
+        Applies a set of pragmas to the connection
+
+        Args:
+            profile: dict
+                Pragma name to value, None or empty to keep SQLite's defaults
+        """
+        for pragma, value in (profile or {}).items():
+            try:
+                self.cursor.execute(f"PRAGMA {pragma} = {value}")
+            except Error as err:
+                logging.warning(f"Could not set pragma {pragma}.")
+                logging.error(f"error code: {err}")
 
     def create_db(self, db_name: str):
         """
@@ -29,7 +57,7 @@ class Database():
     #######################
     # Query Manipulation
     ########################
-    def select_data(self, query_for: str, query_table: str, where: str=None):
+    def select_data(self, query_for: str, query_table: str, where: str=None, params: tuple=()):
         """
         Selects data from a table
 
@@ -38,10 +66,14 @@ class Database():
                 The data to be queried
             query_table: str
                 The table to be queried
+            where: str
+                The where statement for the select, may contain ? placeholders
+            params: tuple
+                The values bound to the placeholders in where
         """
         if where:
             try:
-                self.cursor.execute(f"SELECT {query_for} FROM {query_table} WHERE {where};")
+                self.cursor.execute(f"SELECT {query_for} FROM {query_table} WHERE {where};", params)
                 return self.cursor.fetchall()
             except Error as err:
                 if err != 0:
@@ -62,7 +94,83 @@ class Database():
                     logging.error("An unknown problem has occured.")
                     raise Exception("An unknown problem has occured.")
 
-    def insert_data(self, table_name: str, columns: str, data: str):
+    def stream_data(self, query_for, query_table: str, where: str=None, params: tuple=(),
+                    batch_size: int=1000, key_column: str=None):
+        """
+        Selects data from a table, yielding it in fixed-size batches
+        Only one batch is held in memory at a time, so work can start on the first batch right away
+
+        By default the rows come from one cursor read with fetchmany. Given a
+        key_column, every batch is a separate query resuming after the last key
+        seen (keyset pagination), which stays correct while the caller updates
+        the rows being read.
+
+        Args:
+            query_for: str or list
+                The columns to be queried
+            query_table: str
+                The table to be queried
+            where: str
+                The where statement for the select, may contain ? placeholders
+                (without ORDER BY when key_column is given)
+            params: tuple
+                The values bound to the placeholders in where
+            batch_size: int
+                The number of rows in each batch
+            key_column: str
+                A unique column to paginate on
+        Yields:
+            list
+                The next batch of rows
+        """
+        if not isinstance(query_for, str):
+            query_for = ', '.join(query_for)
+
+        try:
+            if key_column is None:
+                cursor = self.connector.cursor()
+                cursor.execute(f"SELECT {query_for} FROM {query_table}" + (f" WHERE {where};" if where else ";"), params)
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        return
+                    yield batch
+
+            last_key = None
+            while True:
+                conditions = [f"({where})"] if where else []
+                batch_params = tuple(params)
+                if last_key is not None:
+                    conditions.append(f"{key_column} > ?")
+                    batch_params += (last_key,)
+                where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+                batch = self.connector.execute(
+                    f"SELECT {key_column}, {query_for} FROM {query_table}{where_clause} "
+                    f"ORDER BY {key_column} LIMIT ?;",
+                    batch_params + (batch_size,)
+                ).fetchall()
+                if not batch:
+                    return
+                last_key = batch[-1][0]
+                yield [row[1:] for row in batch]
+        except Error as err:
+            if err != 0:
+                logging.warning("Problem with table Select.")
+                logging.error(f"error code: {err}")
+            else:
+                logging.error("An unknown problem has occured.")
+                raise Exception("An unknown problem has occured.")
+
+    def stream_rows(self, query_for, query_table: str, where: str=None, params: tuple=(),
+                    batch_size: int=1000, key_column: str=None):
+        """
+        Selects data from a table, yielding it row by row
+        See stream_data for the arguments
+        """
+        for batch in self.stream_data(query_for, query_table, where, params, batch_size, key_column):
+            yield from batch
+
+    def insert_data(self, table_name: str, columns: str, data: str, params: tuple=()):
         """
         Inserts data into a table
 
@@ -72,10 +180,15 @@ class Database():
             columns: str
                 The columns to be updated
             data: str
-                The data to be inserted
+                The data to be inserted, may contain ? placeholders
+            params: tuple
+                The values bound to the placeholders in data
+        Returns:
+            The rowid of the inserted row
         """
         try:
-            self.cursor.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({data})")
+            self.cursor.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({data})", params)
+            return self.cursor.lastrowid
         except Error as err:
             if err != 0:
                 logging.warning("Problem with Data Insertion.")
@@ -84,7 +197,70 @@ class Database():
                 logging.error("An unknown problem has occured.")
                 raise Exception("An unknown problem has occured.")
     
-    def update_row(self, table_name: str, data_args: str, where: str):
+    def insert_many(self, table_name: str, columns: list, rows, on_conflict: str=None,
+                    conflict_columns: list=None, update_columns: list=None) -> int:
+        """
+        Inserts many rows into a table with a single prepared statement
+        Values are bound as parameters, so text containing quotes is stored as is.
+        The rows are written atomically: on error none of them are kept.
+
+        Args:
+            table_name: str
+                The name of the table to be updated
+            columns: list
+                The columns to be inserted
+            rows: iterable
+                Tuples of values, in the order of columns
+            on_conflict: str
+                None to fail on conflicts, "ignore" to skip conflicting rows,
+                "replace" to overwrite them or "update" to upsert
+            conflict_columns: list
+                The unique columns checked by "update"
+            update_columns: list
+                The columns overwritten by "update", defaults to every other column
+        Returns:
+            The number of rows written
+        Raises:
+            ValueError: on_conflict is unknown, or "update" is given without conflict_columns
+        """
+        if on_conflict not in (None, "ignore", "replace", "update"):
+            raise ValueError(f"Unknown on_conflict {on_conflict}, expected ignore, replace or update")
+        if on_conflict == "update" and not conflict_columns:
+            raise ValueError("on_conflict update needs the conflict_columns to check")
+        placeholders = ', '.join('?' for _ in columns)
+        if on_conflict == "ignore":
+            statement = f"INSERT OR IGNORE INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        elif on_conflict == "replace":
+            statement = f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+        elif on_conflict == "update":
+            update_columns = update_columns or [column for column in columns if column not in conflict_columns]
+            statement = (
+                f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE SET "
+                + ', '.join(f"{column} = excluded.{column}" for column in update_columns)
+            )
+        else:
+            statement = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
+
+        # The savepoint makes the batch atomic without discarding the caller's pending work
+        self.cursor.execute("SAVEPOINT insert_many")
+        try:
+            self.cursor.executemany(statement, rows)
+            count = self.cursor.rowcount
+            self.cursor.execute("RELEASE insert_many")
+            return count
+        except Error as err:
+            self.cursor.execute("ROLLBACK TO insert_many")
+            self.cursor.execute("RELEASE insert_many")
+            if err != 0:
+                logging.warning("Problem with Data Insertion.")
+                logging.error(f"error code: {err}")
+            else:
+                logging.error("An unknown problem has occured.")
+                raise Exception("An unknown problem has occured.")
+        return 0
+
+    def update_row(self, table_name: str, data_args: str, where: str, params: tuple=()):
         """
         Updates a row in a table with the given name
 
@@ -95,9 +271,11 @@ class Database():
                 The arguments for the table to be updated
             where: str
                 The where statement for the update
+            params: tuple
+                The values bound to ? placeholders in data_args and where
         """
         try:
-            self.cursor.execute(f"UPDATE {table_name} SET {data_args} WHERE {where}")
+            self.cursor.execute(f"UPDATE {table_name} SET {data_args} WHERE {where}", params)
         except Error as err:   
             if err != 0:
                 logging.warning("Problem with table Update.")
@@ -106,16 +284,44 @@ class Database():
                 logging.error("An unknown problem has occured.")
                 raise Exception("An unknown problem has occured.")
 
-    def custom_query(self, sql_query: str):
+    def update_rows(self, table_name: str, columns: list, key_column: str, rows):
+        """
+        Updates many rows of a table with a single prepared statement
+        Nothing is committed, so a batch can be written in one transaction
+
+        Args:
+            table_name: str
+                The name of the table to be updated
+            columns: list
+                The columns to be set
+            key_column: str
+                The column identifying the row to update
+            rows: iterable
+                Tuples of the new column values followed by the key value
+        """
+        assignments = ', '.join(f"{column} = ?" for column in columns)
+        try:
+            self.cursor.executemany(f"UPDATE {table_name} SET {assignments} WHERE {key_column} = ?", rows)
+        except Error as err:
+            if err != 0:
+                logging.warning("Problem with table Update.")
+                logging.error(f"error code: {err}")
+            else:
+                logging.error("An unknown problem has occured.")
+                raise Exception("An unknown problem has occured.")
+
+    def custom_query(self, sql_query: str, params: tuple=()):
         """
         Executes a custom query
 
         Args:
             sql_query: str
-                The query to be executed
+                The query to be executed, may contain ? placeholders
+            params: tuple
+                The values bound to the placeholders
         """
         try:
-            self.cursor.execute(sql_query)
+            self.cursor.execute(sql_query, params)
         except Error as err:
             if err != 0:
                 logging.warning("Problem with Custom Query.")
@@ -128,7 +334,7 @@ class Database():
     #######################
     # Table Manipulation
     ########################
-    def create_table(self, table_name: str, table_args: str):
+    def create_table(self, table_name: str, table_args: str, if_not_exists: bool=False):
         """
         Creates a table with the given name
 
@@ -137,9 +343,12 @@ class Database():
                 The name of the table to be created
             table_args: str
                 The arguments for the table to be created
+            if_not_exists: bool
+                Quietly keep the table if it already exists
         """
+        exists_clause = "IF NOT EXISTS " if if_not_exists else ""
         try:
-            self.cursor.execute(f"CREATE TABLE {table_name} ({table_args});")
+            self.cursor.execute(f"CREATE TABLE {exists_clause}{table_name} ({table_args});")
         except Error as err:
             if err != 0:
                 logging.warning("Table already exists.")
@@ -148,6 +357,31 @@ class Database():
                 logging.error("An unknown problem has occured.")
                 raise Exception("An unknown problem has occured.")
 
+    def create_index(self, index_name: str, table_name: str, columns: list, unique: bool=False):
+        """
+        Creates an index on a table if it does not exist yet
+
+        Args:
+            index_name: str
+                The name of the index to be created
+            table_name: str
+                The name of the table to be indexed
+            columns: list
+                The indexed columns, in order
+            unique: bool
+                Whether the indexed columns must be unique, so inserts can replace on conflict
+        """
+        try:
+            self.cursor.execute(
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)});")
+        except Error as err:
+            if err != 0:
+                logging.warning("Problem with index Create.")
+                logging.error(f"error code: {err}")
+            else:
+                logging.error("An unknown problem has occured.")
+                raise Exception("An unknown problem has occured.")
+
     def alter_table(self, table_name: str, table_args: str):
         """
         Alters a table with the given name
@@ -168,6 +402,50 @@ class Database():
                 logging.error("An unknown problem has occured.")
                 raise Exception("An unknown problem has occured.")
     
+    def table_columns(self, table_name: str) -> list:
+        """
+        Returns the names of the columns of a table
+
+        Args:
+            table_name: str
+                The name of the table
+        Returns:
+            list
+                The column names, in order, empty if the table does not exist
+        """
+        try:
+            return [row[1] for row in self.connector.execute(f"PRAGMA table_info({table_name});")]
+        except Error as err:
+            if err != 0:
+                logging.warning("Problem with table Info.")
+                logging.error(f"error code: {err}")
+            else:
+                logging.error("An unknown problem has occured.")
+                raise Exception("An unknown problem has occured.")
+        return []
+
+    def table_indexes(self, table_name: str) -> list:
+        """
+        Returns the names of the indexes of a table
+
+        Args:
+            table_name: str
+                The name of the table
+        Returns:
+            list
+                The index names, empty if the table does not exist
+        """
+        try:
+            return [row[1] for row in self.connector.execute(f"PRAGMA index_list({table_name});")]
+        except Error as err:
+            if err != 0:
+                logging.warning("Problem with index List.")
+                logging.error(f"error code: {err}")
+            else:
+                logging.error("An unknown problem has occured.")
+                raise Exception("An unknown problem has occured.")
+        return []
+
     def clear_table(self, table_name: str):
         """
         Clears a table with the given name
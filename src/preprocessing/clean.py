@@ -8,10 +8,38 @@ Cleaning the data takes place in the following steps:
     - Dividing data into clusters by community
 """
 
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 
+# Patterns are compiled once at import instead of on every call
+EMOJI_PATTERN = re.compile("["
+    u"\U0001F600-\U0001F64F"  # emoticons
+    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+    u"\U0001F680-\U0001F6FF"  # transport & map symbols
+    u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    u"\U00002702-\U000027B0"
+    u"\U000024C2-\U0001F251"
+    u"\U00010000-\U0010ffff"
+    "]+", flags=re.UNICODE)
+URL_PATTERN = re.compile(r"http\S+")
+RETWEET_PATTERN = re.compile(r'^RT[\r\n]*', flags=re.MULTILINE)
+MENTION_PATTERN = re.compile(r'@\S+')
+HASHTAG_PATTERN = re.compile(r'#\S+')
+
+# Quotes, line breaks, tabs and every character demoji removes, in one class.
+# The emoji ranges above collapse into a single range from \u24C2 upwards
+STRIP_PATTERN = re.compile("['\"\n\r\t\u24C2-\U0010FFFF]+")
+
+# Fast approximation of word_tokenize: words, the contractions it splits
+# off ("do" + "n't", "it" + "'s"), ellipses and single punctuation marks
+TOKEN_PATTERN = re.compile(r"\w+(?=n't\b)|n't\b|'(?:s|m|d|ll|re|ve)\b|\w+|\.\.\.|[^\w\s]")
+
 def demoji(text: str) -> str:
     """
     Executes the command
@@ -22,17 +50,7 @@ def demoji(text: str) -> str:
     Returns:
         The text with emojis removed
     """
-    emoji_pattern = re.compile("["
-        u"\U0001F600-\U0001F64F"  # emoticons
-        u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-        u"\U0001F680-\U0001F6FF"  # transport & map symbols
-        u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        u"\U00002702-\U000027B0"
-        u"\U000024C2-\U0001F251"
-        u"\U00010000-\U0010ffff"
-        "]+", flags=re.UNICODE)
-
-    return emoji_pattern.sub(r'', text)
+    return EMOJI_PATTERN.sub(r'', text)
 
 def deurl(text: str) -> None:
     """
@@ -44,8 +62,7 @@ def deurl(text: str) -> None:
     Returns:
         None
     """
-    url_pattern = re.compile(r"http\S+")
-    return url_pattern.sub(r'', text)
+    return URL_PATTERN.sub(r'', text)
     
 def deretweet(text):
     """
@@ -57,7 +74,7 @@ def deretweet(text):
     Returns:
         The string of text with retweets removed.
     """
-    return re.sub(r'^RT[\r\n]*', '', text, flags=re.MULTILINE)
+    return RETWEET_PATTERN.sub('', text)
 
 def demention(text: str) -> str:
     """
@@ -69,7 +86,7 @@ def demention(text: str) -> str:
     Returns:
         The text with mentions removed
     """
-    return re.sub(r'@\S+', '', text)
+    return MENTION_PATTERN.sub('', text)
 
 def dehashtag(text: str) -> str:
     """
@@ -81,28 +98,108 @@ def dehashtag(text: str) -> str:
     Returns:
         The text with hashtags removed
     """
-    return re.sub(r'#\S+', '', text)
+    return HASHTAG_PATTERN.sub('', text)
 
-def remove_stopwords(text: str) -> str:
+@lru_cache(maxsize=None)
+def _load_stopwords(languages: tuple, extra_words: frozenset) -> frozenset:
+    """
+    Reads the stop word lists from the NLTK corpus, once per combination
+    """
+    words = set(extra_words)
+    for language in languages:
+        words.update(stopwords.words(language))
+    return frozenset(words)
+
+def get_stopwords(language='english', extra_words=None) -> frozenset:
+    """
+    Returns the stop words of one or more languages
+    The corpus is only read the first time a combination is asked for
+
+    Args:
+        language (str or list):
+            The NLTK stop word list(s) to use, an empty list for custom words only
+        extra_words (iterable):
+            Custom stop words added to the lists
+    Returns:
+        The set of stop words
+    """
+    languages = (language,) if isinstance(language, str) else tuple(language)
+    return _load_stopwords(languages, frozenset(extra_words or ()))
+
+def tokenize_many(texts: list, tokenizer: str='nltk') -> list:
+    """
+    Splits a list of texts into words
+
+    Args:
+        texts (list):
+            The texts to tokenize
+        tokenizer (str):
+            'nltk' for word_tokenize, 'regex' for a much faster approximation
+            of it that needs no NLTK data
+    Returns:
+        A list of tokens for every text, in the same order
+    """
+    if tokenizer == 'regex':
+        findall = TOKEN_PATTERN.findall
+        return [findall(text) for text in texts]
+    if tokenizer == 'nltk':
+        return [word_tokenize(text) for text in texts]
+    raise ValueError(f"Unknown tokenizer: {tokenizer}")
+
+def remove_stopwords(text: str, language='english', extra_words=None, tokenizer: str='nltk',
+                     return_tokens: bool=False):
     """
     Removes stop words from the text
 
     Args:
         text (str):
             The text to remove stop words from
+        language (str or list):
+            The stop word list(s) to use, see get_stopwords
+        extra_words (iterable):
+            Custom stop words to remove as well
+        tokenizer (str):
+            The tokenizer to use, see tokenize_many
+        return_tokens (bool):
+            Return the remaining tokens instead of joining them
     Returns:
-        The text with stop words removed
+        The text with stop words removed, or its tokens
+    """
+    return remove_stopwords_many([text], language, extra_words, tokenizer, return_tokens)[0]
+
+def remove_stopwords_many(texts: list, language='english', extra_words=None, tokenizer: str='nltk',
+                          return_tokens: bool=False) -> list:
     """
-    stop_words = set(stopwords.words('english'))
-    word_tokens = word_tokenize(text)
+    Removes stop words from a list of texts
 
-    filtered_sentence = [w for w in word_tokens if not w in stop_words]
+    Args:
+        texts (list):
+            The texts to remove stop words from
+        language (str or list):
+            The stop word list(s) to use, see get_stopwords
+        extra_words (iterable):
+            Custom stop words to remove as well
+        tokenizer (str):
+            The tokenizer to use, see tokenize_many
+        return_tokens (bool):
+            Return the remaining tokens of every text instead of joining them,
+            so later stages do not have to tokenize again
+    Returns:
+        The texts with stop words removed (or their tokens), in the same order
+    """
+    stop_words = get_stopwords(language, extra_words)
+    filtered = [[w for w in tokens if w not in stop_words] for tokens in tokenize_many(texts, tokenizer)]
 
-    return ' '.join(filtered_sentence)
+    if return_tokens:
+        return filtered
+    return [' '.join(tokens) for tokens in filtered]
 
 def run_all(text: str) -> str:
     """
     Runs all of the cleaning functions on the text
+    Gives the same result as removing quotes and line breaks, then running
+    demoji, deurl, deretweet, demention and dehashtag, but passes whose
+    markup does not appear in the text are skipped
 
     Args:
         text (str):
@@ -110,32 +207,94 @@ def run_all(text: str) -> str:
     Returns:
         The cleaned text
     """
-    original_text = text
-    
-    text = text.replace("'", "")
-    text = text.replace('"', '')
-    
-    text = text.replace('\n', '')
-    text = text.replace('\r', '')
-    text = text.replace('\t', '')
-    
-    demoji_text = demoji(text)
+    if text.isascii():
+        # No emojis possible, plain replaces beat any regex here
+        demoji_text = text.replace("'", "").replace('"', '').replace('\n', '').replace('\r', '').replace('\t', '')
+    else:
+        demoji_text = STRIP_PATTERN.sub('', text)
     
     if demoji_text == '':
-        demoji_text = original_text
+        demoji_text = text
     
-    text = deurl(demoji_text)
-    text = deretweet(text)
-    text = demention(text)
-    text = dehashtag(text)
+    cleaned = demoji_text
+    if 'http' in cleaned:
+        cleaned = URL_PATTERN.sub('', cleaned)
+    # Line breaks are gone (a text that fell back to its original has no
+    # letters left), so a retweet marker can only sit at the very start
+    if cleaned.startswith('RT'):
+        cleaned = cleaned[2:]
+    if '@' in cleaned:
+        cleaned = MENTION_PATTERN.sub('', cleaned)
+    if '#' in cleaned:
+        cleaned = HASHTAG_PATTERN.sub('', cleaned)
     
-    text = text.replace("  ", " ")
-    text = text.strip()
+    cleaned = cleaned.replace("  ", " ")
+    cleaned = cleaned.strip()
 
-    if text == '':
-        return original_text
-    else:
+    if cleaned == '':
         return text
+    else:
+        return cleaned
+
+def clean_rows(rows: list) -> list:
+    """
+    Runs all of the cleaning functions on a batch of rows
+
+    Args:
+        rows (list):
+            (postID, text) rows
+    Returns:
+        The (postID, cleaned text) rows, in the same order
+    """
+    return [(post_id, run_all(text)) for post_id, text in rows]
+
+def clean_many(texts: list, workers: int=None, chunksize: int=1000) -> list:
+    """
+    Runs all of the cleaning functions on a list of texts, across a process pool
+
+    Args:
+        texts (list):
+            The texts to clean
+        workers (int):
+            The number of processes, defaults to the number of cores
+        chunksize (int):
+            The number of texts sent to a process at once
+    Returns:
+        The cleaned texts, in the same order
+    """
+    if workers == 1:
+        return [run_all(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_all, texts, chunksize=chunksize))
+
+def clean_batches(batches, workers: int=None):
+    """
+    Cleans a stream of row batches across a process pool
+    Only a few batches per process are in flight at once, so the stream
+    is never read further ahead than the pool can clean
+
+    Args:
+        batches (iterable):
+            Lists of (postID, text) rows, such as the batches of Database.stream_data
+        workers (int):
+            The number of processes, defaults to the number of cores
+    Yields:
+        The cleaned batches, see clean_rows, in the same order as they were read
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for batch in batches:
+            yield clean_rows(batch)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(clean_rows, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 if __name__ == "__main__":
     test = [
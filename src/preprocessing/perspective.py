@@ -21,39 +21,165 @@ We will be using the following technologies and methods
 
 import logging
 import os
-import json
-import sys
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+import httplib2
 from googleapiclient import discovery
+
+from preprocessing.score_cache import ScoreCache
+from util.rate_limit import AdaptiveRateLimiter, backoff_delay
+
+# Attributes that can be requested from the API
+ATTRIBUTES = (
+  "TOXICITY",
+  "INSULT",
+  "THREAT",
+  "SEXUALLY_EXPLICIT",
+  "FLIRTATION",
+  "ATTACK_ON_AUTHOR",
+  "ATTACK_ON_COMMENTER",
+  "INFLAMMATORY",
+  "OBSCENE",
+)
+
+# Attributes requested by "ALL"
+ALL_ATTRIBUTES = (
+  "INSULT",
+  "THREAT",
+  "SEXUALLY_EXPLICIT",
+)
+
+# Column in the processed table holding each attribute's score
+SCORE_COLUMNS = {attribute: f"{attribute.lower()}_score" for attribute in ATTRIBUTES}
+SCORE_COLUMNS["ATTACK_ON_COMMENTER"] = "attack_on_commentor_score"
+
+def resolve_attributes(requested_attribute=None) -> tuple:
+  """
+  Turns a requested attribute into the set of attributes to score
+  
+  Args:
+    requested_attribute: None for TOXICITY, "ALL", a single attribute,
+      a comma separated string of attributes, or a list of attributes
+      
+  Returns:
+    A tuple of upper case attribute names, in request order without repeats
+  """
+  if not requested_attribute:
+    return ("TOXICITY",) # default
+  if isinstance(requested_attribute, str):
+    if requested_attribute.upper() == "ALL":
+      return ALL_ATTRIBUTES
+    requested_attribute = requested_attribute.split(',')
+
+  attributes = []
+  for attribute in requested_attribute:
+    attribute = attribute.strip().upper()
+    if attribute not in ATTRIBUTES:
+      raise ValueError(f"Unknown Perspective attribute: {attribute}")
+    if attribute not in attributes:
+      attributes.append(attribute)
+  return tuple(attributes)
+
+class PerspectiveError(Exception):
+  """
+  Raised when a text could not be scored, even after retrying
+  
+  Attributes:
+    status: The HTTP status of the last failed attempt, None if the request never got a response
+    attempts: The number of attempts made
+  """
+  
+  def __init__(self, message: str, status: int=None, attempts: int=1) -> None:
+    super().__init__(message)
+    self.status = status
+    self.attempts = attempts
+
+class PerspectiveKey():
+  """
+  One API key of a Perspective key pool
+  Every key has its own quota, so it gets its own client, rate limiter and health state
+  
+  Attributes:
+    client: The client for the Perspective API using this key
+    limiter: Adaptive token bucket for this key's quota
+    in_flight: Number of requests currently using this key
+    failures: Number of consecutive quota (429) errors
+    cooldown_until: Monotonic time before which the key is out of rotation
+  """
+  
+  def __init__(self, api_key: str, qps: float) -> None:
+    """
+    Configures a client for the key
+    
+    Args:
+      api_key: The API key
+      qps: The number of queries per second allowed by the key's quota
+    """
+    self.client = discovery.build(
+      "commentanalyzer",
+      "v1alpha1",
+      developerKey=api_key,
+      discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
+      static_discovery=False,
+    )
+    self.limiter = AdaptiveRateLimiter(qps)
+    self.in_flight = 0
+    self.failures = 0
+    self.cooldown_until = 0.0
+
 class Perspective():
   """
   This class is used to configure the Perspective API and interact with it
   You can use this class to pass in data and run analysis on it
+  Requests are spread over a pool of API keys, so throughput grows with the number of keys
   
   Attributes:
-    client: The client for the Perspective API
+    client: The client for the first API key
+    keys: The pool of API keys, see PerspectiveKey
+    workers: Number of requests kept in flight per key by analyze_many
+    cache: Optional ScoreCache checked before any request is sent
+    max_retries: Number of retries for throttled (429), server (5xx) and network errors
+    max_failures: Consecutive quota errors after which a key is taken out of rotation
+    cooldown: Seconds a failing key stays out of rotation
   
   Functions:
     analyze: Analyzes the text using the Perspective API
+    analyze_many: Analyzes a list of texts concurrently
+    analyze_chunks: Analyzes a stream of chunks, sending the next chunk while the current one finishes
   """
   
-  def __init__(self, api_key: str=None) -> None:
+  def __init__(self, api_key=None, qps: float=1.0, workers: int=8, cache: ScoreCache=None,
+               max_retries: int=8, max_failures: int=3, cooldown: float=60.0) -> None:
     """
     Configures the Perspective API
     
     Args:
-      api_key: The API key for the Perspective API
+      api_key: The API key for the Perspective API, or a list of keys to pool
+      qps: The number of queries per second allowed by each key's quota
+      workers: The number of requests kept in flight at once per key
+      cache: The score cache to use, None to always call the API
+      max_retries: The number of retries before a text is given up on
+      max_failures: The number of consecutive quota errors before a key is rested
+      cooldown: The number of seconds a rested key stays out of rotation
     """
-    
-    if api_key:
-      self.client = discovery.build(
-        "commentanalyzer",
-        "v1alpha1",
-        developerKey=api_key,
-        discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-        static_discovery=False,
-      )
+    self.workers = workers
+    self.cache = cache
+    self.max_retries = max_retries
+    self.max_failures = max_failures
+    self.cooldown = cooldown
+    self._local = threading.local()
+    self._pool_lock = threading.Lock()
+    self._executor = None
+    self._executor_workers = 0
+
+    api_keys = [api_key] if isinstance(api_key, str) else list(api_key or [])
+    self.keys = [PerspectiveKey(key, qps) for key in api_keys if key]
+
+    if self.keys:
+      self.client = self.keys[0].client
     else:
       logging.warning("No API key provided for Perspective API")
       self.client = None
@@ -61,81 +187,269 @@ class Perspective():
       # TODO: specific exception handling ?
       # raise Exception("No API key provided for Perspective API")
 
-  def analyze(self, text: str, requested_attribute: str=None) -> dict:
+  def _checkout(self) -> PerspectiveKey:
     """
-    Analyzes the text using the Perspective API
+    Picks the least loaded key that is in rotation, waiting if every key is resting
+    
+    Returns:
+      The key to send the next request with
+    """
+    while True:
+      with self._pool_lock:
+        now = time.monotonic()
+        available = [key for key in self.keys if key.cooldown_until <= now]
+        if available:
+          # Keys slowed down by throttling count as more loaded
+          key = min(available, key=lambda key: (key.in_flight + 1) / key.limiter.rate)
+          key.in_flight += 1
+          return key
+        wait = min(key.cooldown_until for key in self.keys) - now
+      time.sleep(wait)
+
+  def _checkin(self, key: PerspectiveKey, quota_error: bool=False) -> None:
+    """
+    Returns a key to the pool and updates its health
+    
+    Args:
+      key: The key that was used
+      quota_error: Whether the request hit the key's quota (HTTP 429)
+    """
+    with self._pool_lock:
+      key.in_flight -= 1
+      if not quota_error:
+        key.failures = 0
+        return
+      key.failures += 1
+      if key.failures >= self.max_failures:
+        logging.warning(f"Perspective key {self.keys.index(key)} keeps hitting its quota, resting it for {self.cooldown}s")
+        key.failures = 0
+        key.cooldown_until = time.monotonic() + self.cooldown
+
+  def _http(self) -> httplib2.Http:
+    """
+    Returns the HTTP connection owned by the calling thread
+    httplib2 connections are not thread safe, so every worker gets its own
+    """
+    if not hasattr(self._local, "http"):
+      self._local.http = httplib2.Http()
+    return self._local.http
+
+  def _request(self, text: str, attributes: tuple, key: PerspectiveKey) -> dict:
+    """
+    Sends a single analyze request for every attribute, waiting on the key's rate limiter first
     
     Args:
       text: The text to be analyzed
+      attributes: The attributes to be scored
+      key: The key to send the request with
       
     Returns:
-      The response from the Perspective API
+      A dictionary of attribute to summary score
     """
-    response = {}
-    if not self.client:
-      logging.warning("No client configured for Perspective API")
-      return None
+    request = {
+      'comment': { 'text': text },
+      'requestedAttributes': {attribute: {} for attribute in attributes}
+    }
+    key.limiter.acquire()
+    res = key.client.comments().analyze(body=request).execute(http=self._http())
+    return {
+      attribute: res["attributeScores"][attribute]["summaryScore"]["value"]
+      for attribute in attributes
+    }
 
-    if not requested_attribute:
-      requested_attribute = {
-        'TOXICITY': {}
-      } # default
-      request = {
-          'comment': { 'text': text },
-          'requestedAttributes': requested_attribute
-      }
+  def _request_with_retry(self, text: str, attributes: tuple) -> dict:
+    """
+    Sends an analyze request, retrying transient failures:
+    throttling (429), server errors (5xx) and network errors
+    Every attempt is sent with the least loaded key, throttling and
+    server errors also slow that key's rate limiter down
+    
+    Args:
+      text: The text to be analyzed
+      attributes: The attributes to be scored
+      
+    Returns:
+      A dictionary of attribute to summary score
+    
+    Raises:
+      PerspectiveError: The request failed permanently or ran out of retries
+    """
+    for attempt in range(self.max_retries + 1):
+      key = self._checkout()
       try:
-        time.sleep(1) # Perspective API has a limit of 1 request per second
-        res = self.client.comments().analyze(body=request).execute()
-        response['TOXICITY'] = res["attributeScores"]['TOXICITY']["summaryScore"]["value"]
+        scores = self._request(text, attributes, key)
+        key.limiter.on_success()
+        self._checkin(key)
+        return scores
       except Exception as e:
-          print(f"{e}\n\n")
-          response['TOXICITY'] = 0.0
-
-    elif requested_attribute == "ALL":
-      attributes = [
-        "INSULT",
-        "THREAT",
-        "SEXUALLY_EXPLICIT",
-      ]
-      for attribute in attributes:
-        request = {
-          'comment': { 'text': text },
-          'requestedAttributes': {attribute: {}}
-        }
-        try:
-          time.sleep(2) # Perspective API has a limit of 1 request per second
-          res = self.client.comments().analyze(body=request).execute()
-          response[attribute] = res["attributeScores"][attribute]["summaryScore"]["value"]
-        except Exception as e:
-          if e.resp.status == 429:
-            print("API rate limit exceeded")
-            sys.exit(1)
-          else:
-            print(f"{e}\n\n")
-            response[attribute] = 0.0
+        status = getattr(getattr(e, "resp", None), "status", None)
+        if status is not None:
+          status = int(status)
+        self._checkin(key, quota_error=status == 429)
+        if status == 429 or (status is not None and status >= 500):
+          key.limiter.on_throttle()
+        elif status is not None or isinstance(e, KeyError):
+          # Bad request, unsupported language, malformed response...
+          raise PerspectiveError(str(e), status, attempt + 1) from e
+        elif not isinstance(e, (OSError, httplib2.HttpLib2Error)):
+          # Not a network error but a bug, retrying would only delay it
+          raise
+
+        if attempt == self.max_retries:
+          raise PerspectiveError(str(e), status, attempt + 1) from e
+        delay = backoff_delay(attempt)
+        logging.info(f"Perspective request failed ({status or e}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+      except BaseException:
+        self._checkin(key)
+        raise
+
+  def analyze(self, text: str, requested_attribute=None) -> dict:
+    """
+    Analyzes the text using the Perspective API
+    Cached scores are used first, the remaining attributes are scored by the same API call
+    
+    Args:
+      text: The text to be analyzed
+      requested_attribute: The attribute(s) to score, see resolve_attributes
+      
+    Returns:
+      A dictionary of attribute to score
+    
+    Raises:
+      PerspectiveError: The text could not be scored
+    """
+    attributes = resolve_attributes(requested_attribute)
 
+    response = self.cache.get(text, attributes) if self.cache else {}
+    missing = tuple(attribute for attribute in attributes if attribute not in response)
+    if not missing:
       return response
-  
-    else:
-      requested_attributes = {
-        requested_attribute.upper(): {}
-      }
 
-      analyze_request = {
-        'comment': { 'text': text },
-        'requestedAttributes': requested_attributes
-      }
+    if not self.keys:
+      logging.warning("No client configured for Perspective API")
+      return None
+
+    scores = self._request_with_retry(text, missing)
+    if self.cache:
+      self.cache.put(text, scores)
+    response.update(scores)
 
-      try:
-        time.sleep(1) # Perspective API has a limit of 1 request per second
-        res = self.client.comments().analyze(body=analyze_request).execute()
-        response = res["attributeScores"][requested_attribute.upper()]["summaryScore"]["value"]
-      except Exception as e:
-        print(f"{e}\n\n")
-        response[attribute] = 0.0
+    return {attribute: response[attribute] for attribute in attributes}
+
+  def _executor_for(self, workers: int=None) -> ThreadPoolExecutor:
+    """
+    Returns the thread pool kept from one call to the next, so the worker
+    threads and their HTTP connections (see _http) are not rebuilt every chunk
+    
+    Args:
+      workers: Overrides the number of requests kept in flight per key
+    """
+    max_workers = (workers or self.workers) * max(1, len(self.keys))
+    with self._pool_lock:
+      if self._executor is None or self._executor_workers != max_workers:
+        if self._executor is not None:
+          self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="perspective")
+        self._executor_workers = max_workers
+      return self._executor
+
+  def _analyze_or_error(self, text: str, attributes: tuple, return_exceptions: bool):
+    """
+    Runs analyze, returning the PerspectiveError of a failed text if asked to
+    """
+    try:
+      return self.analyze(text, attributes)
+    except PerspectiveError as e:
+      if return_exceptions:
+        return e
+      raise
+
+  def analyze_many(self, texts: list, requested_attribute: str=None, workers: int=None,
+                   return_exceptions: bool=False) -> list:
+    """
+    Analyzes a list of texts, keeping several requests in flight at once
+    The shared token bucket keeps the overall rate at the configured QPS
+    
+    Args:
+      texts: The texts to be analyzed
+      requested_attribute: The attribute(s) to score, see resolve_attributes
+      workers: Overrides the number of requests kept in flight per key
+      return_exceptions: Put the PerspectiveError of a failed text in its place
+        in the results instead of raising it
+      
+    Returns:
+      A list of responses from analyze, in the same order as texts
+    """
+    if not self.keys and not self.cache:
+      logging.warning("No client configured for Perspective API")
+      return [None for _ in texts]
+
+    attributes = resolve_attributes(requested_attribute)
+    futures = [self._executor_for(workers).submit(self._analyze_or_error, text, attributes, return_exceptions)
+               for text in texts]
+    try:
+      results = [future.result() for future in futures]
+    finally:
+      for future in futures:
+        future.cancel()
+    # Cache hits are written once per call instead of once per text
+    if self.cache:
+      self.cache.flush()
+    return results
+
+  def analyze_chunks(self, chunks, requested_attribute: str=None, workers: int=None,
+                     return_exceptions: bool=False, text=None):
+    """
+    Analyzes a stream of chunks, such as the batches of Database.stream_data
+    The next chunk is sent before the current one is returned, so the keys stay
+    busy while the slowest requests of a chunk finish and the caller stores it
     
-    return response
+    Args:
+      chunks: Iterable of lists of items to be analyzed
+      requested_attribute: The attribute(s) to score, see resolve_attributes
+      workers: Overrides the number of requests kept in flight per key
+      return_exceptions: Put the PerspectiveError of a failed text in its place
+        in the results instead of raising it
+      text: Gets the text of an item, the items are the texts themselves by default
+      
+    Yields:
+      Every chunk with the list of its responses from analyze, in the order of the chunks
+    """
+    text = text or (lambda item: item)
+    if not self.keys and not self.cache:
+      logging.warning("No client configured for Perspective API")
+      for chunk in chunks:
+        yield chunk, [None for _ in chunk]
+      return
+
+    attributes = resolve_attributes(requested_attribute)
+    executor = self._executor_for(workers)
+    chunks = iter(chunks)
+    pending = deque() # chunks sent, with the futures of their texts
+    try:
+      while True:
+        # One chunk ahead of the one being returned
+        while len(pending) < 2:
+          chunk = next(chunks, None)
+          if chunk is None:
+            break
+          pending.append((chunk, [
+            executor.submit(self._analyze_or_error, text(item), attributes, return_exceptions) for item in chunk
+          ]))
+        if not pending:
+          return
+        chunk, futures = pending[0]
+        results = [future.result() for future in futures]
+        pending.popleft()
+        if self.cache:
+          self.cache.flush()
+        yield chunk, results
+    finally:
+      # Stopped early (interrupted or an error), requests not started yet are dropped
+      for _, futures in pending:
+        for future in futures:
+          future.cancel()
 
 if __name__ == "__main__":
   # Test Perspective API
@@ -0,0 +1,181 @@
+"""
+This module contains a persistent cache for Perspective API scores
+
+Retweets and copy-pasted posts mean the same cleaned text is scored many times.
+Scores are stored in their own SQLite file, keyed by a hash of the text,
+the attribute and the model version, so repeated runs cost no API quota.
+The cache is shared by the scoring threads, so every access is locked.
+Hits only write when a score was not used for a while, and those writes are batched,
+so a mostly cached run stays read only.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+
+class ScoreCache():
+    """
+    Content-addressed cache of Perspective scores
+
+    Attributes:
+        model_version: str
+            Version tag stored with every score, changing it invalidates old scores
+        max_entries: int
+            Maximum number of scores kept before the least recently used are evicted
+        touch_interval: float
+            Seconds after which a hit refreshes the last use of a score
+        hits: int
+            Number of attribute scores served from the cache
+        misses: int
+            Number of attribute scores that had to be requested
+    """
+    def __init__(self, path: str, model_version: str="v1alpha1", max_entries: int=1000000,
+                 touch_interval: float=3600.0) -> None:
+        """
+        Opens (or creates) the cache file
+
+        Args:
+            path: str
+                Path to the SQLite file backing the cache
+            model_version: str
+                Version tag of the model producing the scores
+            max_entries: int
+                Size cap of the cache
+            touch_interval: float
+                Seconds after which a hit refreshes the last use of a score
+        """
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._puts_since_check = 0
+        self._touched = []
+        self.connector = sqlite3.connect(path, check_same_thread=False)
+        self.connector.execute("PRAGMA journal_mode=WAL")
+        self.connector.execute("PRAGMA synchronous=NORMAL")
+        self.connector.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "key TEXT, "
+            "attribute TEXT, "
+            "model TEXT, "
+            "score REAL, "
+            "last_used REAL, "
+            "PRIMARY KEY (key, attribute, model))"
+        )
+        self.connector.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        self.connector.commit()
+
+    @staticmethod
+    def key(text: str) -> str:
+        """
+        Returns the content hash used to key a piece of text
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str, attributes: tuple) -> dict:
+        """
+        Looks up the cached scores of a piece of text
+
+        Args:
+            text: str
+                The text that was scored
+            attributes: tuple
+                The attributes wanted
+        Returns:
+            dict
+                Attribute to score for every attribute found in the cache
+        """
+        key = self.key(text)
+        placeholders = ', '.join('?' for _ in attributes)
+        with self._lock:
+            rows = self.connector.execute(
+                f"SELECT attribute, score, last_used FROM scores "
+                f"WHERE key = ? AND model = ? AND attribute IN ({placeholders})",
+                (key, self.model_version, *attributes)
+            ).fetchall()
+            # Eviction only needs a rough order, so recent scores are not touched again
+            now = time.time()
+            self._touched.extend(
+                (now, key, attribute, self.model_version)
+                for attribute, _, last_used in rows if last_used < now - self.touch_interval)
+            if len(self._touched) >= 1000:
+                self._touch()
+                self.connector.commit()
+            self.hits += len(rows)
+            self.misses += len(attributes) - len(rows)
+        return {attribute: score for attribute, score, _ in rows}
+
+    def put(self, text: str, scores: dict) -> None:
+        """
+        Stores the scores of a piece of text
+
+        Args:
+            text: str
+                The text that was scored
+            scores: dict
+                Attribute to score, as returned by the API
+        """
+        key = self.key(text)
+        now = time.time()
+        with self._lock:
+            self.connector.executemany(
+                "INSERT OR REPLACE INTO scores (key, attribute, model, score, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, attribute, self.model_version, score, now) for attribute, score in scores.items()]
+            )
+            self._touch()
+            # Counting rows is a full scan, so the cap is only checked periodically
+            self._puts_since_check += len(scores)
+            if self._puts_since_check >= 1000:
+                self._evict()
+            self.connector.commit()
+
+    def flush(self) -> None:
+        """
+        Writes the pending last uses of the scores served since the last write
+        """
+        with self._lock:
+            if self._touched:
+                self._touch()
+                self.connector.commit()
+
+    def _touch(self) -> None:
+        """
+        Refreshes the last use of the scores served since the last write
+        Callers must hold the lock and commit
+        """
+        self.connector.executemany(
+            "UPDATE scores SET last_used = ? WHERE key = ? AND attribute = ? AND model = ?",
+            self._touched
+        )
+        self._touched = []
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used scores once the cache is over its cap
+        Callers must hold the lock
+        """
+        self._puts_since_check = 0
+        size = self.connector.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        if size <= self.max_entries:
+            return
+        logging.info(f"Evicting {size - self.max_entries} cached scores")
+        self.connector.execute(
+            "DELETE FROM scores WHERE rowid IN "
+            "(SELECT rowid FROM scores ORDER BY last_used LIMIT ?)",
+            (size - self.max_entries,)
+        )
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters and the number of cached scores
+        """
+        with self._lock:
+            size = self.connector.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size}
@@ -9,6 +9,7 @@ from database.csv.database import CsvHelper
 from database.sql.database import Database
 
 from preprocessing.perspective import Perspective
+from preprocessing.score_cache import ScoreCache
 from collection.twitter import Twitter
 
 
@@ -51,7 +52,6 @@ class Configuration():
             logging.info("Database already exists")
             database = Database("tic")
             self.ctx["database"] = database
-            return
         else:
             logging.info("Creating database")
             database = Database("tic")
@@ -73,13 +73,112 @@ class Configuration():
                                   "obscene_score REAL, "
                                   "PRIMARY KEY (postID)")
             database.create_table("clusters",
-                                  "cluster TEXT, ",
-                                  "representative int, ", # postID
+                                  "cluster TEXT, "
+                                  "representative int, " # postID
                                   "toxicity_score REAL, "
                                   "insult_score REAL, "
                                   "threat_score REAL, "
                                   "sexually_explicit_score REAL")
             database.create_table("community", "community TEXT, score REAL, topics TEXT, PRIMARY KEY (community)")
+
+        # Near-duplicate index, see analysis.dedup
+        database.create_table("minhash", "postID int, community TEXT, signature BLOB, PRIMARY KEY (postID)",
+                              if_not_exists=True)
+        database.create_table("minhash_bands", "community TEXT, band int, bucket int, postID int",
+                              if_not_exists=True)
+        database.create_table("duplicates", "postID int, canonicalID int, similarity REAL, PRIMARY KEY (postID)",
+                              if_not_exists=True)
+
+        # Upper triangle of the community distance matrix of every metric
+        database.create_table("distances",
+                              "metric TEXT, "
+                              "community1 TEXT, "
+                              "community2 TEXT, "
+                              "distance REAL, "
+                              "PRIMARY KEY (metric, community1, community2)",
+                              if_not_exists=True)
+
+        # Posts already fitted by every streaming clustering model, see analysis.cluster.StreamingClusters,
+        # and already counted in the community aggregates (model 'community'), see analysis.cluster.CommunityStats
+        database.create_table("cluster_fitted", "model TEXT, postID int, PRIMARY KEY (model, postID)",
+                              if_not_exists=True)
+        database.create_table("community_stats",
+                              "community TEXT, "
+                              "count int, "
+                              "sums BLOB, "     # float64 sum of every score
+                              "squares BLOB, "  # float64 sum of the square of every score
+                              "PRIMARY KEY (community)",
+                              if_not_exists=True)
+        database.create_table("community_candidates",
+                              "community TEXT, "
+                              "slot int, "
+                              "postID int, "
+                              "scores BLOB, "
+                              "PRIMARY KEY (community, slot)",
+                              if_not_exists=True)
+
+        # Tweet metadata kept alongside the text, also added to databases created before it
+        unprocessed_columns = database.table_columns("unprocessed")
+        for column, column_type in (("createdAt", "TEXT"), ("authorID", "int"), ("lang", "TEXT")):
+            if column not in unprocessed_columns:
+                database.alter_table("unprocessed", f"ADD COLUMN {column} {column_type}")
+
+        # Bookkeeping tables, also added to databases created before them
+        database.create_table("jobs",
+                              "jobID INTEGER PRIMARY KEY AUTOINCREMENT, "
+                              "command TEXT, "
+                              "args TEXT, "
+                              "status TEXT, "
+                              "total int, "
+                              "done int, "
+                              "lastPostID int, "
+                              "started REAL, "
+                              "updated REAL",
+                              if_not_exists=True)
+        database.create_table("dead_letters",
+                              "postID int, "
+                              "attributes TEXT, "
+                              "status int, "
+                              "error TEXT, "
+                              "attempts int, "
+                              "failed REAL, "
+                              "PRIMARY KEY (postID, attributes)",
+                              if_not_exists=True)
+        database.create_table("watermarks",
+                              "community TEXT, "
+                              "query TEXT, "
+                              "since_id int, "  # newest tweet collected
+                              "max_id int, "    # oldest tweet collected
+                              "updated REAL, "
+                              "PRIMARY KEY (community, query)",
+                              if_not_exists=True)
+        # Newer tweets collected above a gap not fetched yet, see collection.twitter.Watermark
+        watermark_columns = database.table_columns("watermarks")
+        for column in ("pending_since_id", "pending_max_id"):
+            if column not in watermark_columns:
+                database.alter_table("watermarks", f"ADD COLUMN {column} int")
+
+        # Every analysis command filters by community, and cluster only reads the
+        # scores, so the covering index answers it without touching the table.
+        # clean pages through a community by postID, which replaced the community only index
+        database.custom_query("DROP INDEX IF EXISTS unprocessed_community")
+        database.create_index("unprocessed_community_post", "unprocessed", ["community", "postID"])
+        database.create_index("minhash_bands_bucket", "minhash_bands", ["community", "band", "bucket"])
+        database.create_index("duplicates_canonical", "duplicates", ["canonicalID"])
+        # One representative per community. Older runs appended a row every time,
+        # so the latest row of every community is kept once, before the unique index exists
+        if "clusters_cluster" not in database.table_indexes("clusters"):
+            database.custom_query("DELETE FROM clusters WHERE rowid NOT IN (SELECT MAX(rowid) FROM clusters GROUP BY cluster)")
+        database.create_index("clusters_cluster", "clusters", ["cluster"], unique=True)
+        database.create_index("processed_community_scores", "processed", [
+            "community",
+            "toxicity_score",
+            "insult_score",
+            "threat_score",
+            "sexually_explicit_score",
+            "postID",
+        ])
+        database.commit()
     
     def setup_api(self) -> None:
         """
@@ -102,7 +201,13 @@ class Configuration():
                 self.ctx["twitter_api"]["client_id"] = os.getenv("TWITTER_CLIENT_ID")
                 self.ctx["twitter_api"]["client_secret"] = os.getenv("TWITTER_CLIENT_SECRET")
                 # Perspective API
-                self.ctx["perspective_api"]["api_key"] = os.getenv("GOOGLE_PERSPECTIVE_API_KEY")
+                # A comma separated pool of keys multiplies the available quota
+                self.ctx["perspective_api"]["api_key"] = os.getenv(
+                    "GOOGLE_PERSPECTIVE_API_KEYS",
+                    os.getenv("GOOGLE_PERSPECTIVE_API_KEY")
+                )
+                self.ctx["perspective_api"]["qps"] = float(os.getenv("PERSPECTIVE_QPS", 1.0))
+                self.ctx["perspective_api"]["workers"] = int(os.getenv("PERSPECTIVE_WORKERS", 8))
             except Exception as e:
                 logging.error(f"Error: {e}")
         else:
@@ -116,10 +221,24 @@ class Configuration():
             self.ctx["twitter_api"]["client_id"] = input("Enter Twitter client id: ")
             self.ctx["twitter_api"]["client_secret"] = input("Enter Twitter client secret: ")
             # Perspective API
-            self.ctx["perspective_api"]["api_key"] = input("Enter Google Perspective API key: ")
+            self.ctx["perspective_api"]["api_key"] = input("Enter Google Perspective API key(s), comma separated: ")
+            self.ctx["perspective_api"]["qps"] = float(os.getenv("PERSPECTIVE_QPS", 1.0))
+            self.ctx["perspective_api"]["workers"] = int(os.getenv("PERSPECTIVE_WORKERS", 8))
         
         # API configuration
-        perspective = Perspective(self.ctx["perspective_api"]['api_key'])
+        cache = ScoreCache(
+            os.path.join(os.getcwd(), "src", "data", "score_cache.db"),
+            os.getenv("PERSPECTIVE_MODEL_VERSION", "v1alpha1"),
+            int(os.getenv("PERSPECTIVE_CACHE_SIZE", 1000000))
+        )
+        api_keys = [key.strip() for key in (self.ctx["perspective_api"]['api_key'] or '').split(',') if key.strip()]
+        perspective = Perspective(
+            api_keys,
+            self.ctx["perspective_api"].get('qps', 1.0),
+            self.ctx["perspective_api"].get('workers', 8),
+            cache,
+            int(os.getenv("PERSPECTIVE_MAX_RETRIES", 8))
+        )
         twitter = Twitter(
             self.ctx["twitter_api"]['consumer_key'],
             self.ctx["twitter_api"]['consumer_secret'],
@@ -0,0 +1,102 @@
+"""
+This module contains the definition of the Job class
+Jobs record the progress of long running commands (such as gain)
+in the jobs table, so an interrupted run can be resumed where it stopped
+"""
+
+import logging
+import time
+
+
+class Job():
+    """
+    A resumable run of a command, tracked in the jobs table
+
+    Attributes:
+        database: Database
+            The database holding the jobs table
+        job_id: int
+            The id of the job in the jobs table
+        done: int
+            Number of items finished so far, including previous runs
+        total: int
+            Number of items the job has to process
+    """
+    def __init__(self, database, command: str, args: str) -> None:
+        """
+        Resumes the unfinished job with the same command and args, or starts a new one
+
+        Args:
+            database: Database
+                The database holding the jobs table
+            command: str
+                The command being run
+            args: str
+                The arguments identifying this run of the command
+        """
+        self.database = database
+        self.resumed = False
+
+        rows = database.select_data(
+            'jobID, done, total',
+            'jobs',
+            "command = ? AND args = ? AND status != 'done' ORDER BY jobID DESC LIMIT 1",
+            (command, args)
+        )
+        if rows:
+            self.job_id, self.done, self.total = rows[0]
+            self.resumed = True
+            logging.info(f"Resuming job {self.job_id}")
+            database.update_row('jobs', "status = 'running', updated = ?", "jobID = ?", (time.time(), self.job_id))
+        else:
+            self.done = 0
+            self.total = 0
+            self.job_id = database.insert_data(
+                'jobs',
+                'command, args, status, total, done, started, updated',
+                "?, ?, 'running', 0, 0, ?, ?",
+                (command, args, time.time(), time.time())
+            )
+        database.commit()
+
+    def start(self, remaining: int) -> None:
+        """
+        Records how many items are left to process
+
+        Args:
+            remaining: int
+                Number of items this run still has to process
+        """
+        self.total = self.done + remaining
+        self.database.update_row('jobs', "total = ?", "jobID = ?", (self.total, self.job_id))
+        self.database.commit()
+
+    def advance(self, count: int, last_post_id: int=None) -> None:
+        """
+        Records a finished batch
+        Callers commit the batch's results and the progress in the same transaction
+
+        Args:
+            count: int
+                Number of items finished in the batch
+            last_post_id: int
+                The last postID of the batch
+        """
+        self.done += count
+        self.database.update_row(
+            'jobs',
+            "done = ?, lastPostID = ?, updated = ?",
+            "jobID = ?",
+            (self.done, last_post_id, time.time(), self.job_id)
+        )
+
+    def finish(self, status: str='done') -> None:
+        """
+        Marks the job as finished (or interrupted)
+
+        Args:
+            status: str
+                The final status of the job
+        """
+        self.database.update_row('jobs', "status = ?, updated = ?", "jobID = ?", (status, time.time(), self.job_id))
+        self.database.commit()
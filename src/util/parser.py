@@ -3,25 +3,82 @@ This module contains the definition of the Parser class
 This parser is used to parse the command line arguments
 
 Commands include:
-    - get <query> --c <count>
+    - get <community> <query> --c <count>
         Gets the specified number of tweets from the query passed
         Stores this data in the database under the UNPROCESSED table
-    - clean <dataset>
+        Repeated runs only fetch tweets that were not collected yet
+    - collect <manifest> --c <count> --workers <n>
+        Gets the specified number of tweets for every community of the manifest at once
+    - import <community> <path> --source <twitter|reddit>
+        Loads an archive of tweets or Reddit posts into the UNPROCESSED table
+    - clean <dataset> --workers <n> --no-dedup
         Cleans the data in the source table by running demoji, deurl, and deretweet
         Cleans the data by removing stop words
     -gain <method> <dataset>
         Run perspective API to gain toxicity metrics
         Run distance metrics to gain similarity metrics
         Run entity recognition mining to gain topically relevant words
+    - cluster community --workers <n> --fast --refresh
+        Finds the representative post (medoid) of every community in the data,
+        or an approximate one from the running aggregates with --fast
+    - cluster <minibatch|birch> --k <k> --refit
+        Clusters the scored posts in chunks, refreshing the saved model with new posts
+    - distance <metric> --centroids
+        Finds the distance between every pair of communities
     -analyze <method> <dataset>
         Analyzes the data in the source table by running distance metrics and sentiment analysis
     -visualize <method> <args> <dataset>
         Visualizes the data in the source table by creating graphs and charts
 """
 
-from analysis.cluster import get_representative
-from analysis.distance import get_distance
-from preprocessing.clean import run_all
+import itertools
+import os
+import time
+
+import numpy as np
+
+from analysis.cluster import STREAMING_METHODS, CommunityStats, StreamingClusters, get_representatives
+from analysis.dedup import DuplicateIndex
+from analysis.distance import METRICS, condensed, pairwise_distances, streamed_covariance
+from collection import reddit, twitter
+from collection.twitter import Watermark
+from collection.archive import read_archive, read_records
+from collection.scheduler import CollectionScheduler, load_manifest
+from preprocessing.clean import clean_batches
+from preprocessing.perspective import ATTRIBUTES, SCORE_COLUMNS, PerspectiveError, resolve_attributes
+from util.jobs import Job
+
+
+def get_option(args: list, name: str, cast=int, default=None):
+    """
+    Reads the positive number given after an option, e.g. --workers 8
+
+    Args:
+        args: list
+            List of arguments passed by the user
+        name: str
+            The option, e.g. '--workers'
+        cast: type
+            int or float
+        default:
+            The value when the option is not given
+    Returns:
+        The value of the option
+    Raises:
+        ValueError: The value is missing, not a number or not positive
+    """
+    if name not in args:
+        return default
+    position = args.index(name) + 1
+    try:
+        value = cast(args[position])
+    except (IndexError, ValueError):
+        value = None
+    if value is None or not 0 < value < float('inf'):
+        kind = 'a whole number' if cast is int else 'a number'
+        raise ValueError(f"Usage: {name} expects {kind} above 0, got {' '.join(args[position:position + 1]) or 'nothing'}")
+    return value
+
 class Parser():
     """
     Class definiton for CLI parser
@@ -36,6 +93,8 @@ class Parser():
         self.commands = {
             # Data collection and analysis
             "get": self.get,
+            "collect": self.collect,
+            "import": self.import_archive,
             "clean": self.clean,
             "gain": self.gain,
             "cluster": self.cluster,
@@ -67,18 +126,20 @@ class Parser():
             print(f'Command {command} not found')
             return
         else:
-            getattr(self, command)(args)
+            command_function(args)
 
-    def get(self, args: list) -> list:
+    def get(self, args: list) -> int:
         """
         Gets tweets from the Twitter API
+        Only tweets that were not collected by a previous get of the same
+        community and query are fetched, see the watermarks table
         
         Args:
             args: list
                 List of arguments passed by the user
         Returns:
-            list
-                List of tweets
+            int
+                Number of tweets collected
         """
         # Get the query and count from the args
         command = ' '.join(args)
@@ -86,90 +147,359 @@ class Parser():
         query = args[1]
         count = command.split('--c')[1].strip()
 
-        # Get tweets
-        tweets = self.ctx['twitter'].get_tweets(query, count)
-        
-        # Insert tweets into unprocessed table in DB
-        for tweet in tweets:
-            self.ctx['database'].insert_data('unprocessed', 'community, postID, data', f"'{community}', '{tweet.id}', '{tweet.text}'")
-        
-        self.ctx['database'].commit()
+        # Resume from what was already collected for this query
+        watermark = self.load_watermark(community, query)
 
-        # Return the tweets
-        for tweet in tweets:
+        # Get tweets, inserting them into unprocessed table in DB a page at a time.
+        # The watermark is saved with every page, so an interrupted get loses nothing
+        collected = 0
+        batch = []
+        for tweet in self.ctx['twitter'].get_tweets(query, count, watermark):
             print(tweet.text)
-        return tweets
+            batch.append(tweet)
+            if len(batch) == 100:
+                self.save_tweets(community, query, batch, watermark)
+                collected += len(batch)
+                batch = []
+        # Also saved without tweets, running out of results can close a gap in the watermark
+        self.save_tweets(community, query, batch, watermark)
+        collected += len(batch)
+
+        print(f"Collected {collected} tweets for {community}")
+        return collected
+
+    def load_watermark(self, community: str, query: str) -> Watermark:
+        """
+        Reads the ids already collected for a query, see collection.twitter.Watermark
+        """
+        watermark = self.ctx['database'].select_data(
+            'since_id, max_id, pending_since_id, pending_max_id', 'watermarks',
+            "community = ? AND query = ?", (community, query))
+        return Watermark(*watermark[0]) if watermark else Watermark()
+
+    def save_tweets(self, community: str, query: str, tweets: list, watermark: Watermark) -> int:
+        """
+        Stores a page of tweets along with the query's watermark
+
+        Args:
+            community: str
+                The community the tweets were collected for
+            query: str
+                The query the tweets were found with
+            tweets: list
+                The TweetRecords to store
+            watermark: Watermark
+                The ids collected, this page included
+        Returns:
+            int
+                The number of tweets that were new
+        """
+        # Skip tweets already stored
+        inserted = self.ctx['database'].insert_many(
+            'unprocessed',
+            ['community', 'postID', 'data', 'createdAt', 'authorID', 'lang'],
+            [(community, tweet.id, tweet.text, tweet.created_at, tweet.author_id, tweet.lang) for tweet in tweets],
+            on_conflict='ignore')
+        self.ctx['database'].insert_many(
+            'watermarks',
+            ['community', 'query', 'since_id', 'max_id', 'pending_since_id', 'pending_max_id', 'updated'],
+            [(community, query, *watermark.as_tuple(), time.time())],
+            on_conflict='update',
+            conflict_columns=['community', 'query'])
+        self.ctx['database'].commit()
+        return inserted
     
+    def collect(self, args: list) -> dict:
+        """
+        Collects tweets for every community of a manifest at once
+        Every keyword is searched concurrently within the Twitter rate limit,
+        and each community stops at its target so the sample stays balanced
+
+        Examples:
+            collect --c 1000
+            collect src/data/communities.json --c 1000 --workers 4
+        
+        Args:
+            args: list
+                List of arguments passed by the user
+        Returns:
+            dict
+                Community to the number of tweets collected
+        """
+        # Get the manifest, target and number of workers from the args
+        path = args[0] if args and not args[0].startswith('--') else os.path.join(os.getcwd(), "src", "data", "communities.json")
+        try:
+            target = get_option(args, '--c', int)
+            workers = get_option(args, '--workers', int, 8)
+        except ValueError as e:
+            print(e)
+            return
+        if not os.path.exists(path):
+            print(f"Manifest {path} not found")
+            return
+
+        communities = load_manifest(path, target)
+        # Without a target a community would never start collecting
+        untargeted = [community for community, entry in communities.items() if entry['target'] <= 0]
+        if untargeted:
+            print(f"Usage: collect <manifest> --c <count>, no target for {', '.join(untargeted)}")
+            return
+        scheduler = CollectionScheduler(
+            self.ctx['twitter'],
+            {community: entry['target'] for community, entry in communities.items()},
+            workers)
+
+        # Every search resumes from its own watermark
+        queries = [
+            (community, keyword, self.load_watermark(community, keyword))
+            for community, entry in communities.items() for keyword in entry['keywords']
+        ]
+
+        # Pages arrive from the search threads, but are only stored from this one.
+        # Pages are stored whole, as their watermark covers every tweet in them,
+        # so a community can end up to a page per keyword past its target
+        try:
+            for community, keyword, tweets, watermark in scheduler.run(queries):
+                inserted = self.save_tweets(community, keyword, tweets, watermark)
+                scheduler.record(community, inserted)
+                print(' | '.join(
+                    f"{name}: {scheduler.collected[name]}/{scheduler.targets[name]}" for name in communities))
+        except KeyboardInterrupt:
+            print("Collection interrupted, run the same command to continue")
+
+        print("Collection complete")
+        return scheduler.collected
+
+    def import_archive(self, args: list) -> int:
+        """
+        Loads an archive of posts (newline delimited JSON, plain, .gz or .zst)
+        into the unprocessed table, without going through the API
+
+        Examples:
+            import gaming tweets.jsonl.gz
+            import politics RC_2019-01.zst --source reddit
+
+        Args:
+            args: list
+                List of arguments passed by the user
+        Returns:
+            int
+                Number of posts stored
+        """
+        usage = "Usage: import <community> <archive> [--source twitter|reddit]"
+        if len(args) < 2 or args[0].startswith('--') or args[1].startswith('--'):
+            print(usage)
+            return 0
+        community = args[0]
+        path = args[1]
+        source = None
+        if '--source' in args:
+            position = args.index('--source') + 1
+            if position >= len(args):
+                print(usage)
+                return 0
+            source = args[position]
+        if not os.path.exists(path):
+            print(f"Archive {path} not found")
+            return 0
+
+        posts = read_archive(path)
+        try:
+            first = next(posts, None)
+        except (ImportError, OSError) as e:
+            print(f"Could not read {path}: {e}")
+            return 0
+        if first is None:
+            print(f"No posts found in {path}")
+            return 0
+
+        # Without a source, tell the archive apart by its first post
+        if source is None:
+            source = 'reddit' if isinstance(first, dict) and ('subreddit' in first or 'body' in first) else 'twitter'
+        schemas = {'twitter': twitter.from_archive, 'reddit': reddit.from_archive}
+        if source not in schemas:
+            print(f"Unknown source {source}, expected one of {', '.join(schemas)}")
+            return 0
+        records = read_records(itertools.chain([first], posts), schemas[source])
+
+        # Store the records in large batches, skipping posts already stored
+        stored = 0
+        start = time.time()
+        while True:
+            batch = [(community, record.id, record.text, record.created_at, record.author_id, record.lang)
+                     for record in itertools.islice(records, 10000)]
+            if not batch:
+                break
+            stored += self.ctx['database'].insert_many(
+                'unprocessed',
+                ['community', 'postID', 'data', 'createdAt', 'authorID', 'lang'],
+                batch,
+                on_conflict='ignore')
+            self.ctx['database'].commit()
+            print(f"{stored} posts stored ({stored / max(time.time() - start, 1e-9):.0f}/s)", end='\r')
+
+        print(f"Imported {stored} {source} posts into {community}")
+        return stored
+
     def clean(self, args: list):
         """
         Cleans the data in the source table by running demoji, deurl, and deretweet
         Cleans the data by removing stop words
         Also adds toxicity metrics by running data through Perspective
+
+        Examples:
+            clean gaming
+            clean gaming --workers 8
+            clean gaming --no-dedup
         """
         # Get the name of dataset to clean
         dataset = args[0]
-        
-        # Get the data that has that name from DB
-        data = self.ctx['database'].select_data('*', 'unprocessed', f"community = '{dataset}'")
-        
-        # Clean the data
-        for row in data:
-            res = run_all(row[2])
 
-            # Insert the cleaned data into the processed table
-            self.ctx['database'].insert_data(
+        # Cleaning is CPU bound, so it can be spread over several processes
+        try:
+            workers = get_option(args, '--workers', int, 1)
+        except ValueError as e:
+            print(e)
+            return
+
+        # Near-duplicates of posts cleaned before are grouped as they are cleaned
+        index = None if '--no-dedup' in args else DuplicateIndex(self.ctx['database'])
+
+        # Only rows that are not in the processed table yet are read, so
+        # running clean again on an unchanged dataset does no work
+        new_rows = (
+            "community = ? AND NOT EXISTS "
+            "(SELECT 1 FROM processed WHERE processed.postID = unprocessed.postID)"
+        )
+
+        # Stream the new rows of that dataset from DB, cleaning and
+        # inserting them into the processed table one batch at a time.
+        # Batches come back from the pool in the order they were read, and
+        # are paged by postID so inserting them does not disturb the read
+        batches = self.ctx['database'].stream_data(
+            ['postID', 'data'], 'unprocessed', new_rows, (dataset,),
+            batch_size=1000 if workers == 1 else 5000, key_column='postID')
+        cleaned = 0
+        duplicates = 0
+        for batch in clean_batches(batches, workers):
+            cleaned += self.ctx['database'].insert_many(
                 'processed',
-                'community, postID, data',
-                f"'{dataset}', '{row[1]}', '{res}'")
-        
-        self.ctx['database'].commit()
+                ['community', 'postID', 'data'],
+                [(dataset, post_id, text) for post_id, text in batch],
+                on_conflict='ignore')
+            if index:
+                duplicates += index.add(dataset, batch)
+            self.ctx['database'].commit()
+        print(f"Cleaned {cleaned} new rows from {dataset}, {duplicates} of them near-duplicates")
 
     def gain(self, args: list):
         """
         Gains the data in the source table by running perspective API
+
+        Examples:
+            gain perspective toxicity
+            gain perspective all
+            gain perspective toxicity,insult,threat,sexually_explicit
+            gain perspective toxicity --retry-failed
         """
         # Create args
         method = args[0]
         
         if method == 'perspective':
-            valid_attributes = [
-                "ALL",
-                "TOXICITY",
-                "INSULT",
-                "THREAT",
-                "SEXUALLY_EXPLICIT",
-                "FLIRTATION",
-                "ATTACK_ON_AUTHOR",
-                "ATTACK_ON_COMMENTER",
-                "INFLAMMATORY",
-                "OBSCENE",
-            ]
-            
             # Args
-            if args[1].upper() in valid_attributes:
-                attribute = args[1].upper()
-            else:
-                attribute = 'TOXICITY'
+            # Texts that failed permanently are skipped unless asked to retry them
+            retry_failed = '--retry-failed' in args
+            args = [arg for arg in args if arg != '--retry-failed']
 
-            print("Beginning Perspective analysis")
-            # Get the data that has that name from DB
+            # An attribute set can be given as "insult,threat" or "insult threat"
             try:
-                data = self.ctx['database'].select_data('*', 'processed')
-            except Exception as e:
+                attributes = resolve_attributes(','.join(args[1:]))
+            except ValueError as e:
                 print(e)
+                print(f"Usage: gain perspective <attribute>[,<attribute>...] [--retry-failed], "
+                      f"attributes: all, {', '.join(attribute.lower() for attribute in ATTRIBUTES)}")
+                return
+            attribute_set = ','.join(attributes)
+
+            columns = [SCORE_COLUMNS[attribute] for attribute in attributes]
+            if retry_failed:
+                self.ctx['database'].custom_query("DELETE FROM dead_letters WHERE attributes = ?", (attribute_set,))
+            job = Job(self.ctx['database'], 'gain', f"perspective {attribute_set}")
+            if job.resumed:
+                print(f"Resuming job {job.job_id} ({job.done}/{job.total} rows done)")
+
+            print("Beginning Perspective analysis")
+            # Only rows missing one of the target scores are left to do,
+            # so a resumed job never rescores anything
+            missing = '(' + ' OR '.join(f"{column} IS NULL" for column in columns) + ')'
+            # Near-duplicates are not sent to the API, they get their canonical post's scores
+            pending = (
+                f"{missing} "
+                'AND postID NOT IN (SELECT postID FROM dead_letters WHERE attributes = ?) '
+                'AND postID NOT IN (SELECT postID FROM duplicates)'
+            )
+            remaining = self.ctx['database'].select_data('COUNT(*)', 'processed', pending, (attribute_set,))
+            if remaining is None:
+                job.finish('failed')
                 return
+            job.start(remaining[0][0])
+
+            # Score in chunks, each written in one transaction with the job progress.
+            # Chunks are paged by postID, so rows are streamed while they are being updated,
+            # and the next chunk is already being scored while one is written
+            failed = 0
+            community_stats = CommunityStats(self.ctx['database'])
+            chunks = self.ctx['perspective'].analyze_chunks(
+                self.ctx['database'].stream_data(
+                    ['postID', 'data'], 'processed', pending, (attribute_set,),
+                    batch_size=100, key_column='postID'),
+                attributes, return_exceptions=True, text=lambda row: row[1])
+            try:
+                for chunk, results in chunks:
+                    # Insert every metric from the response into DB at once
+                    self.ctx['database'].update_rows(
+                        'processed',
+                        columns,
+                        'postID',
+                        [(*[metrics[attribute] for attribute in attributes], row[0])
+                         for row, metrics in zip(chunk, results)
+                         if metrics and not isinstance(metrics, PerspectiveError)])
+
+                    # Texts that could not be scored go to the dead letter table, never a fake score
+                    for row, error in zip(chunk, results):
+                        if isinstance(error, PerspectiveError):
+                            failed += 1
+                            self.ctx['database'].insert_data(
+                                'dead_letters',
+                                'postID, attributes, status, error, attempts, failed',
+                                '?, ?, ?, ?, ?, ?',
+                                (row[0], attribute_set, error.status, str(error), error.attempts, time.time()))
 
-            for row in data:
-                metrics = self.ctx['perspective'].analyze(row[2], attribute)
-                
-                for metric in metrics:
-                    # Insert metrics into DB
-                    self.ctx['database'].update_row(
-                        'processed', 
-                        f"{metric.lower()}_score = '{metrics[metric]}'",
-                        f"postID = '{row[1]}'")
+                    # Posts with every score are counted in their community's aggregates
+                    community_stats.refresh([row[0] for row in chunk])
+                    job.advance(len(chunk), chunk[-1][0])
                     self.ctx['database'].commit()
-            
+            except KeyboardInterrupt:
+                chunks.close()
+                job.finish('interrupted')
+                print(f"Perspective analysis interrupted at {job.done}/{job.total} rows, run the same command to resume")
+                return
+            job.finish()
+
+            # Copy the scores of canonical posts to their duplicates
+            self.ctx['database'].update_row(
+                'processed',
+                f"({', '.join(columns)}) = (SELECT {', '.join('canonical.' + column for column in columns)} "
+                "FROM duplicates JOIN processed AS canonical ON canonical.postID = duplicates.canonicalID "
+                "WHERE duplicates.postID = processed.postID)",
+                f"{missing} AND postID IN (SELECT postID FROM duplicates)")
+            self.ctx['database'].commit()
+
+            if failed:
+                print(f"{failed} rows could not be scored, see the dead_letters table")
+            if self.ctx['perspective'].cache:
+                stats = self.ctx['perspective'].cache.stats()
+                print(f"Score cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} cached")
             print("Perspective analysis complete")
     
     def cluster(self, args: list):
@@ -179,149 +509,209 @@ class Parser():
         
         Examples:
             cluster kmeans <dataset> <k>
-            cluster community <dataset>
+            cluster community
+            cluster community --workers <n>
+            cluster community --fast
+            cluster community --fast --refresh
+            cluster minibatch --k 5
+            cluster birch --k 5 --threshold 0.1 --refit
         """
         method = args[0] # clustering method
         
         if method == 'community':
-            data = []
-            
-            # Get data
-            gaming_data = self.ctx['database'].select_data('*', 'processed', "community = 'gaming'")
-            politics_data = self.ctx['database'].select_data('*', 'processed', "community = 'politics'")
-            youtube_data = self.ctx['database'].select_data('*', 'processed', "community = 'youtube'")
-            stem_data = self.ctx['database'].select_data('*', 'processed', "community = 'stem'")
-            
-            data.append(gaming_data)
-            data.append(politics_data)
-            data.append(youtube_data)
-            data.append(stem_data)
-            
-            # 0 = community,
-            # 1 = postID, 
-            # 2 = data
-            # 3 = toxicity_score
-            # 4 = insult_score
-            # 5 = threat_score
-            # 6 = sexually_explicit_score
-            for community in data:
-                scores = {} # container for scores
-
-                for row in community: # Add scores
-                    scores[row[1]] = [row[3], row[4], row[5], row[6]]
-            
-                # Find the representative
-                cluster = get_representative(scores)
-                
-                # Add cluster rep to DB
-                self.ctx['database'].insert_data(
-                    "clusters",
-                    "cluster, "
-                    "representative, "
-                    "toxicity_score, "
-                    "insult_score, "
-                    "threat_score, "
-                    "sexually_explicit_score",
-                    f"'{community[0][0]}', "
-                    f"'{cluster[0]}', "
-                    f"'{cluster[1][0]}', "
-                    f"'{cluster[1][1]}', "
-                    f"'{cluster[1][2]}', "
-                    f"'{cluster[1][3]}'"
-                )
+            try:
+                workers = get_option(args, '--workers', int)
+            except ValueError as e:
+                print(e)
+                return
+            score_columns = ['toxicity_score', 'insult_score', 'threat_score', 'sexually_explicit_score']
+
+            # gain keeps the running aggregates current, posts scored before they
+            # existed are counted on the first run or when asked to
+            stats = CommunityStats(self.ctx['database'], score_columns)
+            added = stats.refresh() if '--refresh' in args or not stats.initialized() else 0
+
+            if '--fast' not in args:
+                # One scan of the score index, ordered by community, so every community
+                # is a contiguous block of rows and the communities come from the data.
+                # Near-duplicates would pull the representative towards spam, so they are left out
+                communities = [] # community of every block
+                starts = [] # first row of every block
+                post_ids = []
+                scores = []
+                offset = 0
+                for batch in self.ctx['database'].stream_data(
+                        ['community', 'postID'] + score_columns,
+                        'processed',
+                        "postID NOT IN (SELECT postID FROM duplicates) ORDER BY community",
+                        batch_size=10000):
+                    for row, (community, *_) in enumerate(batch):
+                        if not communities or community != communities[-1]:
+                            communities.append(community)
+                            starts.append(offset + row)
+                    post_ids.append(np.fromiter((row[1] for row in batch), dtype=np.int64, count=len(batch)))
+                    scores.append(np.array([row[2:] for row in batch], dtype=float))
+                    offset += len(batch)
+
+                groups = {}
+                if communities:
+                    post_ids = np.concatenate(post_ids)
+                    scores = np.concatenate(scores)
+                    bounds = starts + [offset]
+                    groups = {
+                        community: (post_ids[bounds[i]:bounds[i + 1]], scores[bounds[i]:bounds[i + 1]])
+                        for i, community in enumerate(communities)
+                    }
+
+                # Find the representatives, one community per process
+                representatives = dict(get_representatives(groups, workers))
+            else:
+                # Approximate: the medoid of every community's candidates, no scan needed
+                representatives = stats.representatives()
 
+            if not representatives:
+                print("No scored posts")
+                return
+            for community, cluster in representatives.items():
+                if cluster is None:
+                    print(f"No scored posts in {community}")
+
+            # Add cluster reps to DB, replacing the previous run's
+            self.ctx['database'].insert_many(
+                "clusters",
+                ["cluster", "representative"] + score_columns,
+                [(community, cluster[0], *cluster[1]) for community, cluster in representatives.items() if cluster],
+                on_conflict="replace")
+            self.ctx['database'].commit()
+
+            print(f"Counted {added} new posts")
+            for community, (count, mean, std) in sorted(stats.summary().items()):
+                print(f"{community}: {count} posts, " + ', '.join(
+                    f"{column} {value:.3f} (std {deviation:.3f})"
+                    for column, value, deviation in zip(score_columns, mean, std)))
+
+        elif method in STREAMING_METHODS:
+            try:
+                n_clusters = get_option(args, '--k', int, 5)
+                threshold = get_option(args, '--threshold', float, 0.1)
+            except ValueError as e:
+                print(e)
+                return
+            score_columns = ['toxicity_score', 'insult_score', 'threat_score', 'sexually_explicit_score']
+            path = os.path.join(os.getcwd(), "src", "data", "models", f"{method}.joblib")
+
+            # Refresh the saved model, unless asked to start over or its parameters changed
+            model = StreamingClusters.load(path) if os.path.exists(path) else None
+            if '--refit' in args or model is None or model.n_clusters != n_clusters or (
+                    method == 'birch' and getattr(model, 'threshold', None) != threshold):
+                model = StreamingClusters(method, n_clusters, threshold)
+                self.ctx['database'].custom_query("DELETE FROM cluster_fitted WHERE model = ?", (method,))
+
+            # Only scored posts the model has not seen yet are read, a chunk at a time.
+            # Chunks are paged by postID, so the fitted posts are recorded while reading
+            scored = (
+                ' AND '.join(f"{column} IS NOT NULL" for column in score_columns) + ' '
+                'AND postID NOT IN (SELECT postID FROM duplicates)'
+            )
+            new_rows = (
+                f"{scored} AND NOT EXISTS (SELECT 1 FROM cluster_fitted "
+                'WHERE cluster_fitted.model = ? AND cluster_fitted.postID = processed.postID)'
+            )
+            fitted = 0
+            for batch in self.ctx['database'].stream_data(
+                    ['postID'] + score_columns, 'processed', new_rows, (method,),
+                    batch_size=10000, key_column='postID'):
+                model.partial_fit(np.array([row[1:] for row in batch], dtype=float))
+                self.ctx['database'].insert_many(
+                    'cluster_fitted', ['model', 'postID'], [(method, row[0]) for row in batch])
+                fitted += len(batch)
+            model.finish()
+            if method == 'birch' and model.fitted:
+                # The centers are the means of the points of every cluster, read once more
+                model.measure(
+                    np.array(batch, dtype=float) for batch in self.ctx['database'].stream_data(
+                        score_columns, 'processed', scored, batch_size=10000))
+
+            # The model is saved before the fitted posts are committed, so a failed
+            # run at worst fits a few posts again on the next run
+            model.save(path)
             self.ctx['database'].commit()
 
+            print(f"Fitted {fitted} new posts, {model.seen} in total")
+            if model.fitted:
+                for label, center in enumerate(model.centers):
+                    print(f"Cluster {label}: " + ', '.join(
+                        f"{column} {value:.3f}" for column, value in zip(score_columns, center)))
+
         else:
             print("Not implemented yet")
     
     def distance(self, args: list):
         """
-        Finds the distance between two objects
+        Finds the distance between every pair of communities, from their
+        representatives (see cluster) or the centroids of their scores
+        Only the upper triangle of the matrix is stored, in the distances table
+
+        Examples:
+            distance
+            distance euclidean
+            distance mahalanobis --centroids
 
         Args:
-            args (list): _description_
+            args (list): The metric (manhattan by default, see analysis.distance.METRICS)
+                and --centroids to compare centroids instead of representatives
         """
-        distances = {
-            'gaming': {},
-            'politics': {},
-            'youtube': {},
-            'stem': {}
-        }
-        data = self.ctx['database'].select_data('*', 'clusters')
-
-        for cluster in data:
-            community = cluster[0]
-            post_id = cluster[1]
-            toxicity_score = cluster[2]
-            insult_score = cluster[3]
-            threat_score = cluster[4]
-            sexually_explicit_score = cluster[5]
-            
-            metrics = []
-            for other_cluster in data:
-                if other_cluster[0] != community:
-                    other_post_id = other_cluster[1]
-                    other_toxicity_score = other_cluster[2]
-                    other_insult_score = other_cluster[3]
-                    other_threat_score = other_cluster[4]
-                    other_sexually_explicit_score = other_cluster[5]
-                    
-                    
-                    mesaures = [
-                        (toxicity_score, other_toxicity_score), 
-                        (insult_score, other_insult_score), 
-                        (threat_score, other_threat_score), 
-                        (sexually_explicit_score, other_sexually_explicit_score)
-                    ]
-                    
-                    distance = 0
-                    for value1, value2 in mesaures:
-                        distance += ((value1 - value2) ** 2) ** 0.5
-                    
-                    distances[f"{community}"][f"{other_cluster[0]}"] = distance
-        
-        clusters = ['gaming', 'politics', 'youtube', 'stem']
-        
-        for cluster in clusters:
-            self.ctx['database'].insert_data( # Add this cluster to the DB
-                "results",
-                f"cluster",
-                f"'{cluster}'"
-            )
-        
-        # Add the distances to the DB
-        for community, metrics in distances.items():
-            for other_community in metrics:
-                try:
-                    self.ctx['database'].update_row(
-                        "results",
-                        f"{other_community} = '{metrics[other_community]}'",
-                        f"cluster = '{community}'"
-                    )
-                except KeyError:
-                    continue
-        self.ctx['database'].commit()
-        
-        '''
-        for cluster in distances.keys():
-            for community in distances.values():
-                self.ctx['database'].insert_data( # Add this cluster to the DB
-                    "results",
-                    f"cluster",
-                    f"'{cluster}'"
-                )
-            for comm in clusters:
-                try:
-                    self.ctx['database'].update_row(
-                        "results",
-                        f"{comm} = '{community[comm]}'",
-                        f"cluster = '{cluster}'"
-                    )
-                except KeyError:
-                    continue
+        metric = args[0] if args and not args[0].startswith('--') else 'manhattan'
+        if metric not in METRICS:
+            print(f"Unknown metric {metric}, expected one of {', '.join(METRICS)}")
+            return
+        score_columns = ['toxicity_score', 'insult_score', 'threat_score', 'sexually_explicit_score']
+
+        if '--centroids' in args:
+            # Centroids come from the running aggregates, see cluster community
+            stats = CommunityStats(self.ctx['database'], score_columns)
+            if not stats.initialized():
+                stats.refresh()
+                self.ctx['database'].commit()
+            data = [(community, *mean) for community, (_, mean, _) in stats.summary().items()]
+        else:
+            # The latest representative of every community
+            data = self.ctx['database'].select_data(
+                'cluster, ' + ', '.join(score_columns),
+                'clusters',
+                "rowid IN (SELECT MAX(rowid) FROM clusters GROUP BY cluster)")
+
+        communities = [row[0] for row in data or []]
+        vectors = np.array([row[1:] for row in data or []], dtype=float).reshape(len(communities), len(score_columns))
+        scored = np.isfinite(vectors).all(axis=1)
+        communities = [community for community, keep in zip(communities, scored) if keep]
+        vectors = vectors[scored]
+        if len(communities) < 2:
+            print("At least two communities with scores are needed")
+            return
+
+        # Mahalanobis distances are measured against the spread of all the posts,
+        # near-duplicates left out as they are from the centroids and representatives
+        covariance = None
+        if metric == 'mahalanobis':
+            covariance = streamed_covariance(self.ctx['database'].stream_data(
+                score_columns, 'processed', "postID NOT IN (SELECT postID FROM duplicates)", batch_size=10000))
+
+        distances = pairwise_distances(vectors, metric, covariance)
+        rows, columns, values = condensed(distances)
+        self.ctx['database'].insert_many(
+            'distances',
+            ['metric', 'community1', 'community2', 'distance'],
+            [(metric, communities[i], communities[j], float(value)) for i, j, value in zip(rows, columns, values)],
+            on_conflict='replace')
         self.ctx['database'].commit()
-        '''
+
+        # Most similar and most different community of each community
+        others = distances + np.diag(np.full(len(communities), np.inf))
+        farthest = distances.argmax(axis=1)
+        for i, community in enumerate(communities):
+            print(f"{community}: most similar {communities[others[i].argmin()]}, "
+                  f"most different {communities[farthest[i]]}")
     
     def visualize(self, args: list):
         """
@@ -0,0 +1,190 @@
+"""
+This module contains rate limiting helpers shared by the API wrappers
+
+The APIs used by this program (Perspective, Twitter) enforce quotas
+measured in queries per second, so callers share a token bucket instead
+of sleeping before every request. When the API pushes back (HTTP 429/5xx)
+the adaptive limiter lowers its rate and callers retry with backoff.
+"""
+
+import random
+import threading
+import time
+
+
+class TokenBucket():
+    """
+    Thread-safe token bucket used to enforce a request rate
+
+    Tokens are refilled continuously at `rate` tokens per second up to
+    `capacity`. Every request takes one token; when the bucket is empty the
+    caller reserves the next token and waits until it becomes available.
+    Because the wait is computed from the reservation, request latency does
+    not add to the throttling delay.
+
+    Attributes:
+        rate: float
+            Tokens added per second (the allowed QPS)
+        capacity: float
+            Maximum number of tokens the bucket can hold (the allowed burst)
+    """
+    def __init__(self, rate: float, capacity: float=1.0) -> None:
+        """
+        Sets up the token bucket
+
+        Args:
+            rate: float
+                Tokens added per second
+            capacity: float
+                Maximum number of tokens held at once
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be greater than 0")
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_window(cls, requests: int, window: float, burst: int=None) -> 'TokenBucket':
+        """
+        Sets up a bucket for a quota of requests per fixed window, e.g. 180 per 15 minutes
+        A full bucket plus the tokens refilled during a window never exceed the
+        quota, so no window of that length can go over it
+
+        Args:
+            requests: int
+                The number of requests allowed per window
+            window: float
+                The length of the window, in seconds
+            burst: int
+                The number of requests allowed at once, a tenth of the quota by default
+        Returns:
+            TokenBucket
+        """
+        burst = burst or max(1, requests // 10)
+        if burst >= requests:
+            raise ValueError("Burst must be smaller than the number of requests per window")
+        return cls((requests - burst) / window, burst)
+
+    def _refill(self, now: float) -> None:
+        """
+        Adds the tokens earned since the last refill
+        """
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self) -> float:
+        """
+        Takes a token from the bucket
+
+        Returns:
+            float
+                The number of seconds to wait before the token may be used
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> None:
+        """
+        Blocks until a token is available
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """
+    Token bucket whose rate is steered by the API's responses (AIMD)
+
+    Every success raises the rate additively, so it climbs back by about
+    `increase` QPS per second, up to the configured maximum. A throttling
+    response cuts the rate multiplicatively by `decrease`, at most once per
+    second so a burst of failures from the same window only counts once.
+
+    Attributes:
+        max_rate: float
+            The configured rate, never exceeded
+        min_rate: float
+            The floor the rate is never cut below
+        increase: float
+            QPS regained per second of successful requests
+        decrease: float
+            Factor applied to the rate when throttled
+    """
+    def __init__(self, rate: float, capacity: float=1.0, min_rate: float=None,
+                 increase: float=None, decrease: float=0.5) -> None:
+        """
+        Sets up the adaptive limiter
+
+        Args:
+            rate: float
+                The maximum (and starting) rate
+            capacity: float
+                Maximum number of tokens held at once
+            min_rate: float
+                The lowest rate allowed, defaults to rate / 64
+            increase: float
+                QPS regained per second, defaults to rate / 20
+            decrease: float
+                Multiplicative decrease applied when throttled
+        """
+        super().__init__(rate, capacity)
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 64
+        self.increase = increase or rate / 20
+        self.decrease = decrease
+        self._last_decrease = 0.0
+
+    def _set_rate(self, rate: float) -> None:
+        """
+        Changes the rate, keeping the tokens earned at the old rate
+        Callers must hold the lock
+        """
+        self._refill(time.monotonic())
+        self.rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def on_success(self) -> None:
+        """
+        Additive increase after a successful request
+        """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._set_rate(self.rate + self.increase / self.rate)
+
+    def on_throttle(self) -> None:
+        """
+        Multiplicative decrease after a throttling response
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= 1.0:
+                self._last_decrease = now
+                self._set_rate(self.rate * self.decrease)
+
+
+def backoff_delay(attempt: int, base: float=1.0, cap: float=60.0) -> float:
+    """
+    Exponential backoff with full jitter
+
+    Args:
+        attempt: int
+            The number of the retry, starting at 0
+        base: float
+            The delay ceiling of the first retry, in seconds
+        cap: float
+            The largest delay ceiling, in seconds
+    Returns:
+        float
+            Seconds to wait before retrying
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
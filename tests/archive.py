@@ -0,0 +1,106 @@
+"""
+This module is used to test the readers of archived posts
+
+Functions being tested:
+    - read_records
+    - reddit.from_archive, reddit.post_id, reddit.fullname
+    - Parser.import_archive
+"""
+
+import gzip
+import io
+import json
+import sys
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+import collection.reddit as reddit
+import collection.twitter as twitter
+from collection.archive import read_records
+from util.parser import Parser
+from tests.temp_database import TempDatabaseTestCase
+
+class TestArchive(unittest.TestCase):
+    """
+    OBJECTIVE: Test that archived posts become records with ids that never collide
+    """
+    def test_reddit_ids(self):
+        """
+        OBJECTIVE: Test that comments, submissions and tweets with the same number get different ids
+        """
+        comment = reddit.from_archive({"id": "10", "body": "a comment", "created_utc": "1546300800"})
+        submission = reddit.from_archive({"id": "10", "title": "a submission"})
+        tweet = twitter.from_archive({"id": 36, "text": "a tweet"})
+
+        self.assertEqual(len({comment.id, submission.id, tweet.id}), 3)
+        self.assertEqual(reddit.fullname(comment.id), "t1_10")
+        self.assertEqual(reddit.fullname(submission.id), "t3_10")
+        self.assertEqual(comment.created_at, "2019-01-01T00:00:00+00:00")
+        self.assertIsInstance(comment, twitter.TweetRecord)
+        for reddit_id in ("0", "z", "abc12", "zzzzzzzz"):
+            self.assertEqual(reddit.fullname(reddit.post_id('t3', reddit_id)), f"t3_{reddit_id}")
+
+    def test_malformed_records(self):
+        """
+        OBJECTIVE: Test that malformed posts are skipped instead of stopping the import
+        """
+        posts = [
+            {"id": "1", "text": "fine"},
+            {"id": "2", "text": "bad date", "created_at": "Someday"},
+            {"id": "not a number", "text": "bad id"},
+            ["not", "a", "post"],
+            {"delete": {"status": {"id": 3}}},
+            {"id": "4", "text": "also fine", "created_at": "Wed Oct 10 20:19:24 +0000 2018"},
+        ]
+        with self.assertLogs(level='WARNING'):
+            records = list(read_records(posts, twitter.from_archive))
+        self.assertEqual([record.id for record in records], [1, 4])
+        self.assertEqual(records[1].created_at, "2018-10-10T20:19:24+00:00")
+
+class TestImport(TempDatabaseTestCase):
+    """
+    OBJECTIVE: Test that archives are imported and bad arguments print a usage message
+    """
+    def run_import(self, args: list) -> tuple:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            stored = Parser({'database': self.database}).import_archive(args)
+        return stored, output.getvalue()
+
+    def test_import(self):
+        """
+        OBJECTIVE: Test that a gzip archive is stored in the unprocessed table
+        """
+        with gzip.open("tweets.jsonl.gz", "wt", encoding="utf-8") as file:
+            for tweet_id in range(3):
+                file.write(json.dumps({"id": tweet_id, "text": f"tweet {tweet_id}", "lang": "en"}) + "\n")
+        stored, _ = self.run_import(["gaming", "tweets.jsonl.gz"])
+        self.assertEqual(stored, 3)
+        rows = self.database.select_data("community, postID, data, lang", "unprocessed")
+        self.assertEqual(sorted(rows), [("gaming", i, f"tweet {i}", "en") for i in range(3)])
+
+    def test_bad_arguments(self):
+        """
+        OBJECTIVE: Test that missing arguments, missing files and unreadable archives return without raising
+        """
+        open("posts.zst", "wb").close()
+        cases = [
+            ([], "Usage: import"),
+            (["gaming"], "Usage: import"),
+            (["gaming", "missing.jsonl"], "not found"),
+            (["gaming", "posts.zst", "--source"], "Usage: import"),
+        ]
+        for args, message in cases:
+            stored, output = self.run_import(args)
+            self.assertEqual(stored, 0)
+            self.assertIn(message, output)
+
+        # Without the optional zstandard package
+        with mock.patch.dict(sys.modules, {'zstandard': None}):
+            stored, output = self.run_import(["gaming", "posts.zst"])
+        self.assertEqual(stored, 0)
+        self.assertIn("requires the zstandard package", output)
+
+if __name__ == "__main__":
+    unittest.main()
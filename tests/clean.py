@@ -0,0 +1,129 @@
+"""
+This module is used to test the text cleaning functions
+run_all is checked against a golden corpus of tweets and their
+expected cleaned output, recorded from the step by step implementation
+
+Functions being tested:
+    - run_all
+    - demoji, deurl, deretweet, demention, dehashtag
+    - clean_many, clean_batches
+    - remove_stopwords, tokenize_many
+    - Parser.clean only reading rows that are not cleaned yet
+"""
+
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+
+import preprocessing.clean as clean
+from util.parser import Parser
+from tests.temp_database import TempDatabaseTestCase
+
+GOLDEN_CORPUS = "tests/resources/clean_golden.jsonl"
+
+class TestClean(unittest.TestCase):
+    """
+    OBJECTIVE: Test the cleaning functions
+    """
+    def setUp(self):
+        with open(GOLDEN_CORPUS, "r", encoding="utf-8") as file:
+            self.cases = [json.loads(line) for line in file]
+
+    def test_run_all_golden(self):
+        """
+        OBJECTIVE: Test that run_all reproduces the golden corpus exactly
+        """
+        for case in self.cases:
+            with self.subTest(text=case["text"]):
+                self.assertEqual(clean.run_all(case["text"]), case["expected"])
+
+    def test_run_all_matches_steps(self):
+        """
+        OBJECTIVE: Test that run_all gives the same text as running each step in turn
+        """
+        for case in self.cases:
+            text = case["text"]
+            for char in "'\"\n\r\t":
+                text = text.replace(char, "")
+            text = clean.demoji(text) or case["text"]
+            text = clean.dehashtag(clean.demention(clean.deretweet(clean.deurl(text))))
+            text = text.replace("  ", " ").strip() or case["text"]
+            with self.subTest(text=case["text"]):
+                self.assertEqual(clean.run_all(case["text"]), text)
+
+    def test_clean_batches_order(self):
+        """
+        OBJECTIVE: Test that batches cleaned across processes come back in order
+        """
+        rows = [(post_id, case["text"]) for post_id, case in enumerate(self.cases)]
+        batches = [rows[i:i + 10] for i in range(0, len(rows), 10)]
+        expected = [(post_id, case["expected"]) for post_id, case in enumerate(self.cases)]
+
+        cleaned = [row for batch in clean.clean_batches(iter(batches), workers=2) for row in batch]
+        self.assertEqual(cleaned, expected)
+        texts = [case["text"] for case in self.cases]
+        self.assertEqual(clean.clean_many(texts, workers=2, chunksize=10), [row[1] for row in expected])
+
+    def test_remove_stopwords_custom(self):
+        """
+        OBJECTIVE: Test stop word removal with a custom list and the regex tokenizer
+        """
+        self.assertEqual(
+            clean.tokenize_many(["I don't know... it's fine, can't be!"], tokenizer='regex'),
+            [["I", "do", "n't", "know", "...", "it", "'s", "fine", ",", "ca", "n't", "be", "!"]])
+        self.assertEqual(
+            clean.remove_stopwords("the cat is not a dog", [], ["the", "is", "a"], tokenizer='regex'),
+            "cat not dog")
+        self.assertEqual(
+            clean.remove_stopwords_many(["the cat", "a dog"], [], ["the", "a"], tokenizer='regex', return_tokens=True),
+            [["cat"], ["dog"]])
+        self.assertIs(clean.get_stopwords([], ["the"]), clean.get_stopwords([], ["the"]))
+
+class TestIncrementalClean(TempDatabaseTestCase):
+    """
+    OBJECTIVE: Test that clean only reads the rows of a community that are not cleaned yet
+    """
+    def setUp(self):
+        super().setUp()
+        self.database.insert_many(
+            'unprocessed', ['community', 'postID', 'data'],
+            [('gaming' if post_id % 2 else 'stem', post_id, f"RT @user post number {post_id} https://t.co/x")
+             for post_id in range(300)])
+        self.database.commit()
+
+        # Every row handed to clean by the database
+        self.read = []
+        stream_data = self.database.stream_data
+        def counting_stream_data(*args, **kwargs):
+            for batch in stream_data(*args, **kwargs):
+                self.read.extend(batch)
+                yield batch
+        self.database.stream_data = counting_stream_data
+
+    def clean(self, args: list) -> str:
+        self.read = []
+        output = io.StringIO()
+        with redirect_stdout(output):
+            Parser({'database': self.database}).parse(["clean", *args, "--no-dedup"])
+        return output.getvalue()
+
+    def test_second_run(self):
+        """
+        OBJECTIVE: Test that a second run on an unchanged dataset reads nothing, and a later run only the new rows
+        """
+        self.assertIn("Cleaned 150 new rows from gaming", self.clean(["gaming"]))
+        self.assertEqual(sorted(row[0] for row in self.read), list(range(1, 300, 2)))
+        self.assertEqual(self.database.select_data('data', 'processed', 'postID = 1'), [("post number 1",)])
+
+        self.assertIn("Cleaned 0 new rows from gaming", self.clean(["gaming"]))
+        self.assertEqual(self.read, [])
+
+        self.database.insert_many('unprocessed', ['community', 'postID', 'data'], [('gaming', 1001, "new post")])
+        self.database.commit()
+        self.assertIn("Cleaned 1 new rows from gaming", self.clean(["gaming"]))
+        self.assertEqual(self.read, [(1001, "new post")])
+        self.assertEqual(self.database.select_data('COUNT(*)', 'processed', "community = 'stem'"), [(0,)])
+
+if __name__ == "__main__":
+    unittest.main()
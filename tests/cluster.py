@@ -0,0 +1,248 @@
+"""
+This module is used to test the representative (medoid) search
+
+Functions being tested:
+    - medoid
+    - approximate_medoid
+    - get_representative
+    - get_representatives
+    - StreamingClusters
+    - Parser.cluster birch, refitting when its parameters change
+    - CommunityStats
+    - Parser.cluster community, exact by default and approximate with --fast
+    - the one time cleanup of the clusters table
+"""
+
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import numpy as np
+
+import analysis.cluster as cluster
+from util.configuration import Configuration
+from util.parser import Parser
+from tests.temp_database import TempDatabaseTestCase
+
+def brute_force_sums(data: np.ndarray) -> np.ndarray:
+    """
+    Sum of the distances from every point to all others, with the full distance matrix
+    """
+    return np.linalg.norm(data[:, None, :] - data[None, :, :], axis=2).sum(axis=1)
+
+class TestMedoid(unittest.TestCase):
+    """
+    OBJECTIVE: Test the exact and approximate medoids
+    """
+    def setUp(self):
+        generator = np.random.default_rng(0)
+        self.uniform = generator.random((500, 4))
+        self.skewed = generator.beta(0.5, 5, size=(500, 4))
+
+    def test_exact(self):
+        """
+        OBJECTIVE: Test that the chunked search finds the point with the smallest distance sum
+        """
+        for data in (self.uniform, self.skewed, self.uniform[:1], self.uniform[:2]):
+            sums = brute_force_sums(data)
+            self.assertAlmostEqual(sums[cluster.medoid(data, chunk_size=16)], sums.min())
+
+    def test_approximate(self):
+        """
+        OBJECTIVE: Test that CLARA lands close to the exact medoid
+        """
+        sums = brute_force_sums(self.uniform)
+        index = cluster.approximate_medoid(self.uniform, sample_size=100, samples=5)
+        self.assertLess(sums[index], sums.min() * 1.02)
+
+    def test_get_representative(self):
+        """
+        OBJECTIVE: Test that the representative is returned by postID and unscored posts are skipped
+        """
+        scores = {post_id + 1000: list(row) for post_id, row in enumerate(self.skewed)}
+        scores[1] = [None, 0.5, 0.5, 0.5]
+        expected = int(np.argmin(brute_force_sums(self.skewed))) + 1000
+
+        post_id, value = cluster.get_representative(scores)
+        self.assertEqual(post_id, expected)
+        self.assertEqual(value, scores[expected])
+        self.assertIsNone(cluster.get_representative({1: [None, None]}))
+
+    def test_get_representatives(self):
+        """
+        OBJECTIVE: Test that the pool finds the same representative as get_representative for every cluster
+        """
+        groups = {
+            'uniform': (np.arange(500, dtype=np.int64), self.uniform),
+            'skewed': (np.arange(500, 1000, dtype=np.int64), self.skewed),
+            'empty': (np.array([7], dtype=np.int64), np.full((1, 4), np.nan)),
+        }
+        found = dict(cluster.get_representatives(groups, workers=2))
+        self.assertEqual(set(found), set(groups))
+        self.assertIsNone(found['empty'])
+        for name in ('uniform', 'skewed'):
+            keys, data = groups[name]
+            expected = cluster.get_representative({int(key): list(row) for key, row in zip(keys, data)})
+            self.assertEqual(found[name][0], expected[0])
+            np.testing.assert_allclose(found[name][1], expected[1])
+
+class TestStreamingClusters(unittest.TestCase):
+    """
+    OBJECTIVE: Test the clusters fitted a chunk at a time
+    """
+    def setUp(self):
+        generator = np.random.default_rng(0)
+        self.centers = np.array([[0.1, 0.1, 0.1, 0.1], [0.9, 0.1, 0.5, 0.1], [0.5, 0.9, 0.1, 0.9]])
+        self.data = self.centers[generator.integers(0, 3, 6000)] + generator.normal(0, 0.02, (6000, 4))
+
+    def test_methods(self):
+        """
+        OBJECTIVE: Test that both methods find the centers from chunks, including chunks smaller than k
+        """
+        for method in cluster.STREAMING_METHODS:
+            chunks = [self.data[:2]] + [self.data[start:start + 500] for start in range(2, 6000, 500)]
+            model = cluster.StreamingClusters(method, n_clusters=3, batch_size=256).fit_batches(chunks)
+            if method == 'birch':
+                model.measure(chunks)
+            centers = model.centers[np.argsort(model.centers[:, 0])]
+            np.testing.assert_allclose(centers, self.centers[np.argsort(self.centers[:, 0])], atol=0.02)
+            self.assertEqual(len(set(model.predict(self.centers))), 3)
+
+    def test_birch_centers(self):
+        """
+        OBJECTIVE: Test that BIRCH centers are the means of their points, however unevenly the points are spread
+        """
+        # The first cluster is a large and a small blob, each its own subcluster
+        generator = np.random.default_rng(1)
+        large = generator.normal(0.1, 0.005, (3000, 4))
+        small = generator.normal(0.4, 0.005, (100, 4))
+        far = generator.normal(0.9, 0.005, (100, 4))
+        data = np.vstack([large, small, far])
+        chunks = [data[:1500], data[1500:]]
+        model = cluster.StreamingClusters('birch', n_clusters=2, threshold=0.05).fit_batches(chunks)
+        with self.assertRaises(ValueError):
+            model.centers
+        model.measure(chunks)
+        centers = model.centers[np.argsort(model.centers[:, 0])]
+        np.testing.assert_allclose(centers[0], np.vstack([large, small]).mean(axis=0), atol=1e-3)
+        np.testing.assert_allclose(centers[1], far.mean(axis=0), atol=1e-3)
+
+    def test_refresh(self):
+        """
+        OBJECTIVE: Test that a saved model is refreshed with new chunks
+        """
+        model = cluster.StreamingClusters('birch', n_clusters=3).fit_batches([self.data[:3000]])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'models', 'birch.joblib')
+            model.save(path)
+            model = cluster.StreamingClusters.load(path)
+        model.fit_batches([self.data[3000:]])
+        model.measure([self.data])
+        self.assertEqual(model.seen, 6000)
+        self.assertEqual(len(model.centers), 3)
+
+class TestCommunityStats(TempDatabaseTestCase):
+    """
+    OBJECTIVE: Test that the running aggregates cover every scored post
+    """
+    def setUp(self):
+        super().setUp()
+        self.columns = ['toxicity_score', 'insult_score', 'threat_score', 'sexually_explicit_score']
+        self.scores = np.random.default_rng(3).random((330, 4))
+
+    def score(self, community: str, post_ids: range) -> None:
+        self.database.insert_many(
+            'processed', ['community', 'postID', 'data'] + self.columns,
+            [(community, post_id, f"post {post_id}", *self.scores[post_id]) for post_id in post_ids])
+
+    def test_scored_before(self):
+        """
+        OBJECTIVE: Test that the first incremental update also counts the posts scored before the aggregates existed
+        """
+        self.score('gaming', range(0, 200))
+        self.score('stem', range(200, 300))
+        self.database.commit()
+
+        # As gain does after scoring a chunk
+        stats = cluster.CommunityStats(self.database, self.columns, random_state=0)
+        self.assertFalse(stats.initialized())
+        self.score('gaming', range(300, 310))
+        self.assertEqual(stats.refresh(list(range(300, 310))), 310)
+        self.assertTrue(stats.initialized())
+
+        # Later updates only read their chunk
+        self.score('stem', range(310, 330))
+        self.assertEqual(stats.refresh(list(range(310, 330))), 20)
+        self.assertEqual(stats.refresh(), 0)
+
+        summary = stats.summary()
+        expected = {
+            'gaming': self.scores[list(range(0, 200)) + list(range(300, 310))],
+            'stem': self.scores[list(range(200, 300)) + list(range(310, 330))],
+        }
+        self.assertEqual(sorted(summary), sorted(expected))
+        for community, scores in expected.items():
+            count, mean, std = summary[community]
+            self.assertEqual(count, len(scores))
+            np.testing.assert_allclose(mean, scores.mean(axis=0))
+
+    def cluster_community(self, args: list=()) -> dict:
+        with redirect_stdout(io.StringIO()):
+            Parser({'database': self.database}).parse(["cluster", "community", *args])
+        return dict(self.database.select_data('cluster, representative', 'clusters'))
+
+    def test_exact_by_default(self):
+        """
+        OBJECTIVE: Test that the exact medoid is stored unless the approximate one is asked for
+        """
+        # More posts than candidates, so the approximate medoid comes from a sample
+        self.score('gaming', range(0, 330))
+        self.database.commit()
+
+        exact = int(np.argmin(brute_force_sums(self.scores)))
+        self.assertEqual(self.cluster_community(), {'gaming': exact})
+
+        representatives = self.cluster_community(["--fast"])
+        stats = cluster.CommunityStats(self.database, self.columns)
+        self.assertEqual(representatives, {'gaming': stats.representatives()['gaming'][0]})
+
+    def test_birch_command(self):
+        """
+        OBJECTIVE: Test that cluster birch refreshes its saved model, and refits it when the threshold changes
+        """
+        self.score('gaming', range(0, 300))
+        self.database.commit()
+
+        def run(args: list) -> str:
+            output = io.StringIO()
+            with redirect_stdout(output):
+                Parser({'database': self.database}).parse(["cluster", "birch", "--k", "1", *args])
+            return output.getvalue()
+
+        output = run(["--threshold", "0.2"])
+        self.assertIn("Fitted 300 new posts, 300 in total", output)
+        # A single cluster is centered on the mean of every post
+        model = cluster.StreamingClusters.load(os.path.join("src", "data", "models", "birch.joblib"))
+        np.testing.assert_allclose(model.centers[0], self.scores[:300].mean(axis=0))
+
+        self.score('gaming', range(300, 330))
+        self.database.commit()
+        self.assertIn("Fitted 30 new posts, 330 in total", run(["--threshold", "0.2"]))
+        self.assertIn("Fitted 330 new posts, 330 in total", run(["--threshold", "0.3"]))
+
+    def test_clusters_cleanup(self):
+        """
+        OBJECTIVE: Test that older representatives are dropped once, when the unique index is added
+        """
+        self.database.custom_query("DROP INDEX clusters_cluster")
+        self.database.insert_many('clusters', ['cluster', 'representative'], [('gaming', 1), ('gaming', 2), ('stem', 3)])
+        self.database.commit()
+
+        Configuration().setup_database()
+        self.assertEqual(sorted(self.database.select_data('cluster, representative', 'clusters')), [('gaming', 2), ('stem', 3)])
+        self.assertIn('clusters_cluster', self.database.table_indexes('clusters'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+This module is used to test the batched reads and writes of the database
+
+Functions being tested:
+    - Database.insert_many
+    - Database.stream_data, Database.stream_rows
+"""
+
+import unittest
+
+from tests.temp_database import TempDatabaseTestCase
+
+class TestInsertMany(TempDatabaseTestCase):
+    """
+    OBJECTIVE: Test that batches are inserted as given, with every conflict mode
+    """
+    def setUp(self):
+        super().setUp()
+        self.database.create_table("items", "itemID int, name TEXT, count int, PRIMARY KEY (itemID)")
+
+    def items(self) -> list:
+        return sorted(self.database.select_data("itemID, name, count", "items"))
+
+    def test_quotes(self):
+        """
+        OBJECTIVE: Test that text containing quotes is stored as is
+        """
+        names = ["it's", 'say "hi"', "'); DROP TABLE items; --"]
+        self.assertEqual(self.database.insert_many("items", ["itemID", "name", "count"],
+                                                   [(i, name, 0) for i, name in enumerate(names)]), 3)
+        self.assertEqual(self.items(), [(i, name, 0) for i, name in enumerate(names)])
+
+    def test_conflicts(self):
+        """
+        OBJECTIVE: Test that conflicting rows are skipped, replaced or updated
+        """
+        columns = ["itemID", "name", "count"]
+        self.database.insert_many("items", columns, [(1, "first", 1)])
+
+        self.assertEqual(self.database.insert_many("items", columns, [(1, "ignored", 2), (2, "second", 2)],
+                                                   on_conflict="ignore"), 1)
+        self.assertEqual(self.items(), [(1, "first", 1), (2, "second", 2)])
+
+        self.database.insert_many("items", columns, [(1, "replaced", 3)], on_conflict="replace")
+        self.assertEqual(self.items(), [(1, "replaced", 3), (2, "second", 2)])
+
+        self.database.insert_many("items", columns, [(1, "kept", 4), (3, "third", 3)],
+                                  on_conflict="update", conflict_columns=["itemID"], update_columns=["count"])
+        self.assertEqual(self.items(), [(1, "replaced", 4), (2, "second", 2), (3, "third", 3)])
+
+        self.database.insert_many("items", columns, [(2, "updated", 5)],
+                                  on_conflict="update", conflict_columns=["itemID"])
+        self.assertEqual(self.items(), [(1, "replaced", 4), (2, "updated", 5), (3, "third", 3)])
+
+    def test_bad_mode(self):
+        """
+        OBJECTIVE: Test that an upsert without conflict columns or an unknown mode is refused
+        """
+        with self.assertRaises(ValueError):
+            self.database.insert_many("items", ["itemID", "name"], [(1, "first")], on_conflict="update")
+        with self.assertRaises(ValueError):
+            self.database.insert_many("items", ["itemID", "name"], [(1, "first")], on_conflict="skip")
+        self.assertEqual(self.items(), [])
+
+    def test_rollback(self):
+        """
+        OBJECTIVE: Test that a failing row drops its whole batch but keeps the caller's pending writes
+        """
+        self.database.insert_data("items", "itemID, name, count", "?, ?, ?", (1, "pending", 0))
+        with self.assertLogs(level="WARNING"):
+            count = self.database.insert_many("items", ["itemID", "name", "count"], [(2, "new", 0), (1, "duplicate", 0)])
+        self.assertEqual(count, 0)
+        self.database.commit()
+        self.assertEqual(self.items(), [(1, "pending", 0)])
+
+class TestStreamData(TempDatabaseTestCase):
+    """
+    OBJECTIVE: Test that tables are read in batches of the requested size, every row once
+    """
+    def setUp(self):
+        super().setUp()
+        self.database.create_table("items", "itemID int, name TEXT, count int, PRIMARY KEY (itemID)")
+        # Inserted out of order, keyset pages still come sorted by key
+        self.database.insert_many("items", ["itemID", "name", "count"],
+                                  [(item_id, f"item {item_id}", item_id % 3) for item_id in reversed(range(2500))])
+        self.database.commit()
+
+    def test_batch_size(self):
+        """
+        OBJECTIVE: Test that both modes yield full batches followed by the remainder
+        """
+        for key_column in (None, "itemID"):
+            batches = list(self.database.stream_data(["itemID", "name"], "items", batch_size=1000, key_column=key_column))
+            self.assertEqual([len(batch) for batch in batches], [1000, 1000, 500])
+            self.assertEqual(sorted(row for batch in batches for row in batch),
+                             [(item_id, f"item {item_id}") for item_id in range(2500)])
+        batches = list(self.database.stream_data("itemID", "items", "count = ?", (0,), batch_size=300, key_column="itemID"))
+        self.assertEqual([len(batch) for batch in batches], [300, 300, 234])
+        self.assertEqual([row[0] for batch in batches for row in batch], list(range(0, 2500, 3)))
+        self.assertEqual(len(list(self.database.stream_rows("itemID", "items", batch_size=7))), 2500)
+
+    def test_keyset_while_updating(self):
+        """
+        OBJECTIVE: Test that keyset pages stay correct while the caller updates the rows being read
+        """
+        seen = []
+        for batch in self.database.stream_data(["itemID"], "items", "count = 0", batch_size=100, key_column="itemID"):
+            seen.extend(row[0] for row in batch)
+            # As gain does, the rows read leave the filter before the next page
+            self.database.update_rows("items", ["count"], "itemID", [(1, row[0]) for row in batch])
+            self.database.commit()
+        self.assertEqual(seen, list(range(0, 2500, 3)))
+        self.assertEqual(self.database.select_data("COUNT(*)", "items", "count = 0"), [(0,)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+This module is used to test the near-duplicate detection
+
+Functions being tested:
+    - minhash_many
+    - band_keys
+    - similarity
+    - DuplicateIndex.add
+    - Parser.gain copying the scores of canonical posts to their duplicates
+"""
+
+import random
+import unittest
+
+import numpy as np
+
+import analysis.dedup as dedup
+from util.parser import Parser
+from tests.temp_database import TempDatabaseTestCase
+
+class TestMinHash(unittest.TestCase):
+    """
+    OBJECTIVE: Test the MinHash signatures and LSH bands
+    """
+    def test_similarity_estimate(self):
+        """
+        OBJECTIVE: Test that signatures estimate the Jaccard similarity of the word sets
+        """
+        words = [f"word{i}" for i in range(100)]
+        texts = [' '.join(words), ' '.join(words[:90]), ' '.join(words[50:]), ' '.join(reversed(words))]
+        signatures = dedup.minhash_many(texts, chunk_size=3)
+
+        self.assertEqual(signatures.shape, (4, dedup.NUM_PERM))
+        self.assertEqual(dedup.similarity(signatures[0], signatures[3]), 1.0)
+        self.assertAlmostEqual(dedup.similarity(signatures[0], signatures[1]), 0.9, delta=0.15)
+        self.assertAlmostEqual(dedup.similarity(signatures[0], signatures[2]), 0.5, delta=0.15)
+
+    def test_band_keys(self):
+        """
+        OBJECTIVE: Test that identical word sets share every bucket, across runs
+        """
+        signatures = dedup.minhash_many(["Hello there world", "hello THERE world", "something else"])
+        keys = dedup.band_keys(signatures)
+
+        self.assertEqual(keys.shape, (3, dedup.BANDS))
+        self.assertTrue(np.array_equal(keys[0], keys[1]))
+        self.assertFalse(np.any(keys[0] == keys[2]))
+        self.assertTrue(np.array_equal(signatures, dedup.minhash_many(["Hello there world", "hello THERE world", "something else"])))
+
+class FakePerspective():
+    """
+    Scores every text with a different value, keeping the texts it was asked for
+    """
+    cache = None
+
+    def __init__(self) -> None:
+        self.texts = []
+
+    def analyze_many(self, texts: list, attributes, return_exceptions: bool=False) -> list:
+        self.texts.extend(texts)
+        return [{attribute: (len(self.texts) - len(texts) + i + 1) / 100 for attribute in attributes}
+                for i in range(len(texts))]
+
+    def analyze_chunks(self, chunks, attributes, return_exceptions: bool=False, text=None):
+        for chunk in chunks:
+            yield chunk, self.analyze_many([text(item) for item in chunk], attributes, return_exceptions)
+
+class TestDuplicateIndex(TempDatabaseTestCase):
+    """
+    OBJECTIVE: Test the index and the scoring of duplicates against a database
+    """
+    def setUp(self):
+        super().setUp()
+        generator = random.Random(0)
+        vocabulary = [f"word{i}" for i in range(5000)]
+        self.texts = [' '.join(generator.sample(vocabulary, 40)) for _ in range(4)]
+        # Same post with one word changed, about 0.95 similar
+        self.copy = self.texts[0].rsplit(' ', 1)[0] + " changed"
+
+    def test_add(self):
+        """
+        OBJECTIVE: Test that a near-duplicate of an indexed post is found, in a later batch and in the same batch
+        """
+        index = dedup.DuplicateIndex(self.database)
+        self.assertEqual(index.add("gaming", [(1, self.texts[0]), (2, self.texts[1])]), 0)
+        self.assertEqual(index.add("gaming", [(3, self.copy), (4, self.texts[2]), (5, self.texts[2])]), 2)
+        # Other communities are indexed separately
+        self.assertEqual(index.add("stem", [(6, self.copy)]), 0)
+
+        duplicates = self.database.select_data("postID, canonicalID", "duplicates")
+        self.assertEqual(sorted(duplicates), [(3, 1), (5, 4)])
+
+    def test_gain_copies_scores(self):
+        """
+        OBJECTIVE: Test that gain scores only canonical posts and copies their scores to the duplicates
+        """
+        rows = [(1, self.texts[0]), (2, self.texts[1]), (3, self.copy)]
+        self.database.insert_many("processed", ["community", "postID", "data"], [("gaming", *row) for row in rows])
+        dedup.DuplicateIndex(self.database).add("gaming", rows)
+        self.database.commit()
+
+        perspective = FakePerspective()
+        Parser({'database': self.database, 'perspective': perspective}).parse(["gain", "perspective", "toxicity"])
+
+        self.assertEqual(sorted(perspective.texts), sorted([self.texts[0], self.texts[1]]))
+        scores = dict(self.database.select_data("postID, toxicity_score", "processed"))
+        self.assertIsNotNone(scores[1])
+        self.assertEqual(scores[3], scores[1])
+        self.assertNotEqual(scores[2], scores[1])
+
+if __name__ == "__main__":
+    unittest.main()
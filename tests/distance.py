@@ -0,0 +1,74 @@
+"""
+This module is used to test the community distance measures
+
+Functions being tested:
+    - pairwise_distances
+    - streamed_covariance
+    - condensed
+"""
+
+import unittest
+
+import numpy as np
+
+import analysis.distance as distance
+
+class TestPairwiseDistances(unittest.TestCase):
+    """
+    OBJECTIVE: Test that the distance matrix matches distances computed pair by pair
+    """
+    def setUp(self):
+        generator = np.random.default_rng(1)
+        self.vectors = generator.random((40, 4))
+        self.posts = generator.random((3000, 4))
+
+    def loop_distances(self, metric, inverse=None):
+        expected = np.zeros((len(self.vectors), len(self.vectors)))
+        for i, u in enumerate(self.vectors):
+            for j, v in enumerate(self.vectors):
+                if metric == 'euclidean':
+                    expected[i, j] = np.sqrt(((u - v) ** 2).sum())
+                elif metric == 'manhattan':
+                    expected[i, j] = np.abs(u - v).sum()
+                elif metric == 'cosine':
+                    expected[i, j] = 1 - u @ v / (np.linalg.norm(u) * np.linalg.norm(v))
+                else:
+                    expected[i, j] = np.sqrt((u - v) @ inverse @ (u - v))
+        return expected
+
+    def test_metrics(self):
+        """
+        OBJECTIVE: Test every metric against a loop over the pairs
+        """
+        covariance = np.cov(self.posts, rowvar=False)
+        for metric in distance.METRICS:
+            matrix = distance.pairwise_distances(self.vectors, metric, covariance, chunk_size=7)
+            expected = self.loop_distances(metric, np.linalg.inv(covariance))
+            np.testing.assert_allclose(matrix, expected, atol=1e-9, err_msg=metric)
+
+    def test_get_distance(self):
+        """
+        OBJECTIVE: Test that get_distance keeps the sum of the absolute differences
+        """
+        self.assertAlmostEqual(distance.get_distance([1, 2, 3], [3, 2, 0]), 5.0)
+
+    def test_streamed_covariance(self):
+        """
+        OBJECTIVE: Test that the covariance read in batches matches numpy's, skipping missing scores
+        """
+        posts = np.vstack([self.posts, [[np.nan, 0, 0, 0]]])
+        batches = [posts[start:start + 1000] for start in range(0, len(posts), 1000)]
+        np.testing.assert_allclose(distance.streamed_covariance(batches), np.cov(self.posts, rowvar=False))
+
+    def test_condensed(self):
+        """
+        OBJECTIVE: Test that only the pairs above the diagonal are kept
+        """
+        matrix = distance.pairwise_distances(self.vectors)
+        rows, columns, values = distance.condensed(matrix)
+        self.assertEqual(len(values), 40 * 39 // 2)
+        self.assertTrue((rows < columns).all())
+        np.testing.assert_allclose(values, matrix[rows, columns])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+This module is used to test the resumable scoring jobs
+
+Functions being tested:
+    - Job
+    - Parser.gain resuming an interrupted run, retrying failed texts and rejecting unknown attributes
+"""
+
+import io
+import unittest
+from contextlib import redirect_stdout
+
+from preprocessing.perspective import PerspectiveError
+from util.jobs import Job
+from util.parser import Parser
+from tests.temp_database import TempDatabaseTestCase
+
+class FakePerspective():
+    """
+    Scores every text with 0.5, keeping the texts it was asked for
+
+    Attributes:
+        interrupt_after: int
+            Number of calls answered before the user interrupts the run, None to never interrupt
+        failing: set
+            Texts that cannot be scored
+    """
+    cache = None
+
+    def __init__(self, interrupt_after: int=None, failing: set=()) -> None:
+        self.interrupt_after = interrupt_after
+        self.failing = set(failing)
+        self.texts = []
+        self.calls = 0
+
+    def analyze_many(self, texts: list, attributes, return_exceptions: bool=False) -> list:
+        if self.calls == self.interrupt_after:
+            raise KeyboardInterrupt
+        self.calls += 1
+        self.texts.extend(texts)
+        return [PerspectiveError("Bad request", 400) if text in self.failing else {attribute: 0.5 for attribute in attributes}
+                for text in texts]
+
+    def analyze_chunks(self, chunks, attributes, return_exceptions: bool=False, text=None):
+        for chunk in chunks:
+            yield chunk, self.analyze_many([text(item) for item in chunk], attributes, return_exceptions)
+
+class TestGainJob(TempDatabaseTestCase):
+    """
+    OBJECTIVE: Test that an interrupted gain resumes where it stopped
+    """
+    def setUp(self):
+        super().setUp()
+        self.texts = [f"post {post_id}" for post_id in range(250)]
+        self.database.insert_many(
+            'processed', ['community', 'postID', 'data'],
+            [('gaming', post_id, text) for post_id, text in enumerate(self.texts)])
+        self.database.commit()
+
+    def gain(self, perspective: FakePerspective, args: list=()) -> str:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            Parser({'database': self.database, 'perspective': perspective}).parse(["gain", "perspective", "toxicity", *args])
+        return output.getvalue()
+
+    def job(self) -> tuple:
+        return self.database.select_data('jobID, status, done, total', 'jobs', "command = 'gain'")
+
+    def scored(self) -> int:
+        return self.database.select_data('COUNT(*)', 'processed', 'toxicity_score IS NOT NULL')[0][0]
+
+    def test_resume(self):
+        """
+        OBJECTIVE: Test that a resumed job keeps its progress and never rescores a row
+        """
+        first = FakePerspective(interrupt_after=1)
+        self.assertIn("interrupted at 100/250", self.gain(first))
+        self.assertEqual(self.job(), [(1, 'interrupted', 100, 250)])
+        self.assertEqual(self.scored(), 100)
+
+        second = FakePerspective()
+        self.assertIn("Resuming job 1 (100/250 rows done)", self.gain(second))
+        self.assertEqual(self.job(), [(1, 'done', 250, 250)])
+        self.assertEqual(self.scored(), 250)
+        self.assertEqual(sorted(first.texts + second.texts), sorted(self.texts))
+
+        # Nothing is left, a new run sends nothing
+        third = FakePerspective()
+        self.gain(third)
+        self.assertEqual(third.texts, [])
+
+    def test_retry_failed(self):
+        """
+        OBJECTIVE: Test that failed texts are skipped by later runs unless asked to retry them
+        """
+        self.gain(FakePerspective(failing={"post 7", "post 180"}))
+        self.assertEqual(self.scored(), 248)
+        self.assertEqual(sorted(self.database.select_data('postID, status', 'dead_letters')), [(7, 400), (180, 400)])
+
+        skipped = FakePerspective()
+        self.gain(skipped)
+        self.assertEqual(skipped.texts, [])
+
+        retried = FakePerspective()
+        self.gain(retried, ["--retry-failed"])
+        self.assertEqual(sorted(retried.texts), ["post 180", "post 7"])
+        self.assertEqual(self.scored(), 250)
+        self.assertEqual(self.database.select_data('COUNT(*)', 'dead_letters'), [(0,)])
+
+    def test_unknown_attribute(self):
+        """
+        OBJECTIVE: Test that a misspelt attribute scores nothing and starts no job
+        """
+        perspective = FakePerspective()
+        output = self.gain(perspective, ["insutl"])
+        self.assertIn("Unknown Perspective attribute: INSUTL", output)
+        self.assertIn("Usage: gain perspective", output)
+        self.assertEqual(perspective.texts, [])
+        self.assertEqual(self.job(), [])
+
+    def test_accounting(self):
+        """
+        OBJECTIVE: Test that a job resumes only with the same command and args, and counts what is left
+        """
+        job = Job(self.database, 'gain', 'perspective TOXICITY')
+        job.start(40)
+        job.advance(15, 14)
+        self.database.commit()
+
+        other = Job(self.database, 'gain', 'perspective INSULT')
+        self.assertFalse(other.resumed)
+        resumed = Job(self.database, 'gain', 'perspective TOXICITY')
+        self.assertTrue(resumed.resumed)
+        self.assertEqual((resumed.job_id, resumed.done, resumed.total), (job.job_id, 15, 40))
+        resumed.start(20)
+        self.assertEqual(resumed.total, 35)
+
+        resumed.finish()
+        self.assertFalse(Job(self.database, 'gain', 'perspective TOXICITY').resumed)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,241 @@
+"""
+This module is used to test the Perspective API key pool
+Clients are replaced by fakes, so no request leaves the machine
+
+Functions being tested:
+    - Perspective._checkout, Perspective._checkin
+    - Perspective.analyze, Perspective.analyze_many, Perspective.analyze_chunks
+    - Perspective._request_with_retry
+"""
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+import preprocessing.perspective as perspective
+
+class FakeResponse():
+    """
+    HTTP response carried by a failed request
+    """
+    def __init__(self, status: int) -> None:
+        self.status = status
+
+class FakeHttpError(Exception):
+    """
+    Error raised by the API client, with the status of its response
+    """
+    def __init__(self, status: int) -> None:
+        super().__init__(f"HTTP {status}")
+        self.resp = FakeResponse(status)
+
+class FakeClient():
+    """
+    Client of one key, answering every attribute with 0.5 or failing with a status or an error
+    """
+    def __init__(self, status: int=None, error: Exception=None) -> None:
+        self.status = status
+        self.error = error
+        self.requests = 0
+        self.active = 0
+        self.most_active = 0
+        self.lock = threading.Lock()
+
+    def comments(self):
+        return self
+
+    def analyze(self, body):
+        self.body = body
+        return self
+
+    def execute(self, http=None):
+        with self.lock:
+            self.requests += 1
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        try:
+            time.sleep(0.005)
+            if self.status:
+                raise FakeHttpError(self.status)
+            if self.error:
+                raise self.error
+            return {"attributeScores": {
+                attribute: {"summaryScore": {"value": 0.5}} for attribute in self.body['requestedAttributes']
+            }}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+class TestKeyPool(unittest.TestCase):
+    """
+    OBJECTIVE: Test that requests are spread over the keys and failing keys are rested
+    """
+    def make_pool(self, clients: list, **kwargs) -> perspective.Perspective:
+        with mock.patch.object(perspective.discovery, 'build', side_effect=clients):
+            return perspective.Perspective([f"key{i}" for i in range(len(clients))], qps=1000.0, **kwargs)
+
+    def test_rotation(self):
+        """
+        OBJECTIVE: Test that checkouts go to the least loaded key and checkins release it
+        """
+        pool = self.make_pool([FakeClient(), FakeClient()])
+        first = pool._checkout()
+        second = pool._checkout()
+        self.assertIsNot(first, second)
+        self.assertEqual([key.in_flight for key in pool.keys], [1, 1])
+
+        pool._checkin(first)
+        self.assertIs(pool._checkout(), first)
+        pool._checkin(first)
+        pool._checkin(second)
+        self.assertEqual([key.in_flight for key in pool.keys], [0, 0])
+
+    def test_cooldown(self):
+        """
+        OBJECTIVE: Test that a key hitting its quota repeatedly is rested, and leaves rotation until the cooldown ends
+        """
+        pool = self.make_pool([FakeClient(), FakeClient()], max_failures=3, cooldown=60.0)
+        rested = pool.keys[0]
+        for _ in range(3):
+            self.assertEqual(rested.cooldown_until, 0.0)
+            rested.in_flight += 1 # as if checked out for a request that hits the quota
+            pool._checkin(rested, quota_error=True)
+        self.assertEqual(rested.in_flight, 0)
+        self.assertGreater(rested.cooldown_until, time.monotonic())
+        self.assertEqual(rested.failures, 0)
+
+        keys = [pool._checkout() for _ in range(5)]
+        self.assertTrue(all(key is pool.keys[1] for key in keys))
+
+        rested.cooldown_until = time.monotonic()
+        self.assertIs(pool._checkout(), rested)
+
+    def test_failover(self):
+        """
+        OBJECTIVE: Test that the requests of a key over its quota move to the other key
+        """
+        failing, healthy = FakeClient(status=429), FakeClient()
+        pool = self.make_pool([failing, healthy], max_failures=1, cooldown=60.0)
+        with mock.patch.object(perspective, 'backoff_delay', return_value=0.0):
+            for _ in range(10):
+                self.assertEqual(pool.analyze("some text", "TOXICITY"), {"TOXICITY": 0.5})
+
+        self.assertEqual(failing.requests, 1)
+        self.assertEqual(healthy.requests, 10)
+        self.assertGreater(pool.keys[0].cooldown_until, time.monotonic())
+        self.assertEqual([key.in_flight for key in pool.keys], [0, 0])
+
+    def test_success_resets_failures(self):
+        """
+        OBJECTIVE: Test that only consecutive quota errors count towards a cooldown
+        """
+        pool = self.make_pool([FakeClient()], max_failures=2)
+        key = pool._checkout()
+        pool._checkin(key, quota_error=True)
+        self.assertEqual(key.failures, 1)
+        pool._checkout()
+        pool._checkin(key)
+        self.assertEqual(key.failures, 0)
+        self.assertEqual(key.cooldown_until, 0.0)
+
+    def test_in_flight(self):
+        """
+        OBJECTIVE: Test that concurrent requests use every key and are all checked back in, failed ones included
+        """
+        clients = [FakeClient(), FakeClient(), FakeClient(status=400)]
+        pool = self.make_pool(clients, workers=4)
+        results = pool.analyze_many([f"text {i}" for i in range(60)], "TOXICITY", return_exceptions=True)
+
+        failed = [result for result in results if isinstance(result, perspective.PerspectiveError)]
+        self.assertEqual(len(failed), clients[2].requests)
+        self.assertTrue(all(client.requests > 0 for client in clients))
+        self.assertGreater(max(client.most_active for client in clients), 1)
+        self.assertEqual([key.in_flight for key in pool.keys], [0, 0, 0])
+
+class TestChunks(unittest.TestCase):
+    """
+    OBJECTIVE: Test that a stream of chunks keeps the keys busy with one thread pool
+    """
+    def test_ahead(self):
+        """
+        OBJECTIVE: Test that the next chunk is scored while the caller holds the current one
+        """
+        client = FakeClient()
+        with mock.patch.object(perspective.discovery, 'build', return_value=client):
+            pool = perspective.Perspective("key", qps=1000.0, workers=4)
+        chunks = [[(i, f"text {i}") for i in range(start, start + 20)] for start in range(0, 100, 20)]
+        scored = pool.analyze_chunks(chunks, "TOXICITY", text=lambda row: row[1])
+
+        chunk, results = next(scored)
+        self.assertEqual((chunk, results), (chunks[0], [{"TOXICITY": 0.5}] * 20))
+        deadline = time.monotonic() + 5.0
+        while client.requests < 40 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(client.requests, 40)
+
+        self.assertEqual([chunk for chunk, _ in scored], chunks[1:])
+        self.assertEqual(client.requests, 100)
+
+    def test_one_pool(self):
+        """
+        OBJECTIVE: Test that threads and their connections are kept from one call to the next
+        """
+        with mock.patch.object(perspective.discovery, 'build', return_value=FakeClient()):
+            pool = perspective.Perspective("key", qps=1000.0, workers=3)
+        with mock.patch.object(perspective.httplib2, 'Http') as http:
+            for start in range(0, 200, 20):
+                pool.analyze_many([f"text {i}" for i in range(start, start + 20)], "TOXICITY")
+            list(pool.analyze_chunks([["more text"] * 20] * 5, "TOXICITY"))
+        self.assertLessEqual(http.call_count, 3)
+
+    def test_interrupted(self):
+        """
+        OBJECTIVE: Test that closing the stream early drops the requests of the chunk sent ahead
+        """
+        client = FakeClient()
+        with mock.patch.object(perspective.discovery, 'build', return_value=client):
+            pool = perspective.Perspective("key", qps=1000.0, workers=1)
+        scored = pool.analyze_chunks([[f"text {i}"] * 50 for i in range(10)], "TOXICITY")
+        next(scored)
+        scored.close()
+        time.sleep(0.1)
+        self.assertLess(client.requests, 100)
+
+class TestRetry(unittest.TestCase):
+    """
+    OBJECTIVE: Test that only transient failures are retried
+    """
+    def make_pool(self, client: FakeClient) -> perspective.Perspective:
+        with mock.patch.object(perspective.discovery, 'build', return_value=client):
+            return perspective.Perspective("key", qps=1000.0, max_retries=3)
+
+    def test_network_error(self):
+        """
+        OBJECTIVE: Test that network errors are retried until the retries run out
+        """
+        for error in (ConnectionResetError("reset"), TimeoutError("timed out"), perspective.httplib2.ServerNotFoundError("dns")):
+            client = FakeClient(error=error)
+            pool = self.make_pool(client)
+            with mock.patch.object(perspective, 'backoff_delay', return_value=0.0):
+                with self.assertRaises(perspective.PerspectiveError) as raised:
+                    pool.analyze("some text")
+            self.assertEqual(client.requests, 4)
+            self.assertEqual(raised.exception.attempts, 4)
+            self.assertIsNone(raised.exception.status)
+
+    def test_permanent_error(self):
+        """
+        OBJECTIVE: Test that bad requests and bugs fail on the first attempt, with the key checked back in
+        """
+        for client, error in ((FakeClient(status=400), perspective.PerspectiveError),
+                              (FakeClient(error=TypeError("bug")), TypeError)):
+            pool = self.make_pool(client)
+            with mock.patch.object(perspective, 'backoff_delay', return_value=0.0):
+                with self.assertRaises(error):
+                    pool.analyze("some text")
+            self.assertEqual(client.requests, 1)
+            self.assertEqual(pool.keys[0].in_flight, 0)
+
+if __name__ == "__main__":
+    unittest.main()
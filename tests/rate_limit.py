@@ -0,0 +1,87 @@
+"""
+This module is used to test the rate limiting helpers
+used by the API wrappers
+"""
+
+import bisect
+import time
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+from util.rate_limit import AdaptiveRateLimiter, TokenBucket, backoff_delay
+
+class TestTokenBucket(unittest.TestCase):
+    """
+    Test the TokenBucket class
+    """
+    def test_burst(self):
+        """
+        OBJECTIVE: Test that a full bucket does not wait
+        """
+        bucket = TokenBucket(1.0, capacity=3)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertGreater(bucket.reserve(), 0.0)
+
+    def test_rate(self):
+        """
+        OBJECTIVE: Test that concurrent callers are held to the configured rate
+        """
+        bucket = TokenBucket(50.0)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: bucket.acquire(), range(26)))
+        # First token is free, the other 25 take 0.5 seconds at 50 QPS
+        self.assertGreaterEqual(time.monotonic() - start, 0.45)
+
+    def test_window(self):
+        """
+        OBJECTIVE: Test that a bucket sized for a window never allows more than its quota in any window
+        """
+        clock = [1000.0]
+        with mock.patch.object(time, 'monotonic', lambda: clock[0]):
+            bucket = TokenBucket.for_window(180, 900)
+            granted = []
+            for _ in range(1000):
+                clock[0] += bucket.reserve()
+                granted.append(clock[0])
+        # Greedy callers, the busiest windows start at a request
+        self.assertTrue(all(bisect.bisect_left(granted, start + 900) - index <= 180
+                            for index, start in enumerate(granted)))
+        self.assertGreaterEqual(bisect.bisect_left(granted, granted[0] + 900), 170)
+
+    def test_invalid_rate(self):
+        """
+        OBJECTIVE: Test that a non-positive rate is rejected
+        """
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+    """
+    Test the AdaptiveRateLimiter class and backoff helper
+    """
+    def test_aimd(self):
+        """
+        OBJECTIVE: Test that throttling halves the rate and successes raise it back
+        """
+        limiter = AdaptiveRateLimiter(10.0)
+        limiter.on_throttle()
+        self.assertAlmostEqual(limiter.rate, 5.0)
+
+        # A second failure in the same second does not cut again
+        limiter.on_throttle()
+        self.assertAlmostEqual(limiter.rate, 5.0)
+
+        for _ in range(1000):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 10.0)
+
+    def test_backoff_delay(self):
+        """
+        OBJECTIVE: Test that backoff delays stay under the exponential ceiling and the cap
+        """
+        for attempt in range(10):
+            self.assertLessEqual(backoff_delay(attempt, base=1.0, cap=30.0), min(30.0, 2 ** attempt))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+This module is used to test the persistent cache of Perspective scores
+Clients are replaced by fakes, so no request leaves the machine
+
+Functions being tested:
+    - ScoreCache.get, ScoreCache.put, ScoreCache.flush
+    - Perspective.analyze, Perspective.analyze_many with a cache
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import preprocessing.perspective as perspective
+import preprocessing.score_cache as score_cache
+from tests.key_pool import FakeClient
+
+class TestScoreCache(unittest.TestCase):
+    """
+    OBJECTIVE: Test that cached scores are served without requests and evicted least recently used first
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "score_cache.db")
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.connector.close()
+        self.directory.cleanup()
+
+    def make_cache(self, **kwargs) -> score_cache.ScoreCache:
+        cache = score_cache.ScoreCache(self.path, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def make_pool(self, client: FakeClient, cache: score_cache.ScoreCache) -> perspective.Perspective:
+        with mock.patch.object(perspective.discovery, 'build', return_value=client):
+            return perspective.Perspective("key", qps=1000.0, cache=cache)
+
+    def test_hit(self):
+        """
+        OBJECTIVE: Test that scoring the same texts again sends no request
+        """
+        client = FakeClient()
+        pool = self.make_pool(client, self.make_cache())
+        texts = ["first text", "second text", "first text"]
+        pool.analyze_many(texts[:2], "TOXICITY,INSULT")
+        self.assertEqual(client.requests, 2)
+
+        results = pool.analyze_many(texts, "TOXICITY,INSULT")
+        self.assertEqual(client.requests, 2)
+        self.assertEqual(results, [{"TOXICITY": 0.5, "INSULT": 0.5}] * 3)
+        self.assertEqual(pool.cache.stats(), {"hits": 6, "misses": 4, "size": 4})
+
+    def test_partial_hit(self):
+        """
+        OBJECTIVE: Test that only the attributes missing from the cache are requested
+        """
+        client = FakeClient()
+        pool = self.make_pool(client, self.make_cache())
+        pool.analyze("some text", "TOXICITY")
+        self.assertEqual(pool.analyze("some text", "TOXICITY,THREAT"), {"TOXICITY": 0.5, "THREAT": 0.5})
+        self.assertEqual(client.requests, 2)
+        self.assertEqual(list(client.body['requestedAttributes']), ["THREAT"])
+
+    def test_model_version(self):
+        """
+        OBJECTIVE: Test that scores of another model version are not served
+        """
+        self.make_cache(model_version="v1").put("some text", {"TOXICITY": 0.1})
+        self.assertEqual(self.make_cache(model_version="v2").get("some text", ("TOXICITY",)), {})
+        self.assertEqual(self.make_cache(model_version="v1").get("some text", ("TOXICITY",)), {"TOXICITY": 0.1})
+
+    def test_recent_hits_do_not_write(self):
+        """
+        OBJECTIVE: Test that hits on recently used scores leave the database untouched
+        """
+        cache = self.make_cache()
+        cache.put("some text", {"TOXICITY": 0.1})
+        changes = cache.connector.total_changes
+        for _ in range(10):
+            cache.get("some text", ("TOXICITY",))
+        cache.flush()
+        self.assertEqual(cache.connector.total_changes, changes)
+
+    def test_eviction(self):
+        """
+        OBJECTIVE: Test that the least recently used scores are evicted past max_entries
+        """
+        cache = self.make_cache(max_entries=3, touch_interval=5.0)
+        with mock.patch.object(score_cache.time, 'time') as clock:
+            for now, text in enumerate(["a", "b", "c", "d"]):
+                clock.return_value = float(now)
+                cache.put(text, {"TOXICITY": now / 10})
+            # "a" is used again, so "b" is now the least recently used
+            clock.return_value = 10.0
+            cache.get("a", ("TOXICITY",))
+            cache.flush()
+        with cache._lock:
+            cache._evict()
+        remaining = [text for text in ["a", "b", "c", "d"] if cache.get(text, ("TOXICITY",))]
+        self.assertEqual(remaining, ["a", "c", "d"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+"""
+This module holds the test case shared by the tests needing a database
+Every test gets a new database in a temporary directory, set up as the tool does
+"""
+
+import os
+import tempfile
+import unittest
+
+from util.configuration import Configuration
+
+class TempDatabaseTestCase(unittest.TestCase):
+    """
+    Runs every test in a temporary directory holding a new database
+
+    Attributes:
+        database: Database
+            The database of the test, tables created by Configuration.setup_database
+    """
+    def setUp(self):
+        # The database lives under the working directory, so every test gets its own
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        os.makedirs(os.path.join("src", "data"))
+        configuration = Configuration()
+        configuration.setup_database()
+        self.database = configuration.ctx['database']
+
+    def tearDown(self):
+        self.database.connector.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
@@ -0,0 +1,85 @@
+"""
+This module is used to test the text distance measures
+
+Functions being tested:
+    - similarity_blocks
+    - top_k_similar
+    - levenshtein_distance, levenshtein_many
+"""
+
+import random
+import unittest
+
+import analysis.text as text
+
+class TestSimilarityMatrix(unittest.TestCase):
+    """
+    OBJECTIVE: Test that the batch similarities match the pairwise functions
+    """
+    def setUp(self):
+        generator = random.Random(1)
+        vocabulary = [f"word{i}" for i in range(300)]
+        self.texts = [' '.join(generator.choices(vocabulary, k=generator.randint(1, 15))) for _ in range(120)]
+
+    def test_blocks_match_pairwise(self):
+        """
+        OBJECTIVE: Test cosine and jaccard blocks against cosine_similarity and jaccard_distance
+        """
+        others = self.texts[80:]
+        for metric, pairwise in (('cosine', text.cosine_similarity), ('jaccard', text.jaccard_distance)):
+            for start, block in text.similarity_blocks(self.texts[:80], others, metric, chunk_size=32):
+                block = block.toarray()
+                for row in range(block.shape[0]):
+                    for column, other in enumerate(others):
+                        self.assertAlmostEqual(block[row, column], pairwise(self.texts[start + row], other), places=6)
+
+    def test_top_k(self):
+        """
+        OBJECTIVE: Test that top_k_similar finds the same neighbours as a brute force search
+        """
+        neighbours, scores = text.top_k_similar(self.texts, k=3, chunk_size=50)
+        for row, query in enumerate(self.texts):
+            expected = sorted(
+                ((text.cosine_similarity(query, other), column)
+                 for column, other in enumerate(self.texts) if column != row),
+                key=lambda pair: (-pair[0], pair[1]))[:3]
+            for (score, column), neighbour, found in zip(expected, neighbours[row], scores[row]):
+                if score == 0:
+                    self.assertEqual(neighbour, -1)
+                    continue
+                self.assertAlmostEqual(found, score, places=6)
+
+def edit_distance(text1: str, text2: str) -> int:
+    """
+    Textbook Levenshtein Distance, the reference for the fast implementation
+    """
+    previous = list(range(len(text2) + 1))
+    for i, character1 in enumerate(text1, 1):
+        current = [i]
+        for j, character2 in enumerate(text2, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (character1 != character2)))
+        previous = current
+    return previous[-1]
+
+class TestLevenshtein(unittest.TestCase):
+    """
+    OBJECTIVE: Test the bounded and batch Levenshtein Distance
+    """
+    def test_matches_reference(self):
+        """
+        OBJECTIVE: Test exact, bounded and batch distances against the textbook algorithm
+        """
+        generator = random.Random(3)
+        texts = [''.join(generator.choices("abcd ", k=generator.randint(0, 30))) for _ in range(60)]
+        texts += ["kitten", "sitting", "", "a" * 80]
+        for text1 in texts:
+            expected = [edit_distance(text1, text2) for text2 in texts]
+            self.assertEqual([text.levenshtein_distance(text1, text2) for text2 in texts], expected)
+            self.assertEqual(text.levenshtein_many(text1, texts), expected)
+            for bound in (0, 3, 10):
+                bounded = [distance if distance <= bound else bound + 1 for distance in expected]
+                self.assertEqual(text.levenshtein_many(text1, texts, bound), bounded)
+                self.assertEqual([text.levenshtein_distance(text1, text2, bound) for text2 in texts], bounded)
+
+if __name__ == "__main__":
+    unittest.main()
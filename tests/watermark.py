@@ -0,0 +1,142 @@
+"""
+This module is used to test the incremental collection of tweets
+
+Functions being tested:
+    - Twitter.get_tweets
+    - Watermark
+    - to_record
+    - Parser.get storing the tweet metadata, and its columns added to older databases
+"""
+
+import io
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import collection.twitter as twitter
+from util.configuration import Configuration
+from util.parser import Parser
+from tests.temp_database import TempDatabaseTestCase
+
+class FakeTwitter():
+    """
+    Search results over a timeline of tweet ids, newest first, as the search API returns them
+    """
+    get_tweets = twitter.Twitter.get_tweets
+
+    def __init__(self, ids: list) -> None:
+        self.ids = list(ids)
+
+    def search(self, query: str, count: int, since_id: int=None, max_id: int=None):
+        matches = sorted((
+            tweet_id for tweet_id in self.ids
+            if (since_id is None or tweet_id > since_id) and (max_id is None or tweet_id <= max_id)
+        ), reverse=True)[:count]
+        return (SimpleNamespace(
+            id=tweet_id,
+            text=f"tweet {tweet_id}",
+            created_at=datetime.fromtimestamp(tweet_id, timezone.utc),
+            user=SimpleNamespace(id=tweet_id % 7, name="someone"),
+            lang="en",
+        ) for tweet_id in matches)
+
+def covered(watermark: twitter.Watermark) -> set:
+    """
+    The ids of a timeline the watermark claims are collected
+    """
+    ids = set(range(watermark.max_id, watermark.since_id + 1))
+    if watermark.pending_since_id is not None:
+        ids |= set(range(watermark.pending_max_id, watermark.pending_since_id + 1))
+    return ids
+
+class TestWatermark(unittest.TestCase):
+    """
+    OBJECTIVE: Test that runs stopped by their count never skip a tweet
+    """
+    def test_gap_is_filled(self):
+        """
+        OBJECTIVE: Test that newer tweets collected above a gap leave since_id until the gap is closed
+        """
+        api = FakeTwitter(range(1, 1001))
+        watermark = twitter.Watermark()
+        collected = [tweet.id for tweet in api.get_tweets("query", 100, watermark)]
+        self.assertEqual(collected, list(range(1000, 900, -1)))
+        self.assertEqual(watermark, twitter.Watermark(1000, 901))
+
+        # 300 new tweets, the run stops before reaching since_id
+        api.ids += range(1001, 1301)
+        collected += [tweet.id for tweet in api.get_tweets("query", 100, watermark)]
+        self.assertEqual(watermark, twitter.Watermark(1000, 901, 1300, 1201))
+
+        collected += [tweet.id for tweet in api.get_tweets("query", 150, watermark)]
+        self.assertEqual(watermark, twitter.Watermark(1000, 901, 1300, 1051))
+
+        # The gap closes, then the newest tweets and older ones are fetched
+        api.ids += range(1301, 1311)
+        collected += [tweet.id for tweet in api.get_tweets("query", 500, watermark)]
+        self.assertEqual(watermark, twitter.Watermark(1310, 461))
+
+        self.assertEqual(len(collected), len(set(collected)))
+        self.assertEqual(set(collected), covered(watermark))
+
+    def test_interrupted(self):
+        """
+        OBJECTIVE: Test that a copy taken after any tweet covers exactly the tweets received
+        """
+        api = FakeTwitter(range(1, 501))
+        watermark = twitter.Watermark(200, 101)
+        received = {tweet_id for tweet_id in range(101, 201)}
+        for tweet in api.get_tweets("query", 250, watermark):
+            received.add(tweet.id)
+            self.assertEqual(covered(watermark.copy()), received)
+            if len(received) == 100 + 180:
+                break
+        # The run stopped with the gap above 200 still open
+        self.assertEqual(watermark.since_id, 200)
+        self.assertEqual(watermark.pending_max_id, 321)
+
+class TestTweetRecord(TempDatabaseTestCase):
+    """
+    OBJECTIVE: Test that only the stored fields of a tweet are kept, and stored in unprocessed
+    """
+    def test_to_record(self):
+        """
+        OBJECTIVE: Test that a Status becomes a TweetRecord, missing fields left empty
+        """
+        status = SimpleNamespace(
+            id=5, text="truncated…", full_text="the full text",
+            created_at=datetime(2018, 10, 10, 20, 19, 24, tzinfo=timezone.utc),
+            user=SimpleNamespace(id=42), lang="fr", entities={"urls": []})
+        self.assertEqual(twitter.to_record(status),
+                         twitter.TweetRecord(5, "the full text", "2018-10-10T20:19:24+00:00", 42, "fr"))
+        self.assertEqual(twitter.to_record(SimpleNamespace(id=6, text="bare")),
+                         twitter.TweetRecord(6, "bare", None, None, None))
+
+    def test_get(self):
+        """
+        OBJECTIVE: Test that get stores the metadata of every tweet
+        """
+        api = FakeTwitter(range(1, 251))
+        with redirect_stdout(io.StringIO()):
+            collected = Parser({'database': self.database, 'twitter': api}).get(["gaming", "query", "--c", "150"])
+        self.assertEqual(collected, 150)
+        rows = self.database.select_data('community, postID, data, createdAt, authorID, lang', 'unprocessed', 'postID = 250')
+        self.assertEqual(rows, [("gaming", 250, "tweet 250", "1970-01-01T00:04:10+00:00", 250 % 7, "en")])
+
+    def test_upgrade(self):
+        """
+        OBJECTIVE: Test that a database created before the metadata columns gets them, keeping its rows
+        """
+        self.database.custom_query("DROP TABLE unprocessed")
+        self.database.create_table("unprocessed", "community TEXT, postID int, data TEXT, PRIMARY KEY (postID)")
+        self.database.insert_many('unprocessed', ['community', 'postID', 'data'], [("gaming", 1, "old tweet")])
+        self.database.commit()
+
+        Configuration().setup_database()
+        self.assertEqual(self.database.table_columns("unprocessed"),
+                         ["community", "postID", "data", "createdAt", "authorID", "lang"])
+        self.assertEqual(self.database.select_data('*', 'unprocessed'), [("gaming", 1, "old tweet", None, None, None)])
+
+if __name__ == "__main__":
+    unittest.main()